@@ -0,0 +1,305 @@
+# ======================================================
+# bench_matchmaking.py - Benchmark matchmaker dengan populasi sintetis
+# ======================================================
+# Contoh:
+#   python bench_matchmaking.py
+#   python bench_matchmaking.py --sizes 10,1000,10000 --probes 500 --seed 7
+#
+# Untuk setiap ukuran antrean: antrean diisi N pengguna sintetis lewat
+# Matchmaker.seed (setiap pengguna dinilai terhadap SEED_WINDOW pengguna
+# sebelumnya dengan batas K kandidat per entri, belum dipasangkan), lalu
+# sejumlah "probe" menjalankan jalur /search yang sama dengan bot (baca
+# profil -> make_queue_item -> submit -> try_match_users) terhadap SQLite
+# in-memory dan bot tiruan. Yang dilaporkan: latensi per pencarian
+# (p50/p95/p99), pasangan dinilai per detik, panjang heap, serta memori
+# (akhir dan puncak) sepanjang pengisian dan probe. Dengan --offload, pendatang
+# baru di antrean besar dinilai di ProcessPoolExecutor seperti di bot; kolom
+# "maks ms" (putaran terlama di event loop) dan "cakupan" menunjukkan efeknya. tracemalloc ikut
+# memperlambat probe dan pengisian; pakai --no-memory untuk latensi tanpa
+# overhead itu (ukuran bawaan 10..50k: beberapa menit, jauh lebih lama dengan
+# tracemalloc).
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+from datetime import datetime, timezone, timedelta
+from types import SimpleNamespace
+
+import aiosqlite
+
+import bot
+from matchmaking import (
+    SEED_WINDOW, InterestRegistry, Matchmaker, MatchStats, QueueEntry, RecentPairs,
+    calculate_match_score, np, score_entries, score_matrix,
+)
+
+# Pengisian berbiaya O(N * SEED_WINDOW), jadi 50k tetap selesai dalam hitungan menit
+DEFAULT_SIZES = (10, 100, 1000, 5000, 20000, 50000)
+
+# (nama, lat, lon, bobot populasi)
+CITIES = [
+    ("Jakarta", -6.2088, 106.8456, 30),
+    ("Surabaya", -7.2575, 112.7521, 12),
+    ("Bandung", -6.9175, 107.6191, 10),
+    ("Medan", 3.5952, 98.6722, 8),
+    ("Semarang", -6.9667, 110.4167, 6),
+    ("Makassar", -5.1477, 119.4327, 5),
+    ("Palembang", -2.9761, 104.7754, 5),
+    ("Yogyakarta", -7.7956, 110.3695, 5),
+    ("Denpasar", -8.6705, 115.2126, 4),
+    ("Balikpapan", -1.2379, 116.8529, 3),
+    ("Pontianak", -0.0263, 109.3425, 3),
+    ("Manado", 1.4748, 124.8421, 2),
+    ("Jayapura", -2.5337, 140.7181, 1),
+]
+
+# Popularitas minat bawaan (urutan sama dengan bot.COMMON_INTERESTS)
+INTEREST_WEIGHTS = [14, 13, 12, 9, 8, 10, 5, 6, 4, 5, 9, 3, 6, 4, 3]
+MANUAL_INTERESTS = ["anime", "kpop", "coding", "memasak", "otomotif", "catur", "hiking", "desain", "podcast", "kopi"]
+
+BIOS = ["Halo!", "Suka ngobrol santai", "Cari teman baru", "Mahasiswa", "Pekerja kantoran", "Random aja"]
+
+BASE_USER_ID = 1_000_000
+
+
+# =============================
+# POPULASI SINTETIS
+# =============================
+
+def make_profile(rng: random.Random, user_id: int, premium_rate: float) -> dict:
+    """Satu baris user_profiles yang sudah siap /search (gender dan usia terisi)."""
+    gender = "Laki-laki" if rng.random() < 0.55 else "Perempuan"
+    age = min(60, max(15, int(rng.gauss(23, 6))))
+    karma = min(300, max(0, int(rng.gauss(100, 25))))
+
+    latitude = longitude = None
+    if rng.random() < 0.7:
+        _, lat, lon, _ = rng.choices(CITIES, weights=[c[3] for c in CITIES])[0]
+        latitude, longitude = lat + rng.gauss(0, 0.15), lon + rng.gauss(0, 0.15)
+
+    interests = set()
+    for _ in range(rng.choice([0, 1, 2, 2, 3, 3, 4, 5])):
+        interests.add(rng.choices(bot.COMMON_INTERESTS, weights=INTEREST_WEIGHTS)[0].lower())
+    if rng.random() < 0.1:
+        interests.add(rng.choice(MANUAL_INTERESTS))
+
+    profile = {
+        'user_id': user_id, 'username': f"user{user_id}", 'gender': gender, 'age': age, 'bio': rng.choice(BIOS),
+        'koin': 0, 'pro_expires_at': None, 'karma': karma, 'profile_pic_id': None,
+        'interests': ",".join(sorted(interests)) or None, 'latitude': latitude, 'longitude': longitude,
+        'filter_gender': None, 'filter_age_min': None, 'filter_age_max': None,
+        'filter_interests': None, 'filter_distance_km': None,
+    }
+    if rng.random() < premium_rate:
+        profile['pro_expires_at'] = (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
+        profile['filter_gender'] = rng.choices(['opposite', 'same', None], weights=[6, 1, 3])[0]
+        if rng.random() < 0.6:
+            profile['filter_age_min'] = max(15, age - rng.randint(2, 6))
+            profile['filter_age_max'] = age + rng.randint(2, 8)
+        if latitude is not None and rng.random() < 0.5:
+            profile['filter_distance_km'] = rng.choice([10, 25, 50, 100])
+    return profile
+
+def make_population(n: int, seed: int, premium_rate: float = 0.2, blocks_per_user: float = 0.5):
+    """Profil dan sisi blokir (blocker_id, blocked_id) yang deterministik untuk `seed`."""
+    rng = random.Random(seed)
+    profiles = [make_profile(rng, BASE_USER_ID + i, premium_rate) for i in range(n)]
+    blocks = set()
+    for _ in range(int(n * blocks_per_user)):
+        a, b = rng.randrange(n), rng.randrange(n)
+        if a != b:
+            blocks.add((BASE_USER_ID + a, BASE_USER_ID + b))
+    return profiles, sorted(blocks)
+
+
+# =============================
+# BOT TIRUAN
+# =============================
+
+class StubBot:
+    """Menggantikan telegram.Bot: hanya menghitung pesan yang akan dikirim."""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, *args, **kwargs):
+        self.sent += 1
+
+    async def send_photo(self, *args, **kwargs):
+        self.sent += 1
+
+class StubJobQueue:
+    def get_jobs_by_name(self, name):
+        return ()
+
+    def run_once(self, *args, **kwargs):
+        return None
+
+async def no_geocode(lat, lon):
+    return "Kota Sintetis"
+
+async def make_context(profiles: list, blocks: list, executor=None):
+    db = await aiosqlite.connect(":memory:")
+    await bot.init_db(db)
+    columns = list(profiles[0].keys())
+    await db.executemany(
+        f"INSERT INTO user_profiles ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [tuple(p[c] for c in columns) for p in profiles],
+    )
+    await db.executemany("INSERT INTO blocks (blocker_id, blocked_id) VALUES (?, ?)", blocks)
+    await bot.migrate_interests(db)
+    await db.commit()
+    writes = bot.WriteQueue(db, bot.WRITE_BATCH_MS, bot.WRITE_BATCH_MAX)
+    writes.start()
+
+    # Notifikasi match berjalan di task latar; ditunggu sebelum database ditutup
+    background_tasks = []
+    application = SimpleNamespace(
+        db_connection=db, db_readers=db, db_writes=writes,
+        profile_cache=bot.ProfileCache(bot.PROFILE_CACHE_SIZE, bot.PROFILE_CACHE_TTL_SECONDS),
+        known_users=await bot.load_known_users(db),
+        session_ids=await bot.IdAllocator(writes, 'chat_sessions', bot.SESSION_ID_BLOCK).start(),
+        block_index=await bot.load_block_index(db),
+        interest_index=await bot.load_interest_index(db),
+        match_stats=MatchStats(), match_executor=executor, match_offload=None, recent_pairs=RecentPairs(bot.REMATCH_WINDOW_SECONDS),
+        bot_data={}, user_data={}, bot=StubBot(),
+        create_task=lambda coro: background_tasks.append(asyncio.ensure_future(coro)),
+        background_tasks=background_tasks,
+    )
+    return SimpleNamespace(
+        application=application, bot_data=application.bot_data, bot=application.bot,
+        job_queue=StubJobQueue(), user_data={},
+    )
+
+
+# =============================
+# BENCHMARK
+# =============================
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+async def search(context, user_id: int) -> bool:
+    """Jalur /search tanpa I/O Telegram. True jika pengguna langsung dapat pasangan."""
+    profile = await bot.get_profile(context, user_id)
+    entry = bot.make_queue_item(context, user_id, profile, await bot.is_user_pro(context, user_id))
+    bot.get_matchmaker(context).submit(entry)
+    await bot.try_match_users(context)
+    return user_id in context.bot_data.get('chat_partners', {})
+
+async def bench_size(size: int, args) -> dict:
+    profiles, blocks = make_population(size + args.probes, args.seed, args.premium_rate, args.blocks_per_user)
+    context = await make_context(profiles, blocks, args.executor)
+
+    # Isi antrean dengan entri yang dibuat seperti di bot; di bawah SEED_WINDOW
+    # hasilnya sama dengan submit + flush, di atasnya setiap entri hanya dinilai
+    # terhadap jendela pengguna sebelumnya, jadi heap tetap berisi K kandidat per entri.
+    matchmaker = context.bot_data['matchmaker'] = Matchmaker()
+    if not args.no_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    matchmaker.seed(
+        (bot.make_queue_item(context, p['user_id'], p, p['pro_expires_at'] is not None) for p in profiles[:size]),
+        exclude_for=bot.get_block_index(context).neighbours, window=args.seed_window,
+    )
+    prefill_seconds = time.perf_counter() - started
+
+    latencies, matched = [], 0
+    scored_before = matchmaker.pairs_scored
+    try:
+        for profile in profiles[size:]:
+            started = time.perf_counter()
+            matched += await search(context, profile['user_id'])
+            latencies.append(time.perf_counter() - started)
+        await asyncio.gather(*context.application.background_tasks)
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    finally:
+        tracemalloc.stop()
+        await context.application.db_writes.stop()
+        await context.application.db_connection.close()
+    probe_seconds = sum(latencies)
+    return {
+        'size': size,
+        'prefill_s': prefill_seconds,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'pairs_per_s': (matchmaker.pairs_scored - scored_before) / probe_seconds if probe_seconds else 0.0,
+        'matched': matched,
+        'queue_after': len(matchmaker),
+        'heap': matchmaker.heap_size,
+        'budget_hits': bot.get_match_stats(context).budget_hits,
+        'max_pass_ms': bot.get_match_stats(context).max_pass_ms,
+        'coverage': bot.get_match_stats(context).avg_coverage,
+        'current_mb': current / 2**20,
+        'peak_mb': peak / 2**20,
+    }
+
+def bench_scorers(n_pairs: int, seed: int) -> dict:
+    """Pasangan dinilai per detik untuk tiap implementasi skor."""
+    profiles, _ = make_population(512, seed)
+    items = [
+        {'user_id': p['user_id'], 'use_filters': p['pro_expires_at'] is not None, 'profile': p}
+        for p in profiles
+    ]
+    registry = InterestRegistry(bot.COMMON_INTERESTS)
+    entries = [QueueEntry.from_item(item, registry) for item in items]
+    rng = random.Random(seed)
+    pairs = [(rng.randrange(len(items)), rng.randrange(len(items))) for _ in range(n_pairs)]
+
+    results = {}
+    started = time.perf_counter()
+    for i, j in pairs:
+        calculate_match_score(items[i], items[j])
+    results['calculate_match_score'] = n_pairs / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for i, j in pairs:
+        score_entries(entries[i], entries[j])
+    results['score_entries'] = n_pairs / (time.perf_counter() - started)
+
+    if np is not None:
+        started = time.perf_counter()
+        score_matrix(entries)
+        results['score_matrix'] = len(entries) ** 2 / (time.perf_counter() - started)
+    return results
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark matchmaker bot.py dengan populasi sintetis")
+    parser.add_argument('--sizes', default=",".join(map(str, DEFAULT_SIZES)), help="ukuran antrean, dipisah koma")
+    parser.add_argument('--probes', type=int, default=200, help="jumlah /search yang diukur per ukuran")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--premium-rate', type=float, default=0.2)
+    parser.add_argument('--blocks-per-user', type=float, default=0.5)
+    parser.add_argument('--no-memory', action='store_true', help="tanpa tracemalloc, latensi probe lebih akurat")
+    parser.add_argument('--seed-window', type=int, default=SEED_WINDOW, help="jendela penilaian saat pengisian antrean")
+    parser.add_argument('--offload', action='store_true', help="nilai pendatang baru di proses worker seperti bot")
+    parser.add_argument('--score-pairs', type=int, default=50000, help="jumlah pasangan untuk benchmark fungsi skor")
+    args = parser.parse_args()
+
+    bot.get_city_from_coords = no_geocode  # tanpa panggilan jaringan ke Nominatim
+    bot.logger.disabled = True
+
+    print("Fungsi skor (pasangan/detik):")
+    for name, rate in bench_scorers(args.score_pairs, args.seed).items():
+        print(f"  {name:<22} {rate:>14,.0f}")
+
+    args.executor = bot.make_match_executor() if args.offload else None
+    print()
+    print(f"{'antrean':>8} {'isi (s)':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'pasangan/s':>12} {'cocok':>6} {'sisa':>7} {'heap':>9} {'budget':>7} {'maks ms':>8} {'cakupan':>8} {'akhir MB':>9} {'puncak MB':>10}")
+    try:
+        for size in (int(s) for s in args.sizes.split(',') if s):
+            r = await bench_size(size, args)
+            print(
+                f"{r['size']:>8} {r['prefill_s']:>8.2f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                f"{r['pairs_per_s']:>12,.0f} {r['matched']:>6} {r['queue_after']:>7} {r['heap']:>9} {r['budget_hits']:>7} "
+                f"{r['max_pass_ms']:>8.2f} {r['coverage']:>8.1%} {r['current_mb']:>9.1f} {r['peak_mb']:>10.1f}"
+            )
+    finally:
+        if args.executor is not None:
+            args.executor.shutdown(cancel_futures=True)
+
+if __name__ == '__main__':
+    asyncio.run(main())
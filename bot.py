@@ -12,10 +12,19 @@ import subprocess
 import os
 import signal
 import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone, timedelta
 from typing import Optional, List
-from math import radians, cos, sin, asin, sqrt
 
+from matchmaking import (
+    BlockIndex, FindIndex, InterestIndex, Matchmaker, MatchStats, QueueEntry, RecentPairs,
+    haversine_distance, score_offloaded,
+)
+from outbound import BULK_RATE_LIMIT_ARGS, MediaGroup, MediaGroupBuffer, OutboundScheduler, RelayQueues, TypingThrottle
+from updates import UserOrderedUpdateProcessor
+from database import PROFILE_SELECT, Database, IdAllocator, ProfileCache, ProfileRecord, ReaderPool, WriteQueue
 
 from telegram import (
     Update,
@@ -47,6 +56,47 @@ BOT_TOKEN = "7872111732:AAEbwXGvPVvHZHGSexGDzQRhBu3Axr0cWBQ"
 OWNER_ID = 5361605327
 DEVELOPER_CHAT_ID = OWNER_ID 
 
+# Matchmaker berjalan sebagai satu task latar; kedatangan dikumpulkan selama satu tick
+MATCH_TICK_SECONDS = 0.2
+# Batas waktu bagian sinkron satu putaran pencocokan; sisa pekerjaan dilanjutkan pada tick berikutnya
+MATCH_BUDGET_MS = 20
+# Porsi budget untuk menilai pendatang baru; sisanya selalu tersedia untuk mengambil pasangan
+MATCH_FLUSH_SHARE = 0.75
+# Mulai ukuran antrean ini, pendatang baru dinilai di proses worker agar relay chat tidak tertahan (0 = selalu di event loop)
+MATCH_OFFLOAD_MIN_QUEUE = 2000
+# Dua user yang baru dipertemukan tidak dicocokkan lagi selama jendela ini (misal setelah /next)
+REMATCH_WINDOW_SECONDS = 30 * 60
+# /find premium: user dianggap online selama ini sejak perintah terakhirnya
+ONLINE_WINDOW_SECONDS = 10 * 60
+FIND_BUDGET_MS = 50
+FIND_TOP_K = 5
+# Indeks /find dibersihkan dari user yang sudah tidak online setiap sekian detik
+FIND_PRUNE_INTERVAL_SECONDS = 60
+# Relay chat: indikator "mengetik" ke satu partner paling sering sekali per interval ini
+RELAY_TYPING_INTERVAL_SECONDS = 4
+# Batas kirim Bot API: global ~30 pesan/dtk, per chat ~1 pesan/dtk (dengan sedikit ruang burst)
+OUTBOUND_GLOBAL_RATE = 30
+OUTBOUND_CHAT_RATE = 1
+OUTBOUND_CHAT_BURST = 3
+# Pesan relay yang boleh mengantre per arah sesi sebelum pesan baru ditolak
+RELAY_QUEUE_SIZE = 20
+# Item album dikumpulkan sampai tidak ada item baru selama jendela ini, lalu direlay dengan satu panggilan
+RELAY_ALBUM_WINDOW_SECONDS = 1.0
+# Update dari user berbeda diproses paralel (maks sebanyak ini), update satu user tetap berurutan
+MAX_CONCURRENT_UPDATES = 64
+UPDATE_LOCK_SHARDS = 256
+# SQLite dalam mode WAL: satu koneksi penulis dan beberapa koneksi baca untuk lookup
+DB_PATH = 'bot_database.db'
+DB_READERS = 3
+# Group commit: tulisan dari banyak handler di-commit bersama setiap sekian ms atau sekian unit
+WRITE_BATCH_MS = 5
+WRITE_BATCH_MAX = 256
+# Cache profil (LRU + TTL); setiap tulisan ke user_profiles membuang entri user tersebut
+PROFILE_CACHE_SIZE = 10000
+PROFILE_CACHE_TTL_SECONDS = 300
+# session_id dicadangkan di database per blok sebesar ini agar tidak terpakai ulang setelah crash
+SESSION_ID_BLOCK = 1000
+
 # Logger setup
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -149,10 +199,131 @@ async def init_db(db):
         )
     ''')
     await db.commit()
+    await run_migrations(db)
+
+# Migrasi skema berurutan; indeks ke-i (mulai 1) adalah versi di PRAGMA user_version setelah migrasi itu.
+# Tabel di init_db adalah versi 0. Jangan ubah migrasi yang sudah dirilis, tambahkan yang baru di akhir.
+# Setiap langkah berupa SQL atau fungsi async(db).
+SCHEMA_MIGRATIONS = [
+    ("indeks unik blokir", [
+        # Blokir ganda (klik berulang sebelum ada cek) dibuang, sisakan yang paling awal
+        "DELETE FROM blocks WHERE id NOT IN (SELECT MIN(id) FROM blocks GROUP BY blocker_id, blocked_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_blocks_pair ON blocks (blocker_id, blocked_id)",
+        "CREATE INDEX IF NOT EXISTS idx_blocks_blocked ON blocks (blocked_id)",
+    ]),
+    ("indeks sesi chat", [
+        "CREATE INDEX IF NOT EXISTS idx_chat_sessions_user1 ON chat_sessions (user1_id)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_sessions_user2 ON chat_sessions (user2_id)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_sessions_start ON chat_sessions (start_time)",
+    ]),
+    ("indeks rating", [
+        "CREATE INDEX IF NOT EXISTS idx_ratings_rated ON ratings (rated_id)",
+    ]),
+    ("tabel minat ternormalisasi", [
+        '''
+        CREATE TABLE IF NOT EXISTS interests (
+            interest_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_interests (
+            user_id INTEGER NOT NULL,
+            interest_id INTEGER NOT NULL REFERENCES interests(interest_id),
+            PRIMARY KEY (user_id, interest_id)
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_user_interests_interest ON user_interests (interest_id)",
+        lambda db: migrate_interests(db),
+    ]),
+    ("cadangan id sesi", [
+        '''
+        CREATE TABLE IF NOT EXISTS id_reservations (
+            name TEXT PRIMARY KEY,
+            next_id INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        # Lewati juga id sesi yang pernah dipakai lalu dihapus (sqlite_sequence milik AUTOINCREMENT)
+        '''
+        INSERT OR IGNORE INTO id_reservations (name, next_id)
+        SELECT 'chat_sessions', MAX(
+            (SELECT COALESCE(MAX(session_id), 0) FROM chat_sessions),
+            (SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'chat_sessions')
+        ) + 1
+        ''',
+    ]),
+]
+
+async def run_migrations(db):
+    """Jalankan migrasi yang belum diterapkan, masing-masing dalam satu transaksi bersama kenaikan user_version."""
+    async with db.execute("PRAGMA user_version") as c:
+        (version,) = await c.fetchone()
+    for target, (description, steps) in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        await db.execute("BEGIN")
+        try:
+            for step in steps:
+                if isinstance(step, str):
+                    await db.execute(step)
+                else:
+                    await step(db)
+            await db.execute(f"PRAGMA user_version = {target}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logger.critical(f"Migrasi skema v{target} ({description}) gagal, database tetap di v{target - 1}")
+            raise
+        logger.info(f"Migrasi skema v{target}: {description}")
+
+async def migrate_interests(db):
+    """Isi kamus minat (minat bawaan dulu) dan pindahkan kolom `interests` lama ke `user_interests` jika tabelnya masih kosong."""
+    await db.executemany("INSERT OR IGNORE INTO interests (name) VALUES (?)", [(name.lower(),) for name in COMMON_INTERESTS])
+    async with db.execute("SELECT 1 FROM user_interests LIMIT 1") as c:
+        if await c.fetchone():
+            return
+    async with db.execute("SELECT user_id, interests FROM user_profiles WHERE interests IS NOT NULL AND interests != ''") as c:
+        rows = await c.fetchall()
+    for user_id, interests in rows:
+        await set_user_interests(db, user_id, interests.split(','))
+    if rows:
+        logger.info(f"Migrasi minat: {len(rows)} profil dipindahkan ke tabel user_interests.")
+
+async def set_user_interests(db, user_id: int, names) -> list:
+    """Tulis minat user ke tabel normal (tanpa commit). Mengembalikan daftar (interest_id, nama)."""
+    names = sorted({name.strip().lower() for name in names if name.strip()})
+    await db.execute("DELETE FROM user_interests WHERE user_id = ?", (user_id,))
+    if not names:
+        return []
+    await db.executemany("INSERT OR IGNORE INTO interests (name) VALUES (?)", [(name,) for name in names])
+    async with db.execute(
+        f"SELECT interest_id, name FROM interests WHERE name IN ({','.join('?' * len(names))})", names
+    ) as c:
+        rows = await c.fetchall()
+    await db.executemany("INSERT INTO user_interests (user_id, interest_id) VALUES (?, ?)", [(user_id, interest_id) for interest_id, _ in rows])
+    return rows
+
+def get_writes(context: ContextTypes.DEFAULT_TYPE) -> WriteQueue:
+    """Get the group-commit write queue; await hasilnya jika perlu durabilitas atau langsung membaca ulang"""
+    return context.application.db_writes
+
+def get_reader(context: ContextTypes.DEFAULT_TYPE) -> ReaderPool:
+    """Get the read-only connection pool for lookups (tidak menunggu commit penulis)"""
+    return context.application.db_readers
+
+def get_known_users(context: ContextTypes.DEFAULT_TYPE) -> dict:
+    """Get the user_id -> username map of users that already have a profile row"""
+    return context.application.known_users
+
+def get_session_ids(context: ContextTypes.DEFAULT_TYPE) -> IdAllocator:
+    """Get the session_id allocator; id dibagikan dari blok yang sudah dicadangkan agar create_match tidak menunggu INSERT"""
+    return context.application.session_ids
 
-def get_db(context: ContextTypes.DEFAULT_TYPE) -> aiosqlite.Connection:
-    """Get database connection from context"""
-    return context.application.db_connection
+def get_profile_cache(context: ContextTypes.DEFAULT_TYPE) -> ProfileCache:
+    """Get the profile cache (tidak dipersist, kosong setiap start)"""
+    return context.application.profile_cache
+
+def write_profile(context: ContextTypes.DEFAULT_TYPE, user_id: int, sql: str, parameters) -> asyncio.Future:
+    """Antrekan tulisan ke baris user_profiles milik `user_id`; cache profilnya dibuang setelah commit"""
+    return get_profile_cache(context).invalidate_after(get_writes(context).execute(sql, parameters), user_id)
 
 # =============================
 # HELPER FUNCTIONS
@@ -178,12 +349,12 @@ async def broadcast_job(context: ContextTypes.DEFAULT_TYPE):
     if not text_to_send: return
     
     logger.info(f"Menjalankan broadcast job: {text_to_send[:30]}...")
-    db = get_db(context)
+    db = get_reader(context)
     all_user_ids = [row[0] for row in await db.execute_fetchall("SELECT user_id FROM user_profiles")]
     if not all_user_ids: return
     
     escaped_text = escape_md(text_to_send)
-    tasks = [safe_send_message(context.bot, uid, escaped_text, parse_mode=ParseMode.MARKDOWN_V2) for uid in all_user_ids]
+    tasks = [safe_send_message(context.bot, uid, escaped_text, parse_mode=ParseMode.MARKDOWN_V2, rate_limit_args=BULK_RATE_LIMIT_ARGS) for uid in all_user_ids]
     await asyncio.gather(*tasks)
     logger.info(f"Broadcast job ke {len(all_user_ids)} pengguna selesai.")
 
@@ -217,19 +388,6 @@ COMMAND_LIST = [
     "setfilter", "find" # Tambahkan semua perintah pengguna di sini
 ]
 
-def _haversine_distance(lat1, lon1, lat2, lon2):
-    """Menghitung jarak antara dua titik koordinat dalam kilometer."""
-    if not all(isinstance(i, (float, int)) and i is not None for i in [lat1, lon1, lat2, lon2]):
-        return float('inf') 
-
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
-    c = 2 * asin(sqrt(a))
-    r = 6371
-    return c * r
-    
 # Ganti total fungsi get_city_from_coords Anda dengan versi ini
 
 async def get_city_from_coords(lat: float, lon: float) -> str:
@@ -279,7 +437,6 @@ async def get_city_from_coords(lat: float, lon: float) -> str:
 
 async def end_chat_session(context: ContextTypes.DEFAULT_TYPE, user_id: int):
     """Ends a chat session, notifies the partner, and returns the session_id."""
-    db = get_db(context)
     chat_partners = context.bot_data.setdefault('chat_partners', {})
     
     partner_id = chat_partners.get(user_id)
@@ -289,11 +446,10 @@ async def end_chat_session(context: ContextTypes.DEFAULT_TYPE, user_id: int):
         return None
 
     end_time_iso = datetime.now(timezone.utc).isoformat()
-    await db.execute(
+    get_writes(context).execute(
         "UPDATE chat_sessions SET end_time = ?, status = 'ended' WHERE session_id = ?",
         (end_time_iso, session_id)
     )
-    await db.commit()
 
     await safe_send_message(context.bot, partner_id, "Pasangan Anda telah menghentikan chat.")
     
@@ -301,13 +457,13 @@ async def end_chat_session(context: ContextTypes.DEFAULT_TYPE, user_id: int):
 
     return session_id
 
-async def update_karma(db: aiosqlite.Connection, user_id: int, change: int):
-    """Menambah atau mengurangi karma pengguna dan memastikannya tetap dalam batas."""
-    await db.execute(
+def update_karma(context: ContextTypes.DEFAULT_TYPE, user_id: int, change: int):
+    """Menambah atau mengurangi karma pengguna dan memastikannya tetap dalam batas (write-behind)."""
+    write_profile(
+        context, user_id,
         "UPDATE user_profiles SET karma = MAX(0, MIN(200, karma + ?)) WHERE user_id = ?",
         (change, user_id)
     )
-    await db.commit()
     logger.info(f"Karma untuk user {user_id} diubah sebanyak {change}.")
 
 
@@ -316,25 +472,36 @@ def escape_md(text: str) -> str:
     chars_to_escape = r'_*[]()~`>#+-.=|{}!'
     return "".join(f'\\{char}' if char in chars_to_escape else char for char in text)
 
+# Satu round-trip untuk user baru maupun perubahan username; username kosong tidak menimpa yang lama
+UPSERT_USER_SQL = (
+    "INSERT INTO user_profiles (user_id, username, koin) VALUES (?, ?, 0) "
+    "ON CONFLICT(user_id) DO UPDATE SET username = excluded.username WHERE excluded.username != ''"
+)
+
 def auto_update_profile(func):
     """Decorator to automatically update user profile"""
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         user = update.effective_user
         if user and hasattr(context.application, 'db_connection'):
-            db = get_db(context)
             try:
-                async with db.execute("SELECT user_id FROM user_profiles WHERE user_id = ?", (user.id,)) as cursor:
-                    if await cursor.fetchone() is None:
-                        await db.execute(
-                            "INSERT INTO user_profiles (user_id, username, koin) VALUES (?, ?, 0)", 
-                            (user.id, user.username or "")
-                        )
-                    elif user.username and user.username != "":
-                        await db.execute(
-                            "UPDATE user_profiles SET username = ? WHERE user_id = ?", 
-                            (user.username, user.id)
-                        )
-                    await db.commit()
+                known_users = get_known_users(context)
+                username = user.username or ""
+                is_new = user.id not in known_users
+                # Kasus umum (user lama, username sama atau kosong) tidak menyentuh database sama sekali
+                if is_new or (username and known_users[user.id] != username):
+                    known_users[user.id] = username
+                    written = write_profile(context, user.id, UPSERT_USER_SQL, (user.id, username))
+
+                    def forget_on_failure(future, user_id=user.id):
+                        # Jika gagal, lupakan user agar update berikutnya mencoba lagi
+                        if not future.cancelled() and future.exception() is not None:
+                            known_users.pop(user_id, None)
+                    written.add_done_callback(forget_on_failure)
+                    if is_new:
+                        # Ditunggu sampai commit: handler berikutnya akan membaca profil ini lewat pool pembaca
+                        await written
+                if hasattr(context.application, 'find_index'):
+                    await mark_online(context, user.id)
             except Exception as e: 
                 logger.error(f"Failed to update user profile {user.id}: {e}")
         return await func(update, context, *args, **kwargs)
@@ -351,67 +518,146 @@ async def get_admin_contact(context: ContextTypes.DEFAULT_TYPE) -> str:
         logger.error(f"Failed to get admin chat info: {e}")
         return "Admin"
 
-async def is_user_pro(db, user_id: int) -> bool:
-    """Check if user has active premium status"""
-    async with db.execute(
-        "SELECT pro_expires_at FROM user_profiles WHERE user_id = ?", 
-        (user_id,)
-    ) as cursor:
-        row = await cursor.fetchone()
-        if row and row[0]:
-            try:
-                expire_date = datetime.fromisoformat(row[0])
-                return expire_date > datetime.now(timezone.utc)
-            except (ValueError, TypeError): 
-                return False
+async def is_user_pro(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
+    """Check if user has active premium status (dari cache profil)"""
+    profile = await get_profile(context, user_id)
+    if profile and profile.pro_expires_at:
+        try:
+            expire_date = datetime.fromisoformat(profile.pro_expires_at)
+            return expire_date > datetime.now(timezone.utc)
+        except (ValueError, TypeError): 
+            return False
     return False
 
-async def is_blocked(db, user1_id, user2_id):
-    """Check if users have blocked each other"""
-    async with db.execute(
-        """SELECT 1 FROM blocks 
-           WHERE (blocker_id=? AND blocked_id=?) 
-           OR (blocker_id=? AND blocked_id=?)""", 
-        (user1_id, user2_id, user2_id, user1_id)
-    ) as c:
-        return await c.fetchone() is not None
-
-async def block_user(db, blocker_id, blocked_id):
-    """Block a user"""
-    async with db.execute(
-        "SELECT 1 FROM blocks WHERE blocker_id=? AND blocked_id=?", 
-        (blocker_id, blocked_id)
-    ) as c:
-        if await c.fetchone(): 
-            return False
+async def load_known_users(db) -> dict:
+    """Load user_id -> username for every profile, agar auto_update_profile tidak perlu SELECT"""
+    async with db.execute("SELECT user_id, username FROM user_profiles") as c:
+        return {user_id: username or "" async for user_id, username in c}
+
+async def load_block_index(db) -> BlockIndex:
+    """Load the whole blocks table into an in-memory block graph"""
+    block_index = BlockIndex()
+    async with db.execute("SELECT blocker_id, blocked_id FROM blocks") as c:
+        async for blocker_id, blocked_id in c:
+            block_index.add(blocker_id, blocked_id)
+    return block_index
+
+async def load_interest_index(db) -> InterestIndex:
+    """Load the interest dictionary and user_interests into an in-memory inverted index"""
+    interest_index = InterestIndex()
+    async with db.execute("SELECT interest_id, name FROM interests") as c:
+        async for interest_id, name in c:
+            interest_index.define(name, interest_id)
+    async with db.execute("SELECT user_id, interest_id FROM user_interests") as c:
+        async for user_id, interest_id in c:
+            interest_index.add(user_id, interest_id)
+    return interest_index
+
+def get_interest_index(context: ContextTypes.DEFAULT_TYPE) -> InterestIndex:
+    """Get the in-memory interest -> users index from context"""
+    return context.application.interest_index
+
+async def save_user_interests(writes: WriteQueue, interest_index: InterestIndex, user_id: int, names) -> list:
+    """Simpan minat user ke tabel normal dan kolom `interests` (write-through ke interest index)"""
+    async def unit(db):
+        rows = await set_user_interests(db, user_id, names)
+        await db.execute(
+            "UPDATE user_profiles SET interests = ? WHERE user_id = ?",
+            (",".join(sorted(name for _, name in rows)), user_id)
+        )
+        return rows
+    rows = await writes.run(unit)
+    for interest_id, name in rows:
+        interest_index.define(name, interest_id)
+    interest_index.set_user(user_id, [interest_id for interest_id, _ in rows])
+    return interest_index.names(user_id)
+
+def get_block_index(context: ContextTypes.DEFAULT_TYPE) -> BlockIndex:
+    """Get the in-memory block graph from context"""
+    return context.application.block_index
+
+def get_typing_throttle(context: ContextTypes.DEFAULT_TYPE) -> TypingThrottle:
+    """Get the per-partner typing indicator throttle for the relay"""
+    return context.application.typing_throttle
+
+def get_relay_queues(context: ContextTypes.DEFAULT_TYPE) -> RelayQueues:
+    """Get the per-session ordered relay queues"""
+    return context.application.relay_queues
+
+def get_media_groups(context: ContextTypes.DEFAULT_TYPE) -> MediaGroupBuffer:
+    """Get the album buffer used by the relay"""
+    return context.application.media_groups
+
+def get_recent_pairs(context: ContextTypes.DEFAULT_TYPE) -> RecentPairs:
+    """Get the recently-matched pairs, dipakai untuk mencegah rematch langsung"""
+    return context.application.recent_pairs
+
+def make_pair_filter(context: ContextTypes.DEFAULT_TYPE):
+    """Pasangan yang tidak boleh dipertemukan: salah satu memblokir, atau baru saja bertemu."""
+    block_index, recent_pairs = get_block_index(context), get_recent_pairs(context)
+    return lambda user1_id, user2_id: block_index.is_blocked(user1_id, user2_id) or recent_pairs.seen(user1_id, user2_id)
+
+def get_find_index(context: ContextTypes.DEFAULT_TYPE) -> FindIndex:
+    """Get the online/waiting users index used by /find"""
+    return context.application.find_index
+
+async def mark_online(context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    """Catat aktivitas user untuk /find; profil hanya dimuat jika user belum ada di indeks."""
+    find_index = get_find_index(context)
+    if find_index.touch(user_id):
+        return
+    profile = await get_profile(context, user_id)
+    if profile and profile.get('gender') and profile.get('age'):
+        find_index.put(make_queue_item(context, user_id, profile, await is_user_pro(context, user_id)))
+
+async def prune_find_index(context: ContextTypes.DEFAULT_TYPE):
+    """Job berkala: buang user yang tidak lagi online dari indeks /find (yang masih menunggu tetap disimpan)."""
+    matchmaker = get_matchmaker(context)
+    expired = get_find_index(context).expire(keep=lambda uid: uid in matchmaker)
+    if expired:
+        logger.info(f"Indeks /find: {expired} user tidak aktif dibuang.")
+
+def get_match_stats(context: ContextTypes.DEFAULT_TYPE) -> MatchStats:
+    """Get matching-pass statistics (tidak dipersist, mulai dari nol setiap start)"""
+    return context.application.match_stats
+
+def block_user(writes: WriteQueue, block_index: BlockIndex, blocker_id, blocked_id):
+    """Block a user (write-through ke block index, tulisan ke database write-behind)"""
+    if block_index.has_blocked(blocker_id, blocked_id):
+        return False
     
     ts = datetime.now(timezone.utc).isoformat()
-    await db.execute(
-        "INSERT INTO blocks (blocker_id, blocked_id, timestamp) VALUES (?, ?, ?)", 
+    writes.execute(
+        "INSERT OR IGNORE INTO blocks (blocker_id, blocked_id, timestamp) VALUES (?, ?, ?)", 
         (blocker_id, blocked_id, ts)
     )
-    await db.commit()
+    block_index.add(blocker_id, blocked_id)
     return True
 
-async def save_rating(db, rater_id, rated_id, rating):
-    """Save user rating"""
+def save_rating(writes: WriteQueue, rater_id, rated_id, rating):
+    """Save user rating (write-behind)"""
     ts = datetime.now(timezone.utc).isoformat()
-    await db.execute(
+    writes.execute(
         "INSERT INTO ratings (rater_id, rated_id, rating, timestamp) VALUES (?, ?, ?, ?)", 
         (rater_id, rated_id, rating, ts)
     )
-    await db.commit()
 
-async def get_user_profile_data(db, user_id):
-    """Get complete user profile data"""
-    db.row_factory = aiosqlite.Row
-    async with db.execute(
-        "SELECT * FROM user_profiles WHERE user_id = ?", 
-        (user_id,)
-    ) as c:
+async def get_user_profile_data(db, user_id) -> Optional[ProfileRecord]:
+    """Get complete user profile data langsung dari database (tanpa cache)"""
+    async with db.execute(PROFILE_SELECT, (user_id,)) as c:
         row = await c.fetchone()
-        db.row_factory = None  # Reset to default
-        return dict(row) if row else None
+        return ProfileRecord(row) if row else None
+
+async def get_profile(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> Optional[ProfileRecord]:
+    """Get user profile lewat cache; hanya dimuat dari pool pembaca jika tidak ada atau kedaluwarsa"""
+    cache = get_profile_cache(context)
+    profile = cache.get(user_id)
+    if profile is None:
+        generation = cache.generation
+        profile = await get_user_profile_data(get_reader(context), user_id)
+        if profile is not None:
+            cache.put(user_id, profile, generation)
+    return profile
 
 def reset_user_chat(context: ContextTypes.DEFAULT_TYPE, user_id: int):
     """Secara paksa membersihkan semua data sesi aktif untuk seorang pengguna."""
@@ -439,22 +685,34 @@ async def safe_send_message(bot, chat_id, text, **kwargs):
     try:
         # Kirim pesan dan kembalikan hasilnya
         return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
-    except Exception: 
-        # Jika gagal, kembalikan None
+    except telegram.error.Forbidden:
+        # User memblokir bot; wajar saat broadcast, tidak perlu dicatat
         return None
+    except Exception as e:
+        # RetryAfter sudah diulang oleh OutboundScheduler; yang sampai di sini benar-benar gagal
+        logger.warning(f"Gagal mengirim pesan ke {chat_id}: {e}")
+        return None
+
+def get_matchmaker(context: ContextTypes.DEFAULT_TYPE) -> Matchmaker:
+    """Get the waiting-queue matchmaker, migrating the old list-based queue if needed"""
+    matchmaker = context.bot_data.get('matchmaker')
+    if matchmaker is None:
+        legacy_queue = context.bot_data.pop('waiting_queue', None) or []
+        matchmaker = Matchmaker.from_legacy_queue(legacy_queue, get_interest_index(context))
+        context.bot_data['matchmaker'] = matchmaker
+    return matchmaker
+
+def remask_queue(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Hitung ulang bitmask minat antrean dari persistence, karena slot bit InterestIndex hanya berlaku per proses"""
+    # Antrean dari versi lama masih menyimpan registry nomor bitnya sendiri
+    context.bot_data.pop('interest_registry', None)
+    interest_index = get_interest_index(context)
+    for entry in get_matchmaker(context):
+        entry.interest_mask = interest_index.mask_of(entry.user_id)
 
 def remove_from_queue(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
     """Remove user from waiting queue"""
-    waiting_queue = context.bot_data.setdefault('waiting_queue', [])
-    user_in_queue = next(
-        (item for item in waiting_queue if item['user_id'] == user_id), 
-        None
-    )
-    
-    if user_in_queue:
-        waiting_queue.remove(user_in_queue)
-        return True
-    return False
+    return get_matchmaker(context).remove(user_id) is not None
     
 async def safe_edit_message_text(bot, text: str, chat_id: int, message_id: int, **kwargs):
     """Safely edit a message with error handling."""
@@ -523,14 +781,15 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def profil_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if remove_from_queue(context, update.effective_user.id):
         await update.message.reply_text("Pencarian dibatalkan saat masuk ke menu profil.")
+    # Selama mengedit profil user tidak ditawarkan di /find; aktivitas berikutnya memasukkannya lagi dengan profil baru
+    get_find_index(context).remove(update.effective_user.id)
     await display_profile_menu(update, context)
     return PROFILE_MAIN
 
 async def display_profile_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    db = get_db(context)
-    profile = await get_user_profile_data(db, user_id)
-    def format_interests(s): return ', '.join([i.capitalize() for i in s.split(',')]) if s else 'Belum diatur'
+    profile = await get_profile(context, user_id)
+    interests = ', '.join(i.capitalize() for i in get_interest_index(context).names(user_id)) or 'Belum diatur'
     
     menu_text = (
         "👤 *Menu Profil Anda*\n\n"
@@ -538,7 +797,7 @@ async def display_profile_menu(update: Update, context: ContextTypes.DEFAULT_TYP
         f"• *Gender:* `{escape_md(profile.get('gender') or 'Belum diatur')}`\n"
         f"• *Usia:* `{escape_md(str(profile.get('age') or 'Belum diatur'))}`\n"
         f"• *Bio:* `{escape_md(profile.get('bio') or 'Belum diatur')}`\n"
-        f"• *Minat:* `{escape_md(format_interests(profile.get('interests')))}`\n"
+        f"• *Minat:* `{escape_md(interests)}`\n"
         f"• *Lokasi:* `{'Sudah diatur' if profile.get('latitude') else 'Belum diatur'}`\n"
         f"• *Foto Profil:* `{'Sudah diatur' if profile.get('profile_pic_id') else 'Belum diatur'}`"
     )
@@ -581,25 +840,20 @@ async def p_receive_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message.text.isdigit() or not 13 <= int(update.message.text) <= 100:
         await update.message.reply_text("Input tidak valid. Harap kirim angka antara 13 dan 100.")
         return P_AGE
-    db = get_db(context)
-    await db.execute("UPDATE user_profiles SET age = ? WHERE user_id = ?", (int(update.message.text), update.effective_user.id))
-    await db.commit()
+    await write_profile(context, update.effective_user.id, "UPDATE user_profiles SET age = ? WHERE user_id = ?", (int(update.message.text), update.effective_user.id))
+    await refresh_queued_user(context, update.effective_user.id)
     await update.message.delete()
     await display_profile_menu(update, context)
     return PROFILE_MAIN
 
 async def p_receive_bio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db = get_db(context)
-    await db.execute("UPDATE user_profiles SET bio = ? WHERE user_id = ?", (update.message.text, update.effective_user.id))
-    await db.commit()
+    await write_profile(context, update.effective_user.id, "UPDATE user_profiles SET bio = ? WHERE user_id = ?", (update.message.text, update.effective_user.id))
     await update.message.delete()
     await display_profile_menu(update, context)
     return PROFILE_MAIN
 
 async def p_receive_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db = get_db(context)
-    await db.execute("UPDATE user_profiles SET profile_pic_id = ? WHERE user_id = ?", (update.message.photo[-1].file_id, update.effective_user.id))
-    await db.commit()
+    await write_profile(context, update.effective_user.id, "UPDATE user_profiles SET profile_pic_id = ? WHERE user_id = ?", (update.message.photo[-1].file_id, update.effective_user.id))
     await update.message.delete()
     await display_profile_menu(update, context)
     return PROFILE_MAIN
@@ -616,9 +870,8 @@ async def p_edit_gender(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 async def p_set_gender(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     gender = query.data.split('_')[-1]
-    db = get_db(context)
-    await db.execute("UPDATE user_profiles SET gender = ? WHERE user_id = ?", (gender, query.from_user.id))
-    await db.commit()
+    await write_profile(context, query.from_user.id, "UPDATE user_profiles SET gender = ? WHERE user_id = ?", (gender, query.from_user.id))
+    await refresh_queued_user(context, query.from_user.id)
     await query.answer(f"Gender diatur ke {gender}")
     await display_profile_menu(update, context)
     return PROFILE_MAIN
@@ -627,9 +880,7 @@ async def p_edit_interests_menu(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query; await query.answer()
     user_id = query.from_user.id
     if is_new or 'temp_interests' not in context.user_data:
-        db = get_db(context)
-        profile = await get_user_profile_data(db, user_id)
-        context.user_data['temp_interests'] = [i for i in (profile.get('interests') or "").split(',') if i]
+        context.user_data['temp_interests'] = get_interest_index(context).names(user_id)
     selected_interests = set(context.user_data.get('temp_interests', []))
     keyboard = []; row = []
     for interest in COMMON_INTERESTS:
@@ -689,10 +940,9 @@ async def p_receive_manual_interest(update: Update, context: ContextTypes.DEFAUL
 
 async def p_save_interests_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query; await query.answer("Minat berhasil disimpan!")
-    db = get_db(context)
-    final_interests = ",".join(sorted(list(set(context.user_data.pop('temp_interests', [])))))
-    await db.execute("UPDATE user_profiles SET interests = ? WHERE user_id = ?", (final_interests, query.from_user.id))
-    await db.commit()
+    await save_user_interests(get_writes(context), get_interest_index(context), query.from_user.id, context.user_data.pop('temp_interests', []))
+    get_profile_cache(context).invalidate(query.from_user.id)
+    await refresh_queued_user(context, query.from_user.id)
     await display_profile_menu(update, context)
     return PROFILE_MAIN
 
@@ -706,9 +956,8 @@ async def p_prompt_for_location(update: Update, context: ContextTypes.DEFAULT_TY
     return P_LOCATION
 
 async def p_receive_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db = get_db(context)
-    await db.execute("UPDATE user_profiles SET latitude = ?, longitude = ? WHERE user_id = ?", (update.message.location.latitude, update.message.location.longitude, update.effective_user.id))
-    await db.commit()
+    await write_profile(context, update.effective_user.id, "UPDATE user_profiles SET latitude = ?, longitude = ? WHERE user_id = ?", (update.message.location.latitude, update.message.location.longitude, update.effective_user.id))
+    await refresh_queued_user(context, update.effective_user.id)
     prompt_msg_id = context.user_data.pop('prompt_message_id', None)
     if prompt_msg_id:
         try: await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=prompt_msg_id)
@@ -732,16 +981,6 @@ async def p_close(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # --- FUNGSI-FUNGSI BANTUAN (DEFINISIKAN DULU) ---
 
-def _haversine_distance(lat1, lon1, lat2, lon2):
-    """Menghitung jarak antara dua titik koordinat dalam kilometer."""
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
-    c = 2 * asin(sqrt(a))
-    r = 6371
-    return c * r
-
 async def ice_breaker_callback(context: ContextTypes.DEFAULT_TYPE):
     """Ice breaker job callback"""
     job = context.job
@@ -764,111 +1003,53 @@ def schedule_ice_breaker(context: ContextTypes.DEFAULT_TYPE, user1_id: int, user
         name=job_name
     )
 
-# HAPUS FUNGSI is_match LAMA ANDA
-# GANTI DENGAN FUNGSI BARU INI
-
-def calculate_match_score(user_a: dict, user_b: dict) -> float:
+def create_match(context: ContextTypes.DEFAULT_TYPE, user_a: QueueEntry, user_b: QueueEntry):
     """
-    Menghitung skor kecocokan antara dua pengguna (0 hingga 100).
-    Skor -1 berarti mereka tidak cocok sama sekali (misal, filter gender gagal).
+    Fungsi bantuan untuk membuat pasangan. HANYA menggunakan bot_data.
+    Pasangan dicatat di chat_partners sebelum await apa pun, jadi /stop dan /search
+    langsung melihatnya; INSERT sesi ikut group commit berikutnya tanpa ditunggu.
+    Notifikasi profil dikirim di task latar agar putaran pencocokan tidak menunggu
+    API Telegram dan geocoding.
     """
-    p1, p2 = user_a['profile'], user_b['profile']
-    
-    # --- BOBOT PRIORITAS ---
-    WEIGHTS = {
-        'gender': 100,  # Bobot gender sangat tinggi, jika gagal, skor langsung -1
-        'karma': 0.40,  # Karma punya bobot 40%
-        'location': 0.30, # Lokasi 30%
-        'interests': 0.20, # Minat 20%
-        'age': 0.10,    # Usia 10%
-    }
-    
-    # --- FUNGSI BANTUAN UNTUK FILTER PREMIUM ---
-    def check_premium_filters(u_filter, u_target):
-        if not u_filter.get('use_filters', False):
-            return True
-        
-        f_profile, t_profile = u_filter['profile'], u_target['profile']
-        
-        # 1. Validasi Gender (SANGAT WAJIB)
-        filter_gender = f_profile.get('filter_gender')
-        if filter_gender:
-            if filter_gender == 'opposite' and f_profile.get('gender') == t_profile.get('gender'): return False
-            if filter_gender == 'same' and f_profile.get('gender') != t_profile.get('gender'): return False
-
-        # Validasi filter lain yang bersifat "keras" (jika diatur, wajib dipenuhi)
-        if f_profile.get('filter_age_min') and (t_profile.get('age') or 0) < f_profile['filter_age_min']: return False
-        if f_profile.get('filter_age_max') and (t_profile.get('age') or 0) > f_profile['filter_age_max']: return False
-        
-        return True
-
-    # Jika salah satu gagal validasi filter wajib, langsung return skor -1
-    if not (check_premium_filters(user_a, user_b) and check_premium_filters(user_b, user_a)):
-        return -1.0
-
-    # --- PENGHITUNGAN SKOR PARSIAL (0-100) ---
-    
-    # 1. Skor Karma
-    karma_diff = abs(p1.get('karma', 100) - p2.get('karma', 100))
-    # Semakin kecil perbedaan, semakin dekat skor ke 100
-    score_karma = max(0, 100 - karma_diff) 
-
-    # 2. Skor Lokasi
-    score_location = 0.0
-    if p1.get('latitude') and p2.get('latitude'):
-        dist = _haversine_distance(p1['latitude'], p1['longitude'], p2['latitude'], p2['longitude'])
-        # Asumsikan jarak "baik" adalah di bawah 50km. Lebih dari itu skornya menurun.
-        score_location = max(0, 100 - (dist * 2))
-
-    # 3. Skor Minat
-    score_interests = 0.0
-    p1_interests = set(i.strip() for i in (p1.get('interests') or '').lower().split(',') if i)
-    p2_interests = set(i.strip() for i in (p2.get('interests') or '').lower().split(',') if i)
-    if p1_interests and p2_interests:
-        common_interests = len(p1_interests.intersection(p2_interests))
-        total_interests = len(p1_interests.union(p2_interests))
-        if total_interests > 0:
-            score_interests = (common_interests / total_interests) * 100
-
-    # 4. Skor Usia
-    age_diff = abs((p1.get('age') or 25) - (p2.get('age') or 25))
-    # Semakin kecil perbedaan usia, semakin tinggi skornya
-    score_age = max(0, 100 - (age_diff * 5))
-
-    # --- HITUNG SKOR TOTAL BERDASARKAN BOBOT ---
-    total_score = (
-        (score_karma * WEIGHTS['karma']) +
-        (score_location * WEIGHTS['location']) +
-        (score_interests * WEIGHTS['interests']) +
-        (score_age * WEIGHTS['age'])
-    )
-    
-    return total_score
-
-async def create_match(context: ContextTypes.DEFAULT_TYPE, user_a: dict, user_b: dict):
-    """Fungsi bantuan untuk membuat pasangan. HANYA menggunakan bot_data."""
-    db = get_db(context)
     chat_partners = context.bot_data.setdefault('chat_partners', {})
-    user_a_id, user_b_id = user_a['user_id'], user_b['user_id']
-    
-    now_iso = datetime.now(timezone.utc).isoformat()
-    cursor = await db.execute("INSERT INTO chat_sessions (user1_id, user2_id, start_time, status) VALUES (?, ?, ?, 'active')", (user_a_id, user_b_id, now_iso))
-    await db.commit()
-    session_id = cursor.lastrowid
+    user_a_id, user_b_id = user_a.user_id, user_b.user_id
+    session_id = next(get_session_ids(context))
     
     chat_partners[user_a_id] = {'partner_id': user_b_id, 'session_id': session_id}
     chat_partners[user_b_id] = {'partner_id': user_a_id, 'session_id': session_id}
+    get_recent_pairs(context).add(user_a_id, user_b_id)
     
-    await send_match_profiles(context, user_a, user_b)
+    # Antrean tulis FIFO: UPDATE sesi ini (mis. saat /stop) selalu dieksekusi setelah INSERT-nya
+    now_iso = datetime.now(timezone.utc).isoformat()
+    written = get_writes(context).execute(
+        "INSERT INTO chat_sessions (session_id, user1_id, user2_id, start_time, status) VALUES (?, ?, ?, ?, 'active')",
+        (session_id, user_a_id, user_b_id, now_iso),
+    )
+
+    def log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Gagal menyimpan sesi {session_id} ({user_a_id} & {user_b_id}): {future.exception()}")
+    written.add_done_callback(log_failure)
+    
+    context.application.create_task(notify_match(context, user_a_id, user_b_id))
     schedule_ice_breaker(context, user_a_id, user_b_id)
     logger.info(f"Matched user {user_a_id} with {user_b_id}")
 
-async def send_match_profiles(context: ContextTypes.DEFAULT_TYPE, user_a: dict, user_b: dict):
-    user_a_id, user_b_id = user_a['user_id'], user_b['user_id']
-    profile_a, profile_b = user_a['profile'], user_b['profile']
+async def notify_match(context: ContextTypes.DEFAULT_TYPE, user_a_id: int, user_b_id: int):
+    """Task latar untuk notifikasi match. Kegagalan di sini tidak membatalkan sesi yang sudah dibuat."""
+    try:
+        await send_match_profiles(context, user_a_id, user_b_id)
+    except Exception as e:
+        logger.error(f"Gagal mengirim notifikasi match {user_a_id} & {user_b_id}: {e}", exc_info=True)
+
+async def send_match_profiles(context: ContextTypes.DEFAULT_TYPE, user_a_id: int, user_b_id: int):
+    # Entri antrean hanya menyimpan field untuk pencocokan, profil lengkap diambil dari cache profil
+    profile_a = await get_profile(context, user_a_id) or {}
+    profile_b = await get_profile(context, user_b_id) or {}
+    interest_index = get_interest_index(context)
     distance_km_str = None
     if profile_a.get('latitude') and profile_b.get('latitude'):
-        dist = _haversine_distance(profile_a['latitude'], profile_a['longitude'], profile_b['latitude'], profile_b['longitude'])
+        dist = haversine_distance(profile_a['latitude'], profile_a['longitude'], profile_b['latitude'], profile_b['longitude'])
         distance_km_str = f"{dist:.1f} km"
 
     async def send_profile(send_to_id, partner_profile):
@@ -878,7 +1059,7 @@ async def send_match_profiles(context: ContextTypes.DEFAULT_TYPE, user_a: dict,
             if distance_km_str: final_location_line = f"{city_name} - {distance_km_str}"
             else: final_location_line = city_name
         
-        interests_str = ", ".join([i.capitalize() for i in partner_profile.get('interests', '').split(',') if i]) if partner_profile.get('interests') else "Belum diatur"
+        interests_str = ", ".join(i.capitalize() for i in interest_index.names(partner_profile.get('user_id'))) or "Belum diatur"
         
         caption = (
             f"✨ *Pasangan Ditemukan\\!* ✨\n\n"
@@ -899,85 +1080,202 @@ async def send_match_profiles(context: ContextTypes.DEFAULT_TYPE, user_a: dict,
 
     await asyncio.gather(send_profile(user_a_id, profile_b), send_profile(user_b_id, profile_a))
 
-# GANTI TOTAL FUNGSI try_match_users ANDA DENGAN INI
+def make_match_executor() -> Optional[ProcessPoolExecutor]:
+    """Pool worker penilaian antrean besar, atau None jika offload dimatikan."""
+    if not MATCH_OFFLOAD_MIN_QUEUE:
+        return None
+    # Satu worker saja, karena dia menyimpan replika kolom antrean dan hanya menerima perubahannya.
+    # spawn, bukan fork: fork dari proses yang sudah punya thread (aiosqlite) bisa deadlock.
+    return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+
+def offload_scoring(context: ContextTypes.DEFAULT_TYPE, matchmaker: Matchmaker, exclude_for) -> None:
+    """
+    Untuk antrean besar, nilai pendatang baru di `application.match_executor`.
+    Hasil batch sebelumnya diterapkan hanya jika sudah selesai (tanpa menunggu),
+    lalu pendatang yang terkumpul sejak itu dikirim sebagai batch berikutnya.
+    """
+    application = context.application
+    executor = getattr(application, 'match_executor', None)
+    if executor is None:
+        return
+    future = getattr(application, 'match_offload', None)
+    if future is not None:
+        if not future.done():
+            return
+        application.match_offload = None
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error(f"Penilaian di proses worker gagal, pendatang dinilai ulang di event loop: {e}")
+            result = None
+        matchmaker.finish_offload(result)
+    if len(matchmaker) < MATCH_OFFLOAD_MIN_QUEUE:
+        return
+    batch = matchmaker.offload_pending(exclude_for=exclude_for)
+    if batch is None:
+        return
+    try:
+        application.match_offload = executor.submit(score_offloaded, *batch)
+    except Exception as e:
+        # Misal BrokenProcessPool setelah worker mati: lanjut tanpa offload
+        logger.error(f"Proses worker matchmaker tidak tersedia, offload dimatikan: {e}")
+        application.match_executor = None
+        matchmaker.finish_offload(None)
 
 async def try_match_users(context: ContextTypes.DEFAULT_TYPE):
     """
-    Mencocokkan pengguna secara instan berdasarkan skor kecocokan tertinggi.
+    Satu putaran pencocokan: nilai semua pengguna yang masuk sejak tick terakhir,
+    lalu ambil pasangan terbaik dari heap sampai tidak ada lagi yang layak.
+    Untuk antrean besar, penilaian pendatang baru dipindah ke proses worker.
     """
-    db = get_db(context)
-    waiting_queue = context.bot_data.setdefault('waiting_queue', [])
-    
-    # Kita akan memproses antrean sampai tidak ada lagi pasangan yang bisa dibuat
-    while len(waiting_queue) >= 2:
-        best_pair = None
-        highest_score = -1.0
-        
-        # Cari semua kemungkinan pasangan dan hitung skornya
-        for i in range(len(waiting_queue)):
-            for j in range(i + 1, len(waiting_queue)):
-                user_a = waiting_queue[i]
-                user_b = waiting_queue[j]
-
-                # Lewati jika sudah pernah diblokir
-                if await is_blocked(db, user_a['user_id'], user_b['user_id']):
-                    continue
-                
-                score = calculate_match_score(user_a, user_b)
-                
-                # Jika skor saat ini lebih tinggi dari yang terbaik sejauh ini
-                if score > highest_score:
-                    highest_score = score
-                    best_pair = (user_a, user_b)
-
-        # Setelah memeriksa semua pasangan, jika ditemukan pasangan terbaik
-        # dengan skor di atas ambang batas (misal, 40), pasangkan mereka.
-        if best_pair and highest_score >= 40:
-            user_a, user_b = best_pair
-            logger.info(f"Pasangan terbaik ditemukan: {user_a['user_id']} & {user_b['user_id']} dengan skor {highest_score:.2f}")
-            
-            await create_match(context, user_a, user_b)
-            
-            # Hapus mereka dari antrean dan ulangi loop untuk mencari pasangan terbaik berikutnya
-            waiting_queue = [u for u in waiting_queue if u not in (user_a, user_b)]
-        else:
-            # Jika tidak ada lagi pasangan yang skornya layak, hentikan proses
+    matchmaker = get_matchmaker(context)
+    block_index = get_block_index(context)
+    is_excluded = make_pair_filter(context)
+    queue_size = len(matchmaker)
+    if not queue_size:
+        return
+
+    # Bagian sinkron (penilaian + pengambilan pasangan) dibatasi MATCH_BUDGET_MS;
+    # sisanya ditunda ke putaran berikutnya agar event loop tidak tertahan.
+    started = time.perf_counter()
+    deadline = started + MATCH_BUDGET_MS / 1000
+    flush_deadline = started + MATCH_BUDGET_MS * MATCH_FLUSH_SHARE / 1000
+    offload_scoring(context, matchmaker, block_index.neighbours)
+    budget_hit = not matchmaker.flush(exclude_for=block_index.neighbours, deadline=flush_deadline)
+
+    pairs = []
+    while True:
+        best = matchmaker.pop_best_pair(is_excluded=is_excluded, deadline=deadline)
+        if best is None:
+            budget_hit = budget_hit or matchmaker.timed_out
             break
-            
-    # Simpan sisa antrean yang tidak berhasil dicocokkan
-    context.bot_data['waiting_queue'] = waiting_queue
+        pairs.append(best)
+
+    get_match_stats(context).record(
+        (time.perf_counter() - started) * 1000, budget_hit, matchmaker.coverage, queue_size, len(pairs),
+    )
+    for user_a, user_b, score in pairs:
+        logger.info(f"Pasangan terbaik ditemukan: {user_a.user_id} & {user_b.user_id} dengan skor {score:.2f}")
+        create_match(context, user_a, user_b)
+
+async def matchmaker_loop(application: Application):
+    """Task latar tunggal yang menjalankan try_match_users setiap MATCH_TICK_SECONDS."""
+    context = ContextTypes.DEFAULT_TYPE(application=application)
+    while True:
+        await asyncio.sleep(MATCH_TICK_SECONDS)
+        try:
+            await try_match_users(context)
+        except Exception as e:
+            logger.error(f"Putaran matchmaker gagal: {e}", exc_info=True)
+
+def make_queue_item(context: ContextTypes.DEFAULT_TYPE, user_id: int, profile: dict, is_premium: bool) -> QueueEntry:
+    """Bangun entri antrean pencarian dari profil pengguna."""
+    user_has_filters = profile.get('filter_gender') or profile.get('filter_age_min') or profile.get('filter_distance_km')
+    return QueueEntry.from_profile(
+        user_id, profile, bool(is_premium and user_has_filters),
+        get_interest_index(context).mask_of(user_id),
+    )
+
+async def refresh_queued_user(context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    """Jika user mengubah profil, filter atau status premium saat masih menunggu/online, perbarui datanya di antrean (tanpa kehilangan posisi) dan indeks /find."""
+    matchmaker = get_matchmaker(context)
+    find_index = get_find_index(context)
+    if user_id not in matchmaker and user_id not in find_index:
+        return
+    profile = await get_profile(context, user_id)
+    is_premium = await is_user_pro(context, user_id)
+    if user_id in matchmaker:
+        queue_item = make_queue_item(context, user_id, profile, is_premium)
+        matchmaker.update(queue_item, exclude=get_block_index(context).neighbours(user_id))
+    if user_id in find_index:
+        find_index.put(make_queue_item(context, user_id, profile, is_premium))
 
 @auto_update_profile
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Satu-satunya perintah untuk memulai pencarian. Cerdas & Adaptif."""
     user_id = update.effective_user.id
     chat_partners = context.bot_data.setdefault('chat_partners', {})
-    waiting_queue = context.bot_data.setdefault('waiting_queue', [])
-    db = get_db(context)
+    matchmaker = get_matchmaker(context)
 
     if user_id in chat_partners:
         await update.message.reply_text("**Anda sudah berada dalam sesi chat\\.**\n\nGunakan */next* atau */stop*\\.", parse_mode=ParseMode.MARKDOWN_V2)
         return
-    if any(q['user_id'] == user_id for q in waiting_queue):
+    if user_id in matchmaker:
         await update.message.reply_text("Anda sudah dalam antrian pencarian.")
         return
 
-    profile = await get_user_profile_data(db, user_id)
+    profile = await get_profile(context, user_id)
     if not profile or not profile.get('gender') or not profile.get('age'):
         await update.message.reply_text("Profil Anda belum lengkap. Silakan gunakan /profil untuk melengkapinya.")
         return
 
-    is_premium = await is_user_pro(db, user_id)
-    user_has_filters = profile.get('filter_gender') or profile.get('filter_age_min')
-    use_filters = is_premium and user_has_filters
+    is_premium = await is_user_pro(context, user_id)
+    queue_item = make_queue_item(context, user_id, profile, is_premium)
 
-    if is_premium and not user_has_filters:
+    if is_premium and not queue_item.use_filters:
         await update.message.reply_text("Anda adalah pengguna Premium! ✨\nUntuk pencarian spesifik, atur preferensi di /setfilter\\.\nSaat ini, pencarian akan dilakukan secara acak\\.")
 
     await update.message.reply_text("🔍 Mencari pasangan...")
-    queue_item = {'user_id': user_id, 'use_filters': use_filters, 'profile': profile}
-    waiting_queue.append(queue_item)
-    await try_match_users(context)
+    # Pencocokan dilakukan oleh matchmaker_loop pada tick berikutnya
+    matchmaker.submit(queue_item)
+
+@auto_update_profile
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pencarian terarah (Premium) di antara pengguna yang sedang online atau menunggu, sesuai /setfilter."""
+    user_id = update.effective_user.id
+    chat_partners = context.bot_data.setdefault('chat_partners', {})
+    matchmaker = get_matchmaker(context)
+
+    if user_id in chat_partners:
+        await update.message.reply_text("**Anda sudah berada dalam sesi chat\\.**\n\nGunakan */next* atau */stop*\\.", parse_mode=ParseMode.MARKDOWN_V2)
+        return
+    if not await is_user_pro(context, user_id):
+        await update.message.reply_text("Fitur /find khusus pengguna Premium ✨\nDapatkan akses Premium lewat /toko.")
+        return
+
+    profile = await get_profile(context, user_id)
+    if not profile or not profile.get('gender') or not profile.get('age'):
+        await update.message.reply_text("Profil Anda belum lengkap. Silakan gunakan /profil untuk melengkapinya.")
+        return
+
+    entry = make_queue_item(context, user_id, profile, True)
+    wanted_interests = [name for name in (profile.get('filter_interests') or '').split(',') if name]
+    find_index = get_find_index(context)
+    find_index.expire(keep=lambda uid: uid in matchmaker)
+    is_excluded = make_pair_filter(context)
+    results = find_index.search(
+        entry, interests=wanted_interests,
+        exclude=lambda uid: uid in chat_partners or is_excluded(user_id, uid),
+        limit=FIND_TOP_K, deadline=time.perf_counter() + FIND_BUDGET_MS / 1000,
+    )
+
+    # Kandidat terbaik yang sedang menunggu langsung dipasangkan
+    for score, partner_id in results:
+        if partner_id in matchmaker:
+            matchmaker.remove(user_id)
+            partner = matchmaker.remove(partner_id)
+            logger.info(f"/find: {user_id} dipasangkan dengan {partner_id} dengan skor {score:.2f}")
+            create_match(context, entry, partner)
+            return
+
+    # Tidak ada yang menunggu: masuk antrean dengan filter, kandidat online akan cocok begitu mereka /search
+    if user_id not in matchmaker:
+        matchmaker.submit(entry)
+    if not results:
+        await update.message.reply_text("Belum ada pengguna online yang sesuai filter Anda.\n🔍 Anda dimasukkan ke antrean pencarian dengan filter tersebut.")
+        return
+
+    lines = []
+    for score, partner_id in results:
+        candidate = find_index.get(partner_id)
+        line = f"• {candidate.gender}, {candidate.age} th"
+        if entry.located and candidate.located:
+            line += f", ±{haversine_distance(entry.latitude, entry.longitude, candidate.latitude, candidate.longitude):.0f} km"
+        lines.append(f"{line} (kecocokan {score:.0f}%)")
+    await update.message.reply_text(
+        f"Ditemukan {len(results)} pengguna online yang sesuai filter Anda:\n" + "\n".join(lines) +
+        "\n\n🔍 Anda dimasukkan ke antrean pencarian; Anda akan langsung dipasangkan begitu salah satu dari mereka mencari pasangan."
+    )
 
 @auto_update_profile
 async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -985,13 +1283,15 @@ async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     chat_partners = context.bot_data.setdefault('chat_partners', {})
     
-    if user_id in chat_partners:
-        session_info = chat_partners[user_id]
+    session_info = chat_partners.pop(user_id, None)
+    if session_info:
+        # Lepas kedua pihak sebelum await pertama: pesan partner tidak lagi direlay dan /stop dari
+        # partner di saat yang sama tidak mengakhiri sesi yang sama dua kali
         partner_id, session_id = session_info['partner_id'], session_info['session_id']
-        db = get_db(context)
-
-        await db.execute("UPDATE chat_sessions SET end_time = ?, status = 'ended' WHERE session_id = ?", (datetime.now(timezone.utc).isoformat(), session_id))
-        await db.commit()
+        chat_partners.pop(partner_id, None)
+        # Pesan relay yang belum terkirim dibuang agar tidak sampai setelah pemberitahuan berhenti
+        get_relay_queues(context).close_session(session_id, user_id, partner_id)
+        get_writes(context).execute("UPDATE chat_sessions SET end_time = ?, status = 'ended' WHERE session_id = ?", (datetime.now(timezone.utc).isoformat(), session_id))
         
         await safe_send_message(context.bot, partner_id, "Pasangan Anda telah menghentikan obrolan.")
         
@@ -999,9 +1299,6 @@ async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Anda telah menghentikan sesi.", reply_markup=InlineKeyboardMarkup(feedback_keyboard))
         await safe_send_message(context.bot, partner_id, "Sesi telah berakhir.", reply_markup=InlineKeyboardMarkup(feedback_keyboard))
         
-        chat_partners.pop(user_id, None)
-        chat_partners.pop(partner_id, None)
-        
     elif remove_from_queue(context, user_id):
         await update.message.reply_text("Pencarian pasangan telah dibatalkan.")
     else:
@@ -1013,29 +1310,85 @@ async def next_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await stop_command(update, context)
     context.job_queue.run_once(lambda ctx: asyncio.create_task(search_command(update, ctx)), 0.5, name=f"next_search_{update.effective_user.id}")
 
+async def force_end_session(context: ContextTypes.DEFAULT_TYPE, user_id: int, notice: str):
+    """Akhiri sesi chat user tanpa Update (misal relay gagal): tutup sesi di DB, lepas pasangan, kirim menu feedback ke keduanya."""
+    chat_partners = context.bot_data.setdefault('chat_partners', {})
+    session_info = chat_partners.pop(user_id, None)
+    if not session_info: return
+    partner_id, session_id = session_info['partner_id'], session_info['session_id']
+    chat_partners.pop(partner_id, None)
+    get_relay_queues(context).close_session(session_id, user_id, partner_id)
+
+    get_writes(context).execute("UPDATE chat_sessions SET end_time = ?, status = 'ended' WHERE session_id = ?", (datetime.now(timezone.utc).isoformat(), session_id))
+
+    feedback_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("Beri Feedback & Opsi 💬", callback_data=f"feedback_menu_session_{session_id}"), InlineKeyboardButton("Tutup ❌", callback_data="feedback_close")]])
+    await safe_send_message(context.bot, user_id, notice, reply_markup=feedback_keyboard)
+    await safe_send_message(context.bot, partner_id, "Sesi telah berakhir.", reply_markup=feedback_keyboard)
+
+# Semua jenis pesan yang bisa disalin apa adanya dengan copy_message
+RELAY_FILTER = (
+    filters.TEXT | filters.PHOTO | filters.VIDEO | filters.Sticker.ALL | filters.VOICE | filters.ANIMATION |
+    filters.AUDIO | filters.Document.ALL | filters.VIDEO_NOTE | filters.LOCATION | filters.CONTACT | filters.Dice.ALL
+)
+
+async def relay_message(context: ContextTypes.DEFAULT_TYPE, user_id: int, partner_id: int, message) -> bool:
+    """Kirim satu pesan (atau satu album) relay ke partner. False jika pengiriman gagal permanen dan sesi sudah dihentikan."""
+    if isinstance(message, MediaGroup):
+        album = await message.wait()
+    else:
+        album = None
+    if get_typing_throttle(context).should_send(partner_id):
+        try:
+            await context.bot.send_chat_action(chat_id=partner_id, action=ChatAction.TYPING)
+        except telegram.error.TelegramError:
+            pass  # Indikator hanya kosmetik; kegagalan sebenarnya akan terlihat di copy_message
+
+    try:
+        # copy_message menyalin konten & caption tanpa label "diteruskan dari", jadi identitas pengirim tetap tersembunyi
+        if album:
+            # copy_messages mempertahankan pengelompokan album: satu panggilan API untuk seluruh album
+            await context.bot.copy_messages(chat_id=partner_id, from_chat_id=album[0].chat_id, message_ids=sorted(m.message_id for m in album))
+        else:
+            await context.bot.copy_message(chat_id=partner_id, from_chat_id=message.chat_id, message_id=message.message_id)
+    except telegram.error.Forbidden as e:
+        logger.error(f"Gagal relay pesan dari {user_id} ke {partner_id}: {e}")
+        await force_end_session(context, user_id, "Gagal mengirim pesan. Sesi dihentikan.")
+        return False
+    except telegram.error.BadRequest as e:
+        if "chat not found" in str(e).lower():
+            logger.error(f"Gagal relay pesan dari {user_id} ke {partner_id}: {e}")
+            await force_end_session(context, user_id, "Gagal mengirim pesan. Sesi dihentikan.")
+            return False
+        logger.warning(f"Pesan dari {user_id} tidak dapat disalin ke {partner_id}: {e}")
+        await safe_send_message(context.bot, user_id, "Jenis pesan ini tidak dapat dikirim ke pasangan Anda.")
+    except telegram.error.TelegramError as e:
+        # RetryAfter sudah diulang oleh OutboundScheduler; sisanya dianggap sementara
+        logger.error(f"Gagal relay pesan dari {user_id} ke {partner_id}: {e}")
+        await safe_send_message(context.bot, user_id, "Gagal mengirim pesan, silakan coba lagi.")
+    return True
+
 async def direct_relay_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Relay messages between chat partners"""
+    """Relay messages between chat partners lewat antrean berurutan per sesi (satu copy_message per pesan)"""
     user_id = update.effective_user.id
     chat_partners = context.bot_data.setdefault('chat_partners', {})
     if user_id not in chat_partners: return
     
     session_info = chat_partners.get(user_id)
     if not session_info: return
-    partner_id = session_info['partner_id']
+    partner_id, session_id = session_info['partner_id'], session_info['session_id']
     message = update.message
-    await context.bot.send_chat_action(chat_id=partner_id, action=ChatAction.TYPING)
-    
-    try:
-        if message.text: await context.bot.send_message(partner_id, text=message.text)
-        elif message.photo: await context.bot.send_photo(partner_id, photo=message.photo[-1].file_id, caption=message.caption)
-        elif message.video: await context.bot.send_video(partner_id, video=message.video.file_id, caption=message.caption)
-        elif message.voice: await context.bot.send_voice(partner_id, voice=message.voice.file_id)
-        elif message.sticker: await context.bot.send_sticker(partner_id, sticker=message.sticker.file_id)
-    except Exception as e:
-        logger.error(f"Gagal relay pesan dari {user_id} ke {partner_id}: {e}")
-        await update.message.reply_text("Gagal mengirim pesan. Sesi dihentikan.")
-        # Lakukan pembersihan paksa di sini
-        stop_command(update, context)
+
+    if message.media_group_id:
+        # Item album berikutnya hanya ditambahkan ke album yang sudah diantrekan saat item pertama datang
+        message = get_media_groups(context).add(user_id, message.media_group_id, message)
+        if message is None: return
+
+    queue = get_relay_queues(context).get(
+        session_id, user_id, lambda queued: relay_message(context, user_id, partner_id, queued)
+    )
+    if not queue.put(message) and queue.dropped == 1:
+        # Partner sedang kena rate limit dan antrean penuh: beri tahu sekali per gelombang pesan
+        await update.message.reply_text("⏳ Anda mengirim terlalu cepat. Beberapa pesan tidak terkirim, tunggu sebentar.")
 
 # =============================
 # FEEDBACK HANDLERS
@@ -1043,14 +1396,13 @@ async def direct_relay_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def _build_and_update_feedback_menu(query: Update, context: ContextTypes.DEFAULT_TYPE, session_id: int, custom_message: str = None):
     """Membangun dan menampilkan menu feedback Like/Dislike berdasarkan status saat ini."""
-    db = get_db(context)
+    db = get_reader(context)
     user_id = query.from_user.id
     
     # Gunakan aiosqlite.Row untuk akses kolom via nama
-    db.row_factory = aiosqlite.Row
     async with db.execute("SELECT * FROM chat_sessions WHERE session_id = ?", (session_id,)) as cursor:
+        cursor.row_factory = aiosqlite.Row
         session = await cursor.fetchone()
-    db.row_factory = None # Reset ke default
 
     if not session:
         await query.edit_message_text("❌ Error: Sesi ini tidak valid lagi.")
@@ -1060,7 +1412,7 @@ async def _build_and_update_feedback_menu(query: Update, context: ContextTypes.D
     is_user1 = (session['user1_id'] == user_id)
     
     user_rating = session['user1_rating'] if is_user1 else session['user2_rating']
-    is_partner_blocked = await is_blocked(db, user_id, partner_id)
+    is_partner_blocked = get_block_index(context).is_blocked(user_id, partner_id)
 
     # Bangun Teks Pesan
     message_parts = [custom_message or "Silakan memberikan feedback untuk partner"]
@@ -1110,9 +1462,9 @@ async def rate_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     rating_value = 1 if action == 'like' else -1
     
     rater_id = query.from_user.id
-    db = get_db(context)
+    writes = get_writes(context)
 
-    async with db.execute("SELECT user1_id, user2_id FROM chat_sessions WHERE session_id = ?", (session_id,)) as c:
+    async with get_reader(context).execute("SELECT user1_id, user2_id FROM chat_sessions WHERE session_id = ?", (session_id,)) as c:
         users = await c.fetchone()
     if not users: return
     
@@ -1120,18 +1472,19 @@ async def rate_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     is_rater_user1 = (users[0] == rater_id)
 
     rating_field = 'user1_rating' if is_rater_user1 else 'user2_rating'
-    await db.execute(f"UPDATE chat_sessions SET {rating_field} = ? WHERE session_id = ?", (rating_value, session_id))
+    # Rating ditunggu sampai commit karena menu feedback membacanya kembali
+    rating_written = writes.execute(f"UPDATE chat_sessions SET {rating_field} = ? WHERE session_id = ?", (rating_value, session_id))
     
     custom_message = "Feedback Anda disimpan!"
     if rating_value == 1:
-        await update_karma(db, partner_id, 5)
+        update_karma(context, partner_id, 5)
         await query.answer("👍")
     else:
-        await update_karma(db, partner_id, -10)
+        update_karma(context, partner_id, -10)
         await query.answer("👎")
         custom_message = "Jika pengguna ini bermasalah, pertimbangkan untuk Melaporkan atau Memblokirnya."
     
-    await db.commit()
+    await rating_written
     await _build_and_update_feedback_menu(query, context, session_id, custom_message=custom_message)
 
 async def block_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1140,15 +1493,14 @@ async def block_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     session_id = int(query.data.split('_')[-1])
     
     blocker_id = query.from_user.id
-    db = get_db(context)
 
-    async with db.execute("SELECT user1_id, user2_id FROM chat_sessions WHERE session_id = ?", (session_id,)) as c:
+    async with get_reader(context).execute("SELECT user1_id, user2_id FROM chat_sessions WHERE session_id = ?", (session_id,)) as c:
         users = await c.fetchone()
     if not users: return
 
     blocked_id = users[1] if users[0] == blocker_id else users[0]
 
-    await block_user(db, blocker_id=blocker_id, blocked_id=blocked_id)
+    block_user(get_writes(context), get_block_index(context), blocker_id=blocker_id, blocked_id=blocked_id)
     await query.answer("Pengguna diblokir!")
     await _build_and_update_feedback_menu(query, context, session_id, custom_message="Pengguna telah diblokir.")
 
@@ -1182,16 +1534,15 @@ async def submit_report_callback(update: Update, context: ContextTypes.DEFAULT_T
     details = report_details.get(reason_code)
     if not details: return
 
-    db = get_db(context)
     reporter_id = query.from_user.id
     
-    async with db.execute("SELECT user1_id, user2_id FROM chat_sessions WHERE session_id = ?", (session_id,)) as c:
+    async with get_reader(context).execute("SELECT user1_id, user2_id FROM chat_sessions WHERE session_id = ?", (session_id,)) as c:
         users = await c.fetchone()
     if not users: return
         
     reported_id = users[1] if users[0] == reporter_id else users[0]
 
-    await update_karma(db, reported_id, details['penalty'])
+    update_karma(context, reported_id, details['penalty'])
 
     report_message = (
         f"🚨 <b>Laporan Pengguna Baru</b> 🚨\n\n"
@@ -1208,14 +1559,12 @@ async def feedback_done_callback(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     session_id, user_id = int(query.data.split('_')[-1]), query.from_user.id
     
-    db = get_db(context)
-    async with db.execute("SELECT user1_id FROM chat_sessions WHERE session_id = ?", (session_id,)) as c:
+    async with get_reader(context).execute("SELECT user1_id FROM chat_sessions WHERE session_id = ?", (session_id,)) as c:
         res = await c.fetchone()
     if not res: return
         
     feedback_field = 'user1_feedback_given' if res[0] == user_id else 'user2_feedback_given'
-    await db.execute(f"UPDATE chat_sessions SET {feedback_field} = 1 WHERE session_id = ?", (session_id,))
-    await db.commit()
+    get_writes(context).execute(f"UPDATE chat_sessions SET {feedback_field} = 1 WHERE session_id = ?", (session_id,))
     
     await query.answer()
     await query.edit_message_text("Terima kasih atas feedback Anda. ✅")
@@ -1235,15 +1584,14 @@ async def feedback_close_callback(update: Update, context: ContextTypes.DEFAULT_
 async def set_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Memulai atau menampilkan menu utama untuk mengatur filter premium."""
     user_id = update.effective_user.id
-    db = get_db(context)
     
     if update.message:
         if remove_from_queue(context, user_id): await update.message.reply_text("Pencarian dibatalkan.")
-        if not await is_user_pro(db, user_id):
+        if not await is_user_pro(context, user_id):
             await update.message.reply_text("Perintah ini hanya untuk pengguna Premium.")
             return ConversationHandler.END
 
-    profile = await get_user_profile_data(db, user_id)
+    profile = await get_profile(context, user_id)
     if not profile: return ConversationHandler.END
 
     # --- PERBAIKAN DI SINI ---
@@ -1296,10 +1644,9 @@ async def filter_gender_callback(update: Update, context: ContextTypes.DEFAULT_T
 async def set_gender_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     pref = query.data.split('_', 2)[2]
-    db = get_db(context)
     filter_value = None if pref == "any" else pref
-    await db.execute("UPDATE user_profiles SET filter_gender = ? WHERE user_id = ?", (filter_value, query.from_user.id))
-    await db.commit()
+    await write_profile(context, query.from_user.id, "UPDATE user_profiles SET filter_gender = ? WHERE user_id = ?", (filter_value, query.from_user.id))
+    await refresh_queued_user(context, query.from_user.id)
     await query.answer(f"Filter gender diatur ke: {pref.capitalize()}")
     return await set_filter_command(update, context) # Kembali ke menu utama
 
@@ -1310,12 +1657,11 @@ async def filter_age_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def set_filter_age_received(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     text = update.message.text.strip()
-    db = get_db(context)
     try:
         min_age, max_age = map(int, text.split('-'))
         if not 13 <= min_age <= max_age <= 100: raise ValueError
-        await db.execute("UPDATE user_profiles SET filter_age_min = ?, filter_age_max = ? WHERE user_id = ?", (min_age, max_age, update.effective_user.id))
-        await db.commit()
+        await write_profile(context, update.effective_user.id, "UPDATE user_profiles SET filter_age_min = ?, filter_age_max = ? WHERE user_id = ?", (min_age, max_age, update.effective_user.id))
+        await refresh_queued_user(context, update.effective_user.id)
         await update.message.reply_text(f"Filter usia berhasil diatur ke {min_age}-{max_age} tahun.", reply_markup=ReplyKeyboardRemove())
     except (ValueError, IndexError):
         await update.message.reply_text("Format tidak valid. Gunakan `min-max`, contoh: `18-25`.", reply_markup=ReplyKeyboardRemove())
@@ -1330,8 +1676,7 @@ async def filter_interests_menu_callback(update: Update, context: ContextTypes.D
     user_id = query.from_user.id
     
     if is_new or 'temp_filter_interests' not in context.user_data:
-        db = get_db(context)
-        profile = await get_user_profile_data(db, user_id)
+        profile = await get_profile(context, user_id)
         saved_interests = (profile.get('filter_interests') or "").split(',')
         context.user_data['temp_filter_interests'] = [i for i in saved_interests if i]
 
@@ -1352,6 +1697,7 @@ async def filter_interests_menu_callback(update: Update, context: ContextTypes.D
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     display_interests = ", ".join(sorted([i.capitalize() for i in selected_interests])) or "Belum ada"
+    matching_users = len(get_interest_index(context).users_with(selected_interests)) if selected_interests else None
     
     # PERBAIKAN: Escape titik di akhir kalimat
     text = (
@@ -1359,6 +1705,8 @@ async def filter_interests_menu_callback(update: Update, context: ContextTypes.D
         "Pilih minat yang ingin Anda cari\\. Pasangan harus memiliki setidaknya SATU dari minat yang Anda pilih\\.\n\n"
         f"*Filter saat ini:* `{escape_md(display_interests)}`"
     )
+    if matching_users is not None:
+        text += f"\n*Pengguna dengan minat ini:* {matching_users}"
     
     await query.answer()
     try:
@@ -1390,17 +1738,16 @@ async def filter_toggle_interest_callback(update: Update, context: ContextTypes.
 async def filter_save_interests_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Menyimpan filter minat yang dipilih ke database."""
     query = update.callback_query
-    db = get_db(context)
     
     # Ambil data final dari user_data, urutkan, dan gabungkan jadi string
     final_interests = ",".join(sorted(list(set(context.user_data.get('temp_filter_interests', [])))))
     
     # Simpan ke database
-    await db.execute(
+    await write_profile(
+        context, query.from_user.id,
         "UPDATE user_profiles SET filter_interests = ? WHERE user_id = ?",
         (final_interests, query.from_user.id)
     )
-    await db.commit()
     
     await query.answer("Filter minat berhasil disimpan!")
     
@@ -1423,18 +1770,18 @@ async def filter_distance_callback(update: Update, context: ContextTypes.DEFAULT
 async def set_filter_distance_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Menerima dan menyimpan filter jarak."""
     text = update.message.text.strip()
-    db = get_db(context)
     
     if not text.isdigit() or not 1 <= int(text) <= 10000:
         await update.message.reply_text("Input tidak valid. Harap masukkan angka antara 1 dan 10.000.")
         return SET_FILTER_DISTANCE
         
     distance = int(text)
-    await db.execute(
+    await write_profile(
+        context, update.effective_user.id,
         "UPDATE user_profiles SET filter_distance_km = ? WHERE user_id = ?",
         (distance, update.effective_user.id)
     )
-    await db.commit()
+    await refresh_queued_user(context, update.effective_user.id)
     await update.message.reply_text(f"Filter jarak berhasil diatur ke {distance} km.")
     
     # Hapus flag dan kembali ke menu utama filter
@@ -1445,29 +1792,26 @@ async def set_filter_distance_received(update: Update, context: ContextTypes.DEF
 async def filter_reset_interests_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Menghapus filter minat dari database."""
     query = update.callback_query
-    db = get_db(context)
-    await db.execute("UPDATE user_profiles SET filter_interests = NULL WHERE user_id = ?", (query.from_user.id,))
-    await db.commit()
+    await write_profile(context, query.from_user.id, "UPDATE user_profiles SET filter_interests = NULL WHERE user_id = ?", (query.from_user.id,))
     await query.answer("Filter minat dihapus!")
     await set_filter_command(update, context, is_edit=True)
 
 async def filter_reset_distance_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Menghapus filter jarak dari database."""
     query = update.callback_query
-    db = get_db(context)
-    await db.execute("UPDATE user_profiles SET filter_distance_km = NULL WHERE user_id = ?", (query.from_user.id,))
-    await db.commit()
+    await write_profile(context, query.from_user.id, "UPDATE user_profiles SET filter_distance_km = NULL WHERE user_id = ?", (query.from_user.id,))
+    await refresh_queued_user(context, query.from_user.id)
     await query.answer("Filter jarak dihapus!")
     await set_filter_command(update, context, is_edit=True)
     
 async def filter_reset_all_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    db = get_db(context)
-    await db.execute(
+    await write_profile(
+        context, query.from_user.id,
         "UPDATE user_profiles SET filter_gender = NULL, filter_age_min = NULL, filter_age_max = NULL, filter_interests = NULL, filter_distance_km = NULL WHERE user_id = ?",
         (query.from_user.id,)
     )
-    await db.commit()
+    await refresh_queued_user(context, query.from_user.id)
     await query.answer("Semua filter telah dihapus!", show_alert=True)
     return await set_filter_command(update, context)
     
@@ -1496,13 +1840,15 @@ async def process_quiz_answers(context: ContextTypes.DEFAULT_TYPE):
     num_winners = min(5, len(correct_answerers))
     winners = random.sample(correct_answerers, num_winners) if num_winners > 0 else []
     
-    db = get_db(context)
+    # Semua hadiah dalam satu unit tulis; ditunggu sampai commit sebelum pemenang diberi tahu
+    written = get_writes(context).executemany(
+        "UPDATE user_profiles SET koin = koin + 50 WHERE user_id = ?", 
+        [(winner_id,) for winner_id in winners]
+    )
+    for winner_id in winners:
+        get_profile_cache(context).invalidate_after(written, winner_id)
+    await written
     for winner_id in winners:
-        await db.execute(
-            "UPDATE user_profiles SET koin = koin + 50 WHERE user_id = ?", 
-            (winner_id,)
-        )
-        await db.commit()
         await safe_send_message(
             context.bot, 
             winner_id, 
@@ -1515,7 +1861,7 @@ async def process_quiz_answers(context: ContextTypes.DEFAULT_TYPE):
 
 async def quiz_event_callback(context: ContextTypes.DEFAULT_TYPE):
     """Quiz event callback"""
-    db = get_db(context)
+    db = get_reader(context)
     async with db.execute(
         "SELECT question, answer FROM quizzes ORDER BY RANDOM() LIMIT 1"
     ) as c:
@@ -1592,7 +1938,7 @@ async def quiz_event_answer_handler(update: Update, context: ContextTypes.DEFAUL
 
 async def koin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /koin command"""
-    db = get_db(context)
+    db = get_reader(context)
     async with db.execute(
         "SELECT koin FROM user_profiles WHERE user_id = ?", 
         (update.effective_user.id,)
@@ -1607,7 +1953,7 @@ async def koin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def toko_command(update: Update | InlineKeyboardMarkup, context: ContextTypes.DEFAULT_TYPE):
     """Handle /toko command"""
     user_id = update.effective_user.id
-    db = get_db(context)
+    db = get_reader(context)
     async with db.execute(
         "SELECT koin, pro_expires_at FROM user_profiles WHERE user_id = ?", 
         (user_id,)
@@ -1665,35 +2011,41 @@ async def buy_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     user_id = query.from_user.id
-    db = get_db(context)
-    async with db.execute(
-        "SELECT koin, pro_expires_at FROM user_profiles WHERE user_id = ?", 
-        (user_id,)
-    ) as c:
-        koin, current_expiry_str = (await c.fetchone() or [0, None])
-    
-    if koin < item['cost']:
+
+    async def purchase(db):
+        # Baca saldo dan potong koin dalam satu unit tulis, agar hadiah kuis yang masuk bersamaan tidak tertimpa
+        async with db.execute(
+            "SELECT koin, pro_expires_at FROM user_profiles WHERE user_id = ?", 
+            (user_id,)
+        ) as c:
+            koin, current_expiry_str = (await c.fetchone() or [0, None])
+        if koin < item['cost']:
+            return None
+
+        now = datetime.now(timezone.utc)
+        start_time = now
+        
+        if current_expiry_str:
+            current_expiry = datetime.fromisoformat(current_expiry_str)
+            if current_expiry > now: 
+                start_time = current_expiry
+
+        new_expiry = start_time + item['duration']
+        await db.execute(
+            "UPDATE user_profiles SET koin = koin - ?, pro_expires_at = ? WHERE user_id = ?", 
+            (item['cost'], new_expiry.isoformat(), user_id)
+        )
+        return new_expiry
+
+    # Ditunggu sampai commit: pembelian harus tahan lama sebelum dikonfirmasi
+    new_expiry = await get_profile_cache(context).invalidate_after(get_writes(context).run(purchase), user_id)
+    if new_expiry is None:
         await query.answer("Maaf, koin Anda tidak cukup.", show_alert=False)
         return
+    # Status premium mengaktifkan filter pengguna di antrean dan indeks /find
+    await refresh_queued_user(context, user_id)
     
     await query.answer()
-    new_koin = koin - item['cost']
-    
-    now = datetime.now(timezone.utc)
-    start_time = now
-    
-    if current_expiry_str:
-        current_expiry = datetime.fromisoformat(current_expiry_str)
-        if current_expiry > now: 
-            start_time = current_expiry
-
-    new_expiry = start_time + item['duration']
-    
-    await db.execute(
-        "UPDATE user_profiles SET koin = ?, pro_expires_at = ? WHERE user_id = ?", 
-        (new_koin, new_expiry.isoformat(), user_id)
-    )
-    await db.commit()
     
     formatted_expiry = escape_md(new_expiry.strftime('%d-%m-%Y %H:%M'))
     success_text = (
@@ -1786,7 +2138,7 @@ async def confirm_maintenance(update: Update, context: ContextTypes.DEFAULT_TYPE
 @owner_only
 async def prune_sessions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Memulai proses pembersihan data sesi chat yang sudah 'dingin' dan lama."""
-    db = get_db(context)
+    db = get_reader(context)
     two_months_ago_iso = (datetime.now(timezone.utc) - timedelta(days=60)).isoformat()
     
     async with db.execute(
@@ -1813,15 +2165,13 @@ async def confirm_prune_sessions_callback(update: Update, context: ContextTypes.
     query = update.callback_query
     await query.answer()
     await query.edit_message_text("⚙️ Sedang memproses pembersihan data...", reply_markup=None)
-    db = get_db(context)
     cutoff_date_iso = (datetime.now(timezone.utc) - timedelta(days=60)).isoformat()
     
-    cursor = await db.execute(
+    deleted = await get_writes(context).execute(
         """DELETE FROM chat_sessions WHERE start_time < ? AND user1_feedback_given = 1 AND user2_feedback_given = 1""", 
         (cutoff_date_iso,)
     )
-    await db.commit()
-    await query.edit_message_text(f"✅ **Pembersihan Selesai**. Sebanyak *{cursor.rowcount}* data sesi lama telah dihapus.", parse_mode=ParseMode.MARKDOWN)
+    await query.edit_message_text(f"✅ **Pembersihan Selesai**. Sebanyak *{deleted.rowcount}* data sesi lama telah dihapus.", parse_mode=ParseMode.MARKDOWN)
     
 @owner_only
 async def add_quiz_start(update, context):
@@ -1840,19 +2190,17 @@ async def quiz_answer_received(update, context):
     question = context.user_data.pop('new_quiz_question')
     answer = update.message.text
     
-    db = get_db(context)
-    await db.execute(
+    await get_writes(context).execute(
         "INSERT INTO quizzes (question, answer) VALUES (?, ?)", 
         (question, answer)
     )
-    await db.commit()
     await update.message.reply_text("Kuis disimpan!")
     return ConversationHandler.END
 
 @owner_only
 async def list_quizzes(update, context):
     """List all quizzes"""
-    db = get_db(context)
+    db = get_reader(context)
     async with db.execute(
         "SELECT id, question, answer FROM quizzes ORDER BY id"
     ) as c:
@@ -1883,12 +2231,10 @@ async def delete_quiz(update, context):
         
     try:
         qid = int(context.args[0])
-        db = get_db(context)
-        await db.execute(
+        await get_writes(context).execute(
             "DELETE FROM quizzes WHERE id = ?", 
             (qid,)
         )
-        await db.commit()
         await update.message.reply_text(f"Kuis ID {qid} dihapus.")
     except (ValueError, IndexError): 
         await update.message.reply_text("ID tidak valid.")
@@ -1908,6 +2254,22 @@ async def start_quiz_now(update: Update, context: ContextTypes.DEFAULT_TYPE):
         name="manual_quiz_event_admin"
     )
 
+@owner_only
+async def match_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Tampilkan statistik putaran matchmaker untuk menyetel MATCH_BUDGET_MS."""
+    stats = get_match_stats(context)
+    matchmaker = get_matchmaker(context)
+    await update.message.reply_text(
+        f"📊 Statistik Matchmaker\n\n"
+        f"Antrean: {len(matchmaker)} (belum dinilai: {matchmaker.pending_count}, heap: {matchmaker.heap_size})\n"
+        f"Cakupan saat ini: {matchmaker.coverage:.1%}\n\n"
+        f"Putaran: {stats.passes}, pasangan: {stats.pairs}\n"
+        f"Budget {MATCH_BUDGET_MS} ms tercapai: {stats.budget_hits}x ({stats.budget_hit_rate:.1%})\n"
+        f"Rata-rata cakupan: {stats.avg_coverage:.1%}\n"
+        f"Putaran terakhir: {stats.last_pass_ms:.1f} ms, antrean {stats.last_queue_size}, cakupan {stats.last_coverage:.1%}\n"
+        f"Putaran terlama: {stats.max_pass_ms:.1f} ms"
+    )
+
 @owner_only
 async def grant_pro(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Grant premium status to user"""
@@ -1923,10 +2285,8 @@ async def grant_pro(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Format salah. Gunakan: /grantpro <user_id> <jumlah_hari>")
         return
 
-    db = get_db(context)
-    
     # Check if user exists
-    async with db.execute(
+    async with get_reader(context).execute(
         "SELECT pro_expires_at FROM user_profiles WHERE user_id = ?", 
         (user_id,)
     ) as cursor:
@@ -1955,11 +2315,12 @@ async def grant_pro(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_expiry = start_time + timedelta(days=duration_days)
     
     # Update database
-    await db.execute(
+    await write_profile(
+        context, user_id,
         "UPDATE user_profiles SET pro_expires_at = ? WHERE user_id = ?", 
         (new_expiry.isoformat(), user_id)
     )
-    await db.commit()
+    await refresh_queued_user(context, user_id)
     
     # Send confirmation to admin and notification to user
     formatted_expiry = new_expiry.strftime('%d-%m-%Y %H:%M')
@@ -2044,12 +2405,13 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
 async def run_startup_tasks(application: Application):
     """Menjalankan tugas setelah bot siap."""
     application.job_queue.run_once(broadcast_startup_job, 3)
+    application.job_queue.run_repeating(prune_find_index, FIND_PRUNE_INTERVAL_SECONDS, name="prune_find_index")
     schedule_next_quiz_event(application.job_queue)
     logger.info("Tugas startup telah dijadwalkan.")
 
 async def broadcast_startup_job(context: ContextTypes.DEFAULT_TYPE):
     """Tugas yang sebenarnya untuk mengirim broadcast startup."""
-    db = get_db(context)
+    db = get_reader(context)
     all_user_ids = []
     async with db.execute("SELECT user_id FROM user_profiles") as cursor:
         rows = await cursor.fetchall()
@@ -2058,14 +2420,14 @@ async def broadcast_startup_job(context: ContextTypes.DEFAULT_TYPE):
 
     logger.info(f"Memulai broadcast startup ke {len(all_user_ids)} pengguna...")
     startup_text = escape_md("✅ Bot Kembali Online ✅\n\nTerima kasih telah menunggu! Bot sekarang sudah aktif dan siap digunakan kembali. Selamat mengobrol!")
-    tasks = [safe_send_message(context.bot, uid, startup_text, parse_mode=ParseMode.MARKDOWN_V2) for uid in all_user_ids]
+    tasks = [safe_send_message(context.bot, uid, startup_text, parse_mode=ParseMode.MARKDOWN_V2, rate_limit_args=BULK_RATE_LIMIT_ARGS) for uid in all_user_ids]
     await asyncio.gather(*tasks)
     logger.info("Broadcast startup selesai.")
 
 
 async def broadcast_shutdown(application: Application):
     """Broadcasts a neater shutdown countdown, updating every second."""
-    db = get_db(ContextTypes.DEFAULT_TYPE(application=application))
+    db = get_reader(ContextTypes.DEFAULT_TYPE(application=application))
     all_user_ids = []
     async with db.execute("SELECT user_id FROM user_profiles") as cursor:
         rows = await cursor.fetchall()
@@ -2081,7 +2443,7 @@ async def broadcast_shutdown(application: Application):
     initial_text = f"🔧 PENGUMUMAN 🔧\n\nBot akan segera offline untuk pemeliharaan. Shutdown dalam: {countdown_seconds} detik."
     
     sent_messages = await asyncio.gather(
-        *[safe_send_message(application.bot, uid, initial_text) for uid in all_user_ids]
+        *[safe_send_message(application.bot, uid, initial_text, rate_limit_args=BULK_RATE_LIMIT_ARGS) for uid in all_user_ids]
     )
     
     for i, msg in enumerate(sent_messages):
@@ -2093,26 +2455,26 @@ async def broadcast_shutdown(application: Application):
         # Tidak ada lagi 'if i in intervals', jadi ini akan berjalan setiap detik
         text = f"🔧 PENGUMUMAN 🔧\n\nBot akan segera offline untuk pemeliharaan. Shutdown dalam: {i} detik."
         await asyncio.gather(
-            *[safe_edit_message_text(application.bot, text, uid, mid) for uid, mid in broadcast_messages.items()]
+            *[safe_edit_message_text(application.bot, text, uid, mid, rate_limit_args=BULK_RATE_LIMIT_ARGS) for uid, mid in broadcast_messages.items()]
         )
 
     # Menampilkan pesan "0 detik" atau "Shutdown..." sebelum pesan final
     await asyncio.sleep(1)
     final_countdown_text = "🔧 PENGUMUMAN 🔧\n\nBot sedang dalam proses shutdown..."
     await asyncio.gather(
-        *[safe_edit_message_text(application.bot, final_countdown_text, uid, mid) for uid, mid in broadcast_messages.items()]
+        *[safe_edit_message_text(application.bot, final_countdown_text, uid, mid, rate_limit_args=BULK_RATE_LIMIT_ARGS) for uid, mid in broadcast_messages.items()]
     )
     await asyncio.sleep(0.5) # Jeda singkat
 
     # --- PERBAIKAN 3: MEMPERBAIKI NameError DENGAN LOOP YANG BENAR ---
     final_text = "Bot sedang offline. Sampai jumpa lagi! 👋"
     await asyncio.gather(
-        *[safe_send_message(application.bot, uid, final_text) for uid in all_user_ids]
+        *[safe_send_message(application.bot, uid, final_text, rate_limit_args=BULK_RATE_LIMIT_ARGS) for uid in all_user_ids]
     )
     
     # Hapus pesan countdown setelah selesai
     await asyncio.gather(
-        *[application.bot.delete_message(chat_id=uid, message_id=mid) for uid, mid in broadcast_messages.items()]
+        *[application.bot.delete_message(chat_id=uid, message_id=mid, rate_limit_args=BULK_RATE_LIMIT_ARGS) for uid, mid in broadcast_messages.items()]
     )
     logger.info("Broadcast shutdown selesai.")
 
@@ -2127,12 +2489,31 @@ async def main() -> None:
         ApplicationBuilder()
         .token(BOT_TOKEN)
         .persistence(PicklePersistence(filepath="bot_persistence.pkl"))
+        .rate_limiter(OutboundScheduler(OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST))
+        .concurrent_updates(UserOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES, UPDATE_LOCK_SHARDS))
         .build()
     )
     
     try:
-        application.db_connection = await aiosqlite.connect('bot_database.db')
+        application.database = await Database(DB_PATH, DB_READERS).open()
+        application.db_connection = application.database.writer
+        application.db_readers = application.database.readers
         await init_db(application.db_connection)
+        application.block_index = await load_block_index(application.db_connection)
+        application.interest_index = await load_interest_index(application.db_connection)
+        application.db_writes = WriteQueue(application.db_connection, WRITE_BATCH_MS, WRITE_BATCH_MAX)
+        application.db_writes.start()
+        application.profile_cache = ProfileCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL_SECONDS)
+        application.known_users = await load_known_users(application.db_connection)
+        application.session_ids = await IdAllocator(application.db_writes, 'chat_sessions', SESSION_ID_BLOCK).start()
+        application.match_stats = MatchStats()
+        application.match_executor = make_match_executor()
+        application.match_offload = None
+        application.recent_pairs = RecentPairs(REMATCH_WINDOW_SECONDS)
+        application.find_index = FindIndex(ONLINE_WINDOW_SECONDS, application.interest_index)
+        application.typing_throttle = TypingThrottle(RELAY_TYPING_INTERVAL_SECONDS)
+        application.relay_queues = RelayQueues(RELAY_QUEUE_SIZE)
+        application.media_groups = MediaGroupBuffer(RELAY_ALBUM_WINDOW_SECONDS)
     except Exception as e:
         logger.critical(f"KRITIS: Gagal koneksi DB: {e}")
         return
@@ -2233,6 +2614,7 @@ async def main() -> None:
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("find", find_command))
     application.add_handler(CommandHandler("stop", stop_command))
     application.add_handler(CommandHandler("next", next_command))
     application.add_handler(CommandHandler("koin", koin_command))
@@ -2245,6 +2627,7 @@ async def main() -> None:
     application.add_handler(CommandHandler("grantpro", grant_pro))
     application.add_handler(CommandHandler("prunesessions", prune_sessions_command))
     application.add_handler(CommandHandler("maintenance", maintenance_command))
+    application.add_handler(CommandHandler("matchstats", match_stats_command))
     
     # Global CallbackQuery Handlers
     application.add_handler(CallbackQueryHandler(show_full_feedback_menu_callback, pattern="^feedback_menu_session_"))
@@ -2260,7 +2643,7 @@ async def main() -> None:
 
     # Message Handlers (diurutkan berdasarkan prioritas)
     application.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.TEXT & ~filters.COMMAND, quiz_event_answer_handler), group=-1)
-    application.add_handler(MessageHandler(filters.ChatType.PRIVATE & (filters.TEXT | filters.PHOTO | filters.VIDEO | filters.Sticker.ALL | filters.VOICE) & ~filters.COMMAND, direct_relay_handler), group=0)
+    application.add_handler(MessageHandler(filters.ChatType.PRIVATE & RELAY_FILTER & ~filters.COMMAND, direct_relay_handler), group=0)
     
     # Error Handler
     application.add_error_handler(error_handler)
@@ -2268,26 +2651,32 @@ async def main() -> None:
     # --- Run the bot ---
     pid_file = "main_bot.pid"
     with open(pid_file, "w") as f: f.write(str(os.getpid()))
+    matchmaker_task = None
     try:
         await application.initialize()
+        remask_queue(ContextTypes.DEFAULT_TYPE(application=application))
         await reschedule_maintenance_jobs(ContextTypes.DEFAULT_TYPE(application=application))
         await application.updater.start_polling(drop_pending_updates=True)
         await application.start()
+        matchmaker_task = asyncio.create_task(matchmaker_loop(application))
         logger.info("Bot utama berjalan.")
         await shutdown_event.wait()
     finally:
         logger.info("Memulai shutdown bot utama...")
+        if matchmaker_task: matchmaker_task.cancel()
+        if getattr(application, 'match_executor', None): application.match_executor.shutdown(cancel_futures=True)
         if application.updater and application.updater.running: await application.updater.stop()
         if application.running: await application.stop()
         await application.shutdown()
-        if hasattr(application, 'db_connection'): await application.db_connection.close()
+        if hasattr(application, 'db_writes'):
+            # Commit tulisan write-behind yang masih antre sebelum koneksi ditutup
+            await application.db_writes.stop()
+        if hasattr(application, 'database'):
+            await application.database.close()
+            logger.info("Database connection closed.")
         if os.path.exists(pid_file): os.remove(pid_file)
         logger.info("Bot utama telah dimatikan.")
         
-        if hasattr(application, 'db_connection') and application.db_connection:
-            await application.db_connection.close()
-            logger.info("Database connection closed.")
-        
         logger.info("Shutdown complete.")
 
 if __name__ == '__main__':
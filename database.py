@@ -0,0 +1,416 @@
+# ======================================================
+# database.py - Koneksi SQLite (WAL, satu penulis, pool pembaca) untuk bot.py
+# ======================================================
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# WAL: pembaca tidak menunggu penulis. synchronous=NORMAL aman di WAL (tidak korup),
+# hanya transaksi terakhir yang bisa hilang saat listrik mati, dan commit tidak lagi fsync setiap kali.
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+)
+# Dipasang di semua koneksi
+SHARED_PRAGMAS = (
+    "PRAGMA cache_size = -16000",    # ~16 MB page cache per koneksi
+    "PRAGMA mmap_size = 134217728",  # 128 MB
+)
+READER_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    "PRAGMA busy_timeout = 5000",
+)
+
+
+class _PooledCursor:
+    """`async with pool.execute(...) as cursor`: pinjam koneksi pembaca selama blok berjalan."""
+
+    __slots__ = ('_pool', '_sql', '_parameters', '_conn', '_cursor')
+
+    def __init__(self, pool: "ReaderPool", sql: str, parameters):
+        self._pool, self._sql, self._parameters = pool, sql, parameters
+        self._conn = self._cursor = None
+
+    async def __aenter__(self) -> aiosqlite.Cursor:
+        self._conn = await self._pool._idle.get()
+        try:
+            self._cursor = await self._conn.execute(self._sql, self._parameters)
+        except BaseException:
+            self._pool._idle.put_nowait(self._conn)
+            raise
+        return self._cursor
+
+    async def __aexit__(self, *exc_info) -> None:
+        try:
+            await self._cursor.close()
+        finally:
+            self._pool._idle.put_nowait(self._conn)
+
+
+class ReaderPool:
+    """
+    Sekumpulan koneksi baca (query_only) dengan antarmuka baca yang sama seperti
+    aiosqlite.Connection (`async with execute(...)` dan `execute_fetchall`), jadi
+    fungsi yang menerima `db` untuk membaca bisa diberi pool ini tanpa diubah.
+    Setiap koneksi punya thread sendiri, sehingga beberapa bacaan berjalan paralel
+    dan tidak antre di belakang commit penulis.
+    """
+
+    def __init__(self, connections: Iterable[aiosqlite.Connection]):
+        self._connections = list(connections)
+        self._idle = asyncio.Queue()
+        for conn in self._connections:
+            self._idle.put_nowait(conn)
+
+    def __len__(self):
+        return len(self._connections)
+
+    def execute(self, sql: str, parameters: Optional[Iterable] = None) -> _PooledCursor:
+        return _PooledCursor(self, sql, parameters)
+
+    async def execute_fetchall(self, sql: str, parameters: Optional[Iterable] = None) -> list:
+        async with self.execute(sql, parameters) as cursor:
+            return await cursor.fetchall()
+
+    async def close(self) -> None:
+        for conn in self._connections:
+            await conn.close()
+
+
+class Database:
+    """Satu koneksi penulis (semua mutasi) dan pool pembaca, keduanya dalam mode WAL."""
+
+    def __init__(self, path: str, n_readers: int = 3):
+        self.path = path
+        self.n_readers = n_readers
+        self.writer: Optional[aiosqlite.Connection] = None
+        self.readers: Optional[ReaderPool] = None
+
+    async def open(self) -> "Database":
+        self.writer = await aiosqlite.connect(self.path)
+        for pragma in WRITER_PRAGMAS + SHARED_PRAGMAS:
+            await self.writer.execute(pragma)
+        readers = []
+        for _ in range(self.n_readers):
+            conn = await aiosqlite.connect(self.path)
+            for pragma in READER_PRAGMAS + SHARED_PRAGMAS:
+                await conn.execute(pragma)
+            readers.append(conn)
+        self.readers = ReaderPool(readers)
+        return self
+
+    async def close(self) -> None:
+        if self.readers is not None:
+            await self.readers.close()
+            self.readers = None
+        if self.writer is not None:
+            await self.writer.close()
+            self.writer = None
+
+
+# =============================
+# GROUP COMMIT
+# =============================
+
+class WriteResult:
+    """Hasil satu pernyataan tulis yang sudah di-commit."""
+
+    __slots__ = ('lastrowid', 'rowcount')
+
+    def __init__(self, lastrowid: Optional[int], rowcount: int):
+        self.lastrowid = lastrowid
+        self.rowcount = rowcount
+
+
+def _mark_retrieved(future: asyncio.Future) -> None:
+    # Kegagalan sudah dicatat oleh WriteQueue; tulisan write-behind yang tidak di-await tidak perlu peringatan asyncio
+    if not future.cancelled():
+        future.exception()
+
+
+class WriteQueue:
+    """
+    Write-behind dengan group commit di atas koneksi penulis. Handler
+    mengantrekan unit tulis (satu pernyataan, executemany, atau fungsi async
+    untuk beberapa pernyataan yang harus atomik) dan langsung lanjut; satu task
+    menjalankan unit yang terkumpul dalam satu transaksi setiap `interval_ms`
+    atau begitu ada `max_batch` unit, jadi banyak handler berbagi satu fsync.
+
+    Setiap unit mengembalikan Future yang selesai *setelah* commit. Await Future
+    itu jika butuh durabilitas (pembelian koin) atau akan segera membaca
+    datanya lewat pool pembaca. Setiap unit dibungkus SAVEPOINT, sehingga unit
+    yang gagal hanya membatalkan dirinya sendiri, bukan seluruh batch.
+    """
+
+    def __init__(self, conn: aiosqlite.Connection, interval_ms: float = 5, max_batch: int = 256):
+        self.conn = conn
+        self.interval_ms = interval_ms
+        self.max_batch = max_batch
+        self._pending = []  # (fungsi(conn), Future)
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = None
+        self._closing = False
+        self.batches = 0
+        self.units = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Commit semua yang masih antre lalu hentikan task (tidak dibatalkan di tengah transaksi)."""
+        self._closing = True
+        self._wakeup.set()
+        self._full.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        while self._pending:
+            await self._flush()
+
+    def execute(self, sql: str, parameters: Iterable = ()) -> asyncio.Future:
+        async def unit(conn):
+            cursor = await conn.execute(sql, parameters)
+            try:
+                return WriteResult(cursor.lastrowid, cursor.rowcount)
+            finally:
+                await cursor.close()
+        return self.run(unit)
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable) -> asyncio.Future:
+        async def unit(conn):
+            cursor = await conn.executemany(sql, seq_of_parameters)
+            try:
+                return WriteResult(None, cursor.rowcount)
+            finally:
+                await cursor.close()
+        return self.run(unit)
+
+    def run(self, fn) -> asyncio.Future:
+        """Antrekan `fn(conn)` sebagai satu unit atomik; hasilnya diteruskan lewat Future."""
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_mark_retrieved)
+        self._pending.append((fn, future))
+        self._wakeup.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        return future
+
+    async def _run(self) -> None:
+        while not (self._closing and not self._pending):
+            await self._wakeup.wait()
+            if len(self._pending) < self.max_batch and not self._closing:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval_ms / 1000)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush()
+
+    async def _flush(self) -> None:
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if not self._pending:
+            self._wakeup.clear()
+        if len(self._pending) < self.max_batch and not self._closing:
+            self._full.clear()
+        if not batch:
+            return
+
+        results = []
+        try:
+            await self.conn.execute("BEGIN")
+            for fn, future in batch:
+                await self.conn.execute("SAVEPOINT unit")
+                try:
+                    results.append((future, True, await fn(self.conn)))
+                    await self.conn.execute("RELEASE unit")
+                except Exception as e:
+                    await self.conn.execute("ROLLBACK TO unit")
+                    await self.conn.execute("RELEASE unit")
+                    logger.error(f"Unit tulis gagal dan dibatalkan: {e}")
+                    results.append((future, False, e))
+            await self.conn.commit()
+        except Exception as e:
+            logger.critical(f"Commit batch tulis ({len(batch)} unit) gagal: {e}")
+            try:
+                await self.conn.rollback()
+            except Exception:
+                pass
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.units += len(batch)
+        for future, ok, value in results:
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+# =============================
+# ID BERURUTAN
+# =============================
+
+class IdAllocator:
+    """
+    Id berurutan (mis. chat_sessions.session_id) yang dibagikan dari memori,
+    agar pemanggil tidak perlu menunggu INSERT untuk tahu id-nya. Batas id
+    yang boleh dibagikan dicatat di tabel `id_reservations` per `block_size`:
+    blok pertama di-commit saat startup, blok berikutnya diantrekan lewat
+    WriteQueue begitu sisa cadangan tinggal setengah blok. Karena WriteQueue
+    FIFO, cadangan ter-commit paling lambat bersama baris pertama yang memakai
+    id-nya, jadi setelah crash atau restart id yang sudah dibagikan tidak
+    dibagikan lagi walaupun barisnya belum sempat ditulis. Sisa blok terakhir
+    menjadi celah, bukan duplikat.
+    """
+
+    def __init__(self, writes: WriteQueue, name: str, block_size: int = 1000):
+        self.writes = writes
+        self.name = name
+        self.block_size = block_size
+        self._next = self._limit = 0  # id berikutnya; batas cadangan yang sudah diantrekan
+
+    async def start(self) -> "IdAllocator":
+        """Cadangkan blok pertama dari tabel dan tunggu commit-nya; panggil saat startup setelah WriteQueue berjalan."""
+        async def reserve(conn):
+            async with conn.execute(
+                "UPDATE id_reservations SET next_id = next_id + ? WHERE name = ? RETURNING next_id",
+                (self.block_size, self.name),
+            ) as c:
+                (limit,) = await c.fetchone()
+            return limit
+        self._limit = await self.writes.run(reserve)
+        self._next = self._limit - self.block_size
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> int:
+        if self._limit - self._next <= self.block_size // 2:
+            self._limit += self.block_size
+            self.writes.execute("UPDATE id_reservations SET next_id = ? WHERE name = ?", (self._limit, self.name))
+        allocated, self._next = self._next, self._next + 1
+        return allocated
+
+
+# =============================
+# PROFILE CACHE
+# =============================
+
+# Kolom tabel user_profiles, urutannya sama dengan init_db di bot.py
+PROFILE_FIELDS = (
+    'user_id', 'username', 'gender', 'age', 'bio', 'koin', 'pro_expires_at', 'karma',
+    'profile_pic_id', 'interests', 'latitude', 'longitude', 'filter_gender',
+    'filter_age_min', 'filter_age_max', 'filter_interests', 'filter_distance_km',
+)
+PROFILE_SELECT = f"SELECT {', '.join(PROFILE_FIELDS)} FROM user_profiles WHERE user_id = ?"
+
+
+class ProfileRecord:
+    """
+    Satu baris user_profiles dengan __slots__. Mendukung `profile['age']` dan
+    `profile.get('age')` seperti dict hasil `get_user_profile_data` sebelumnya.
+    Dibagikan lewat cache, jadi perlakukan sebagai read-only.
+    """
+
+    __slots__ = PROFILE_FIELDS
+
+    def __init__(self, row: tuple):
+        for name, value in zip(PROFILE_FIELDS, row):
+            setattr(self, name, value)
+
+    def get(self, name: str, default=None):
+        return getattr(self, name, default) if name in PROFILE_FIELDS else default
+
+    def __getitem__(self, name: str):
+        if name not in PROFILE_FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __repr__(self):
+        return f"ProfileRecord(user_id={self.user_id!r})"
+
+
+class ProfileCache:
+    """
+    Cache LRU + TTL untuk ProfileRecord. Setiap tulisan ke user_profiles harus
+    memanggil `invalidate` (atau `invalidate_after` dengan Future dari
+    WriteQueue) agar pembacaan berikutnya memuat ulang dari SQLite.
+
+    Setiap invalidasi menaikkan `generation` dan mencatatnya untuk user itu;
+    `put` dengan generasi dari sebelum invalidasi terakhir user tersebut
+    diabaikan, sehingga bacaan yang dimulai sebelum sebuah commit tidak bisa
+    menyimpan baris lama kembali ke cache. Tulisan untuk user lain tidak
+    membatalkan pengisian cache yang sedang berjalan. Catatan invalidasi
+    dibatasi `max_size`; yang terlama dibuang dan generasinya menjadi batas
+    bawah untuk semua user, jadi paling buruk sebuah pengisian ditolak tanpa perlu.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_sec: float = 300):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self._records = OrderedDict()  # user_id -> (ProfileRecord, kedaluwarsa)
+        self._invalidated = OrderedDict()  # user_id -> generasi invalidasi terakhir, terlama di depan
+        self._floor = 0  # generasi invalidasi terbaru yang catatannya sudah dibuang
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, user_id: int):
+        return user_id in self._records
+
+    def get(self, user_id: int, now: Optional[float] = None) -> Optional[ProfileRecord]:
+        cached = self._records.get(user_id)
+        if cached is None:
+            self.misses += 1
+            return None
+        record, expires_at = cached
+        if expires_at <= (time.monotonic() if now is None else now):
+            del self._records[user_id]
+            self.misses += 1
+            return None
+        self._records.move_to_end(user_id)
+        self.hits += 1
+        return record
+
+    def put(self, user_id: int, record: ProfileRecord, generation: int, now: Optional[float] = None) -> None:
+        """Simpan hasil bacaan; `generation` adalah nilai `self.generation` sebelum membaca dari SQLite."""
+        if self._invalidated.get(user_id, self._floor) > generation:
+            return
+        self._records[user_id] = (record, (time.monotonic() if now is None else now) + self.ttl_sec)
+        self._records.move_to_end(user_id)
+        while len(self._records) > self.max_size:
+            self._records.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._records.pop(user_id, None)
+        self.generation += 1
+        self._invalidated[user_id] = self.generation
+        self._invalidated.move_to_end(user_id)
+        while len(self._invalidated) > self.max_size:
+            _, self._floor = self._invalidated.popitem(last=False)
+
+    def invalidate_after(self, future: asyncio.Future, user_id: int) -> asyncio.Future:
+        """Buang entri setelah tulisan di `future` selesai (commit atau gagal); mengembalikan `future`."""
+        future.add_done_callback(lambda _: self.invalidate(user_id))
+        return future
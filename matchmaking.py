@@ -0,0 +1,1785 @@
+# ======================================================
+# matchmaking.py - Mesin pencocokan antrean untuk bot.py
+# ======================================================
+import bisect
+import heapq
+import time
+from collections import OrderedDict, deque
+from itertools import count, repeat
+from math import radians, degrees, cos, sin, asin, sqrt, floor, ceil, pi
+from typing import Callable, Optional
+
+try:
+    import numpy as np
+except ImportError:  # numpy opsional, tanpa numpy semua skor dihitung skalar
+    np = None
+
+# Skor minimum agar dua pengguna boleh dipasangkan
+MATCH_SCORE_THRESHOLD = 40
+
+# --- BOBOT PRIORITAS ---
+WEIGHTS = {
+    'karma': 0.40,      # Karma punya bobot 40%
+    'location': 0.30,   # Lokasi 30%
+    'interests': 0.20,  # Minat 20%
+    'age': 0.10,        # Usia 10%
+}
+
+# Di bawah jumlah kandidat ini, jalur skalar lebih cepat dari numpy
+VECTORIZE_MIN_CANDIDATES = 32
+
+# Skor lokasi = 100 - 2 * jarak, jadi di atas 50 km skornya selalu 0
+LOCATION_SCORE_RADIUS_KM = 50
+
+# Bonus skor per detik menunggu, agar pasangan di bawah ambang lama-lama tetap dipasangkan.
+# Dihitung dari waktu keduanya sama-sama sudah menunggu; 0 = perilaku lama tanpa aging.
+WAIT_BONUS_PER_SECOND = 0.25
+
+# Kandidat dinilai per potongan paling banyak sebesar ini. Dengan deadline, ukuran potongan
+# dihitung dari biaya per kandidat yang terukur agar potongan selesai sebelum waktunya habis;
+# potongan yang lebih kecil dari SCORE_CHUNK_MIN tidak dimulai lagi
+SCORE_CHUNK_SIZE = 1024
+SCORE_CHUNK_MIN = 32
+
+# Setiap pengguna yang dinilai hanya menaruh sekian kandidat terbaiknya di heap,
+# jadi heap berukuran O(n * K) dan bukan O(n²) saat aging membuat semua skor >= 0 layak
+CANDIDATES_PER_ENTRY = 32
+
+# Matchmaker.seed menilai setiap entri hanya terhadap sekian entri yang masuk tepat sebelumnya
+SEED_WINDOW = 1024
+
+# pop_best_pair mengecek deadline setiap sekian entri basi yang dibuang dari heap
+DRAIN_CHECK_INTERVAL = 32
+
+# Lebar pita usia untuk partisi antrean
+AGE_BAND_YEARS = 5
+
+EARTH_RADIUS_KM = 6371
+GRID_CELL_DEG = 0.5  # ~55 km per sel di ekuator
+
+
+# =============================
+# BITMASK MINAT
+# =============================
+
+class InterestRegistry:
+    """
+    Memetakan nama minat ke posisi bit untuk data tanpa database (benchmark,
+    cek paritas skor). Minat bawaan (COMMON_INTERESTS) mendapat bit tetap
+    sesuai urutannya, minat manual mendapat bit baru saat pertama kali muncul.
+    Bot sendiri memakai `InterestIndex.mask`, yang posisi bitnya adalah slot
+    padat milik `interests.interest_id`.
+    """
+
+    def __init__(self, fixed_interests=()):
+        self._bits = {}
+        for name in fixed_interests:
+            self.intern(name)
+
+    def __len__(self):
+        return len(self._bits)
+
+    def intern(self, name: str) -> int:
+        """Posisi bit untuk sebuah minat, dibuat jika belum ada."""
+        key = name.strip().lower()
+        bit = self._bits.get(key)
+        if bit is None:
+            bit = self._bits[key] = len(self._bits)
+        return bit
+
+    def mask(self, interests) -> int:
+        """Bitmask dari string minat yang dipisah koma (format kolom `interests`) atau daftar nama minat."""
+        if interests is None or isinstance(interests, str):
+            interests = (interests or '').lower().split(',')
+        mask = 0
+        for name in interests:
+            if name:
+                mask |= 1 << self.intern(name)
+        return mask
+
+
+# =============================
+# ENTRI ANTREAN
+# =============================
+
+class QueueEntry:
+    """
+    Satu pengguna di antrean tunggu. Hanya menyimpan field yang dipakai
+    pencocokan (bukan seluruh profil), dengan __slots__ agar ringan di
+    memori dan ringkas saat di-pickle oleh PicklePersistence.
+    """
+
+    __slots__ = (
+        'user_id', 'use_filters', 'gender', 'age', 'karma', 'latitude', 'longitude',
+        'interest_mask', 'filter_gender', 'filter_age_min', 'filter_age_max',
+        'filter_distance_km', 'enqueued_at', 'order', 'seq',
+    )
+
+    def __init__(self, user_id: int, use_filters: bool = False, gender=None, age=None, karma=100,
+                 latitude=None, longitude=None, interest_mask: int = 0, filter_gender=None,
+                 filter_age_min=None, filter_age_max=None, filter_distance_km=None,
+                 enqueued_at: Optional[float] = None):
+        self.user_id = user_id
+        self.use_filters = use_filters
+        self.gender = gender
+        self.age = age
+        self.karma = karma
+        self.latitude = latitude
+        self.longitude = longitude
+        self.interest_mask = interest_mask
+        self.filter_gender = filter_gender
+        self.filter_age_min = filter_age_min
+        self.filter_age_max = filter_age_max
+        self.filter_distance_km = filter_distance_km
+        self.enqueued_at = enqueued_at
+        # Diisi oleh Matchmaker: posisi antrean dan versi entri (untuk validasi heap)
+        self.order = None
+        self.seq = None
+
+    @classmethod
+    def from_profile(cls, user_id: int, profile: dict, use_filters: bool, interest_mask: int) -> "QueueEntry":
+        """Bangun entri dari hasil `get_user_profile_data`."""
+        return cls(
+            user_id, use_filters,
+            gender=profile.get('gender'), age=profile.get('age'), karma=profile.get('karma', 100),
+            latitude=profile.get('latitude'), longitude=profile.get('longitude'),
+            interest_mask=interest_mask,
+            filter_gender=profile.get('filter_gender'),
+            filter_age_min=profile.get('filter_age_min'), filter_age_max=profile.get('filter_age_max'),
+            filter_distance_km=profile.get('filter_distance_km'),
+        )
+
+    @classmethod
+    def from_item(cls, item: dict, registry: "InterestRegistry | InterestIndex") -> "QueueEntry":
+        """Konversi item antrean lama (dict dengan 'profile') menjadi entri."""
+        profile = item['profile']
+        mask = item.get('interest_mask')
+        if mask is None:
+            mask = registry.mask(profile.get('interests'))
+        entry = cls.from_profile(item['user_id'], profile, bool(item.get('use_filters', False)), mask)
+        entry.enqueued_at = item.get('enqueued_at')
+        return entry
+
+    @property
+    def located(self) -> bool:
+        """Sama dengan aturan skor lokasi: latitude harus ada (dan bukan 0)."""
+        return bool(self.latitude) and self.longitude is not None
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"QueueEntry(user_id={self.user_id!r}, order={self.order!r}, seq={self.seq!r})"
+
+
+class WaitingQueue:
+    """
+    Antrean tunggu berurutan: dict user_id -> QueueEntry. Cek keanggotaan dan
+    penghapusan O(1), iterasi mengikuti urutan kedatangan. Mengganti entri
+    yang sudah ada tidak mengubah posisinya.
+    """
+
+    __slots__ = ('_entries',)
+
+    def __init__(self, entries=()):
+        self._entries = {}
+        for entry in entries:
+            self._entries[entry.user_id] = entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def get(self, user_id: int) -> Optional[QueueEntry]:
+        return self._entries.get(user_id)
+
+    def put(self, entry: QueueEntry) -> None:
+        self._entries[entry.user_id] = entry
+
+    def pop(self, user_id: int) -> Optional[QueueEntry]:
+        return self._entries.pop(user_id, None)
+
+    def popleft(self) -> QueueEntry:
+        """Keluarkan entri yang paling lama menunggu."""
+        return self._entries.pop(next(iter(self._entries)))
+
+    def __getstate__(self):
+        return tuple(self._entries.values())
+
+    def __setstate__(self, state):
+        self._entries = {entry.user_id: entry for entry in state}
+
+
+# =============================
+# SKOR KECOCOKAN (REFERENSI SKALAR)
+# =============================
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Menghitung jarak antara dua titik koordinat dalam kilometer."""
+    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
+    c = 2 * asin(sqrt(a))
+    r = 6371
+    return c * r
+
+def check_premium_filters(u_filter: dict, u_target: dict) -> bool:
+    """Filter premium bersifat "keras": jika diatur, wajib dipenuhi."""
+    if not u_filter.get('use_filters', False):
+        return True
+    
+    f_profile, t_profile = u_filter['profile'], u_target['profile']
+    
+    # 1. Validasi Gender (SANGAT WAJIB)
+    filter_gender = f_profile.get('filter_gender')
+    if filter_gender:
+        if filter_gender == 'opposite' and f_profile.get('gender') == t_profile.get('gender'): return False
+        if filter_gender == 'same' and f_profile.get('gender') != t_profile.get('gender'): return False
+
+    # Validasi filter usia
+    if f_profile.get('filter_age_min') and (t_profile.get('age') or 0) < f_profile['filter_age_min']: return False
+    if f_profile.get('filter_age_max') and (t_profile.get('age') or 0) > f_profile['filter_age_max']: return False
+
+    # Validasi jarak maksimal. Hanya berlaku jika pemilik filter membagikan lokasi;
+    # target tanpa lokasi dianggap tidak memenuhi filter.
+    max_km = f_profile.get('filter_distance_km')
+    if max_km and f_profile.get('latitude'):
+        if not t_profile.get('latitude'): return False
+        dist = haversine_distance(f_profile['latitude'], f_profile['longitude'], t_profile['latitude'], t_profile['longitude'])
+        if dist > max_km: return False
+    
+    return True
+
+def calculate_match_score(user_a: dict, user_b: dict, nearby: bool = True) -> float:
+    """
+    Menghitung skor kecocokan antara dua pengguna (0 hingga 100).
+    Skor -1 berarti mereka tidak cocok sama sekali (misal, filter gender gagal).
+    `nearby=False` berarti indeks grid sudah memastikan jarak mereka di atas
+    LOCATION_SCORE_RADIUS_KM, jadi haversine untuk skor lokasi dilewati.
+
+    Ini implementasi referensi untuk item dict; `score_entries` dan
+    `ScoreColumns.score_block` harus selalu memberi hasil yang sama.
+    """
+    p1, p2 = user_a['profile'], user_b['profile']
+
+    # Jika salah satu gagal validasi filter wajib, langsung return skor -1
+    if not (check_premium_filters(user_a, user_b) and check_premium_filters(user_b, user_a)):
+        return -1.0
+
+    # --- PENGHITUNGAN SKOR PARSIAL (0-100) ---
+    
+    # 1. Skor Karma
+    karma_diff = abs(p1.get('karma', 100) - p2.get('karma', 100))
+    # Semakin kecil perbedaan, semakin dekat skor ke 100
+    score_karma = max(0, 100 - karma_diff) 
+
+    # 2. Skor Lokasi
+    score_location = 0.0
+    if nearby and p1.get('latitude') and p2.get('latitude'):
+        dist = haversine_distance(p1['latitude'], p1['longitude'], p2['latitude'], p2['longitude'])
+        # Asumsikan jarak "baik" adalah di bawah 50km. Lebih dari itu skornya menurun.
+        score_location = max(0, 100 - (dist * 2))
+
+    # 3. Skor Minat (Jaccard). Item antrean membawa bitmask minat, jadi cukup dua popcount.
+    score_interests = 0.0
+    mask_a, mask_b = user_a.get('interest_mask'), user_b.get('interest_mask')
+    if mask_a is not None and mask_b is not None:
+        if mask_a and mask_b:
+            score_interests = ((mask_a & mask_b).bit_count() / (mask_a | mask_b).bit_count()) * 100
+    else:
+        p1_interests = set(i.strip() for i in (p1.get('interests') or '').lower().split(',') if i)
+        p2_interests = set(i.strip() for i in (p2.get('interests') or '').lower().split(',') if i)
+        if p1_interests and p2_interests:
+            common_interests = len(p1_interests.intersection(p2_interests))
+            total_interests = len(p1_interests.union(p2_interests))
+            if total_interests > 0:
+                score_interests = (common_interests / total_interests) * 100
+
+    # 4. Skor Usia
+    age_diff = abs((p1.get('age') or 25) - (p2.get('age') or 25))
+    # Semakin kecil perbedaan usia, semakin tinggi skornya
+    score_age = max(0, 100 - (age_diff * 5))
+
+    # --- HITUNG SKOR TOTAL BERDASARKAN BOBOT ---
+    total_score = (
+        (score_karma * WEIGHTS['karma']) +
+        (score_location * WEIGHTS['location']) +
+        (score_interests * WEIGHTS['interests']) +
+        (score_age * WEIGHTS['age'])
+    )
+    
+    return total_score
+
+def _entry_passes(f: QueueEntry, t: QueueEntry) -> bool:
+    """`check_premium_filters` untuk QueueEntry."""
+    if not f.use_filters:
+        return True
+    if f.filter_gender == 'opposite' and f.gender == t.gender: return False
+    if f.filter_gender == 'same' and f.gender != t.gender: return False
+    if f.filter_age_min and (t.age or 0) < f.filter_age_min: return False
+    if f.filter_age_max and (t.age or 0) > f.filter_age_max: return False
+    if f.filter_distance_km and f.latitude:
+        if not t.latitude: return False
+        if haversine_distance(f.latitude, f.longitude, t.latitude, t.longitude) > f.filter_distance_km: return False
+    return True
+
+def score_entries(a: QueueEntry, b: QueueEntry, nearby: bool = True) -> float:
+    """`calculate_match_score` untuk QueueEntry (jalur skalar Matchmaker)."""
+    if not (_entry_passes(a, b) and _entry_passes(b, a)):
+        return -1.0
+
+    score_karma = max(0, 100 - abs(a.karma - b.karma))
+
+    score_location = 0.0
+    if nearby and a.latitude and b.latitude:
+        dist = haversine_distance(a.latitude, a.longitude, b.latitude, b.longitude)
+        score_location = max(0, 100 - (dist * 2))
+
+    score_interests = 0.0
+    if a.interest_mask and b.interest_mask:
+        score_interests = ((a.interest_mask & b.interest_mask).bit_count() / (a.interest_mask | b.interest_mask).bit_count()) * 100
+
+    score_age = max(0, 100 - (abs((a.age or 25) - (b.age or 25)) * 5))
+
+    return (
+        (score_karma * WEIGHTS['karma']) +
+        (score_location * WEIGHTS['location']) +
+        (score_interests * WEIGHTS['interests']) +
+        (score_age * WEIGHTS['age'])
+    )
+
+
+# =============================
+# SKOR BATCH (NUMPY)
+# =============================
+
+_FILTER_GENDER_CODES = {'opposite': 1, 'same': 2}
+_gender_codes = {None: 0}
+
+def _gender_code(gender) -> int:
+    return _gender_codes.setdefault(gender, len(_gender_codes))
+
+_WORD_MASK = (1 << 64) - 1
+
+def _popcount(words):
+    """Jumlah bit 1 per baris (dijumlah pada sumbu kata terakhir)."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    x = words - ((words >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((x * np.uint64(0x0101010101010101)) >> np.uint64(56)).sum(axis=-1, dtype=np.int64)
+
+
+class ScoreColumns:
+    """
+    Entri antrean dalam bentuk kolom array untuk penilaian batch. Setiap entri
+    menempati satu baris yang dicari lewat user_id; baris yang dilepas dipakai
+    ulang dan array digandakan saat penuh, jadi Matchmaker cukup menulis satu
+    baris saat pengguna masuk dan menilai potongan baris yang sudah ada.
+    """
+
+    _COLUMNS = (
+        ('karma', 'float64'), ('age', 'float64'), ('age_raw', 'float64'), ('has_loc', 'bool'),
+        ('lat', 'float64'), ('lon', 'float64'), ('gender', 'int64'), ('use_filters', 'bool'),
+        ('filter_gender', 'int64'), ('filter_age_min', 'float64'), ('filter_age_max', 'float64'),
+        ('filter_distance', 'float64'), ('interest_count', 'int64'),
+    )
+
+    def __init__(self, entries=(), capacity: int = 64):
+        self._rows = {}   # user_id -> baris
+        self._free = []   # baris yang sudah dilepas
+        self._capacity = max(1, capacity, len(entries) if isinstance(entries, list) else 0)
+        for name, dtype in self._COLUMNS:
+            setattr(self, name, np.zeros(self._capacity, dtype=dtype))
+        self.interest_words = np.zeros((self._capacity, 1), dtype=np.uint64)
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, user_id):
+        return user_id in self._rows
+
+    def row_of(self, user_id: int) -> Optional[int]:
+        return self._rows.get(user_id)
+
+    def _grow(self):
+        old = self._capacity
+        self._capacity *= 2
+        for name, _ in self._COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(self._capacity, dtype=column.dtype)
+            grown[:old] = column
+            setattr(self, name, grown)
+        words = np.zeros((self._capacity, self.interest_words.shape[1]), dtype=np.uint64)
+        words[:old] = self.interest_words
+        self.interest_words = words
+
+    def add(self, entry: QueueEntry) -> int:
+        """Tulis (atau timpa) baris milik entri; mengembalikan nomor barisnya."""
+        row = self._rows.get(entry.user_id)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                row = len(self._rows)
+                if row >= self._capacity:
+                    self._grow()
+            self._rows[entry.user_id] = row
+        has_loc = bool(entry.latitude)
+        self.karma[row] = entry.karma
+        self.age[row] = entry.age or 25
+        self.age_raw[row] = entry.age or 0
+        self.has_loc[row] = has_loc
+        self.lat[row] = radians(entry.latitude) if has_loc else 0.0
+        self.lon[row] = radians(entry.longitude) if has_loc else 0.0
+        self.gender[row] = _gender_code(entry.gender)
+        self.use_filters[row] = bool(entry.use_filters)
+        self.filter_gender[row] = _FILTER_GENDER_CODES.get(entry.filter_gender, 0)
+        self.filter_age_min[row] = entry.filter_age_min or 0
+        self.filter_age_max[row] = entry.filter_age_max or 0
+        self.filter_distance[row] = entry.filter_distance_km or 0
+
+        mask = entry.interest_mask
+        n_words = max(1, (mask.bit_length() + 63) // 64)
+        if n_words > self.interest_words.shape[1]:
+            words = np.zeros((self._capacity, n_words), dtype=np.uint64)
+            words[:, :self.interest_words.shape[1]] = self.interest_words
+            self.interest_words = words
+        words = self.interest_words[row]
+        words[:] = 0
+        for k in range(n_words):
+            words[k] = (mask >> (64 * k)) & _WORD_MASK
+        self.interest_count[row] = mask.bit_count()
+        return row
+
+    def discard(self, user_id: int) -> None:
+        row = self._rows.pop(user_id, None)
+        if row is not None:
+            self._free.append(row)
+
+    def rows_of(self, user_ids: list):
+        """Array baris untuk daftar user_id; -1 untuk user yang tidak punya baris."""
+        return np.fromiter(map(self._rows.get, user_ids, repeat(-1)), dtype=np.int64, count=len(user_ids))
+
+    def _passes(self, f, t, dist):
+        """Mask filter premium arah f -> t (f, t: array indeks yang sudah di-broadcast)."""
+        same_gender = self.gender[f] == self.gender[t]
+        fg = self.filter_gender[f]
+        age_t = self.age_raw[t]
+        fmin, fmax, fdist = self.filter_age_min[f], self.filter_age_max[f], self.filter_distance[f]
+        rejected = (
+            ((fg == 1) & same_gender) | ((fg == 2) & ~same_gender) |
+            ((fmin > 0) & (age_t < fmin)) | ((fmax > 0) & (age_t > fmax)) |
+            ((fdist > 0) & self.has_loc[f] & (~self.has_loc[t] | (dist > fdist)))
+        )
+        return ~(self.use_filters[f] & rejected)
+
+    def score_block(self, rows, cols):
+        """Matriks skor len(rows) x len(cols), dengan -1 untuk pasangan yang gagal filter."""
+        r = np.asarray(rows, dtype=np.int64)[:, None]
+        c = np.asarray(cols, dtype=np.int64)[None, :]
+
+        score_karma = np.maximum(0, 100 - np.abs(self.karma[r] - self.karma[c]))
+
+        lat1, lon1, lat2, lon2 = self.lat[r], self.lon[r], self.lat[c], self.lon[c]
+        a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+        dist = 2 * np.arcsin(np.sqrt(a)) * 6371
+        score_location = np.where(self.has_loc[r] & self.has_loc[c], np.maximum(0, 100 - (dist * 2)), 0.0)
+
+        words_r, words_c = self.interest_words[r], self.interest_words[c]
+        common = _popcount(words_r & words_c)
+        union = _popcount(words_r | words_c)
+        both = (self.interest_count[r] > 0) & (self.interest_count[c] > 0)
+        score_interests = np.where(both, (common / np.maximum(union, 1)) * 100, 0.0)
+
+        score_age = np.maximum(0, 100 - (np.abs(self.age[r] - self.age[c]) * 5))
+
+        total = (
+            (score_karma * WEIGHTS['karma']) +
+            (score_location * WEIGHTS['location']) +
+            (score_interests * WEIGHTS['interests']) +
+            (score_age * WEIGHTS['age'])
+        )
+        passes = None
+        for f, t in ((r, c), (c, r)):
+            # Arah tanpa satu pun pemilik filter premium selalu lolos
+            if self.use_filters[f].any():
+                mask = self._passes(f, t, dist)
+                passes = mask if passes is None else passes & mask
+        return total if passes is None else np.where(passes, total, -1.0)
+
+
+def score_candidates(entry: QueueEntry, candidates: list, nearby_ids=None) -> list:
+    """
+    Skor `entry` terhadap daftar kandidat lepas dengan `score_entries`. Matchmaker
+    menilai lewat kolom persistennya sendiri; membangun ScoreColumns per panggilan
+    justru lebih lambat dari jalur skalar.
+    `nearby_ids` (opsional, dari GeoGrid) membatasi haversine ke kandidat terdekat saja.
+    """
+    if nearby_ids is None:
+        return [score_entries(other, entry) for other in candidates]
+    return [score_entries(other, entry, nearby=other.user_id in nearby_ids) for other in candidates]
+
+def score_matrix(entries: list):
+    """Matriks skor penuh n x n untuk seluruh antrean; diagonal diisi -1."""
+    if np is None:
+        raise RuntimeError("score_matrix membutuhkan numpy")
+    columns = ScoreColumns(entries)
+    idx = [columns.row_of(entry.user_id) for entry in entries]
+    matrix = columns.score_block(idx, idx)
+    np.fill_diagonal(matrix, -1.0)
+    return matrix
+
+
+# =============================
+# INDEKS LOKASI
+# =============================
+
+class GeoGrid:
+    """
+    Indeks grid lat/lon untuk pengguna yang membagikan lokasi. Dipakai untuk
+    mencari kandidat dalam radius tertentu tanpa memindai seluruh antrean.
+    """
+
+    def __init__(self, cell_deg: float = GRID_CELL_DEG):
+        self.cell_deg = cell_deg
+        self._n_lon_cells = ceil(360 / cell_deg)
+        self._cells = {}    # (cy, cx) -> {user_id}
+        self._points = {}   # user_id -> (lat, lon, cell)
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, user_id):
+        return user_id in self._points
+
+    def _cell(self, lat, lon):
+        cy = floor((lat + 90) / self.cell_deg)
+        cx = floor((lon + 180) / self.cell_deg) % self._n_lon_cells
+        return cy, cx
+
+    def add(self, user_id: int, lat: float, lon: float):
+        self.remove(user_id)
+        cell = self._cell(lat, lon)
+        self._cells.setdefault(cell, set()).add(user_id)
+        self._points[user_id] = (lat, lon, cell)
+
+    def remove(self, user_id: int):
+        point = self._points.pop(user_id, None)
+        if point is None:
+            return
+        members = self._cells.get(point[2])
+        members.discard(user_id)
+        if not members:
+            del self._cells[point[2]]
+
+    def _candidate_ids(self, lat, lon, radius_km):
+        """Semua user di sel yang bisa berada dalam radius (kotak pembatas, belum tepat)."""
+        delta = radius_km / EARTH_RADIUS_KM  # jarak sudut dalam radian
+        lat_r = radians(lat)
+        lat_min, lat_max = lat_r - delta, lat_r + delta
+        if lat_min <= -pi / 2 or lat_max >= pi / 2 or sin(delta) >= cos(lat_r):
+            # Kutub masuk dalam radius, semua bujur harus diperiksa
+            lon_span = None
+        else:
+            lon_span = degrees(asin(sin(delta) / cos(lat_r)))
+
+        cy_min = self._cell(max(degrees(lat_min), -90), lon)[0]
+        cy_max = self._cell(min(degrees(lat_max), 89.999999), lon)[0]
+        if lon_span is None or lon_span >= 180:
+            cx_range = range(self._n_lon_cells)
+        else:
+            cx_min = floor((lon - lon_span + 180) / self.cell_deg)
+            cx_max = floor((lon + lon_span + 180) / self.cell_deg)
+            cx_range = range(cx_min, min(cx_max, cx_min + self._n_lon_cells - 1) + 1)
+
+        n_cells = (cy_max - cy_min + 1) * len(cx_range)
+        if n_cells >= len(self._cells):
+            # Radius sangat besar: lebih murah memeriksa semua sel yang terisi
+            return self._points.keys()
+
+        ids = []
+        for cy in range(cy_min, cy_max + 1):
+            for cx in cx_range:
+                members = self._cells.get((cy, cx % self._n_lon_cells))
+                if members:
+                    ids.extend(members)
+        return ids
+
+    def around(self, lat: float, lon: float, radius_km: float) -> list:
+        """User id yang mungkin berada dalam radius: superset dari `within`, tanpa haversine per titik."""
+        return list(self._candidate_ids(lat, lon, radius_km))
+
+    def within(self, lat: float, lon: float, radius_km: float) -> set:
+        """User id yang jaraknya <= radius_km dari titik (lat, lon)."""
+        result = set()
+        for user_id in self._candidate_ids(lat, lon, radius_km):
+            p_lat, p_lon, _ = self._points[user_id]
+            if haversine_distance(lat, lon, p_lat, p_lon) <= radius_km:
+                result.add(user_id)
+        return result
+
+
+class BlockIndex:
+    """
+    Graf blokir di memori. Dimuat dari tabel `blocks` saat startup dan
+    diperbarui write-through oleh `block_user`, jadi cek blokir tidak
+    pernah menyentuh database.
+    """
+
+    def __init__(self):
+        self._blocked_by = {}   # blocker_id -> {blocked_id}
+        self._neighbours = {}   # user_id -> {user_id} (simetris)
+
+    def add(self, blocker_id: int, blocked_id: int) -> bool:
+        """Catat blokir baru. False jika blokir yang sama sudah ada."""
+        targets = self._blocked_by.setdefault(blocker_id, set())
+        if blocked_id in targets:
+            return False
+        targets.add(blocked_id)
+        self._neighbours.setdefault(blocker_id, set()).add(blocked_id)
+        self._neighbours.setdefault(blocked_id, set()).add(blocker_id)
+        return True
+
+    def has_blocked(self, blocker_id: int, blocked_id: int) -> bool:
+        return blocked_id in self._blocked_by.get(blocker_id, ())
+
+    def is_blocked(self, user1_id: int, user2_id: int) -> bool:
+        """Cek apakah salah satu dari dua user memblokir yang lain."""
+        return user2_id in self._neighbours.get(user1_id, ())
+
+    def neighbours(self, user_id: int) -> set:
+        return self._neighbours.get(user_id, set())
+
+
+class InterestIndex:
+    """
+    Indeks terbalik minat -> user_id, cermin dari tabel `interests` dan
+    `user_interests`. Dimuat saat startup dan diperbarui write-through oleh
+    `save_user_interests`, jadi daftar minat seorang user dan "siapa saja
+    yang punya minat X" bisa dijawab tanpa memecah kolom teks.
+
+    Posisi bit di bitmask bukan interest_id (AUTOINCREMENT, terus bertambah
+    selama minat manual dibuat) melainkan slot padat yang hanya dimiliki minat
+    yang sedang dipakai seseorang. Slot dilepas saat pemilik terakhirnya pergi
+    dan dipakai ulang, jadi lebar bitmask mengikuti jumlah minat yang aktif.
+    Slot hanya berlaku di proses ini; bitmask antrean dari persistence
+    dihitung ulang saat startup.
+    """
+
+    def __init__(self):
+        self._ids = {}       # nama minat -> interest_id
+        self._names = {}     # interest_id -> nama minat
+        self._users = {}     # interest_id -> {user_id}
+        self._by_user = {}   # user_id -> (interest_id, ...)
+        self._slots = {}     # interest_id -> posisi bit, hanya untuk minat yang punya pemilik
+        self._free_slots = []  # heap posisi bit yang dilepas, yang terkecil dipakai lebih dulu
+
+    def __len__(self):
+        return len(self._by_user)
+
+    def define(self, name: str, interest_id: int) -> None:
+        """Daftarkan satu baris kamus minat."""
+        self._ids[name] = interest_id
+        self._names[interest_id] = name
+
+    def id_of(self, name: str) -> Optional[int]:
+        return self._ids.get(name.strip().lower())
+
+    def set_user(self, user_id: int, interest_ids) -> None:
+        """Ganti seluruh minat seorang user."""
+        for interest_id in self._by_user.pop(user_id, ()):
+            users = self._users.get(interest_id)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self._users[interest_id]
+                    heapq.heappush(self._free_slots, self._slots.pop(interest_id))
+        interest_ids = tuple(sorted(set(interest_ids)))
+        if interest_ids:
+            self._by_user[user_id] = interest_ids
+            for interest_id in interest_ids:
+                users = self._users.get(interest_id)
+                if users is None:
+                    users = self._users[interest_id] = set()
+                    # Tanpa slot bebas, slot 0..len-1 semuanya terpakai
+                    self._slots[interest_id] = heapq.heappop(self._free_slots) if self._free_slots else len(self._slots)
+                users.add(user_id)
+
+    def add(self, user_id: int, interest_id: int) -> None:
+        """Tambahkan satu minat ke user (dipakai saat memuat dari database)."""
+        self.set_user(user_id, self._by_user.get(user_id, ()) + (interest_id,))
+
+    def names(self, user_id: int) -> list:
+        """Nama minat seorang user, terurut."""
+        return sorted(self._names[i] for i in self._by_user.get(user_id, ()))
+
+    def mask_of(self, user_id: int) -> int:
+        """Bitmask minat seorang user untuk QueueEntry; posisi bit = slot minat."""
+        mask = 0
+        for interest_id in self._by_user.get(user_id, ()):
+            mask |= 1 << self._slots[interest_id]
+        return mask
+
+    def mask(self, interests) -> int:
+        """
+        Seperti `InterestRegistry.mask` (string dipisah koma atau daftar nama),
+        tetapi dengan slot minat sebagai posisi bit. Nama yang tidak ada di
+        kamus atau tidak punya slot tidak dimiliki siapa pun, jadi diabaikan.
+        """
+        if interests is None or isinstance(interests, str):
+            interests = (interests or '').split(',')
+        mask = 0
+        for name in interests:
+            slot = self._slots.get(self.id_of(name)) if name else None
+            if slot is not None:
+                mask |= 1 << slot
+        return mask
+
+    def users_with(self, names, match_all: bool = False) -> set:
+        """
+        User yang punya salah satu (atau semua, jika `match_all`) minat di
+        `names`. Himpunan terkecil diproses lebih dulu saat irisan.
+        """
+        sets = [self._users.get(self.id_of(name), set()) for name in names if name]
+        if not sets:
+            return set()
+        if not match_all:
+            return set().union(*sets)
+        sets.sort(key=len)
+        result = set(sets[0])
+        for users in sets[1:]:
+            result &= users
+            if not result:
+                break
+        return result
+
+
+class RecentPairs:
+    """
+    Pasangan yang baru saja dipertemukan, agar mereka tidak langsung dicocokkan
+    lagi setelah /next. Disimpan sebagai beberapa bucket waktu berputar: bucket
+    yang lebih tua dari `window_sec` dibuang utuh, jadi ukurannya dibatasi oleh
+    jumlah match per jendela waktu dan tidak pernah tumbuh tanpa batas.
+    """
+
+    def __init__(self, window_sec: float, n_buckets: int = 6):
+        self.window_sec = window_sec
+        self._bucket_sec = window_sec / n_buckets
+        self._buckets = deque()  # (awal_bucket, {(user_id_kecil, user_id_besar)})
+
+    @staticmethod
+    def _key(user1_id, user2_id):
+        return (user1_id, user2_id) if user1_id < user2_id else (user2_id, user1_id)
+
+    def _expire(self, now):
+        while self._buckets and self._buckets[0][0] + self._bucket_sec <= now - self.window_sec:
+            self._buckets.popleft()
+
+    def add(self, user1_id: int, user2_id: int, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        self._expire(now)
+        if not self._buckets or self._buckets[-1][0] + self._bucket_sec <= now:
+            self._buckets.append((now, set()))
+        self._buckets[-1][1].add(self._key(user1_id, user2_id))
+
+    def seen(self, user1_id: int, user2_id: int, now: Optional[float] = None) -> bool:
+        """Apakah dua user ini dipertemukan dalam jendela waktu terakhir (dibulatkan ke satu bucket)."""
+        self._expire(time.time() if now is None else now)
+        key = self._key(user1_id, user2_id)
+        return any(key in pairs for _, pairs in self._buckets)
+
+    def __iter__(self):
+        for _, pairs in self._buckets:
+            yield from pairs
+
+    def __len__(self):
+        return sum(len(pairs) for _, pairs in self._buckets)
+
+
+def bucket_key(entry: QueueEntry) -> tuple:
+    """Kunci partisi antrean: (gender, filter_gender aktif, pita usia)."""
+    filter_gender = entry.filter_gender if entry.use_filters else None
+    if filter_gender not in ('same', 'opposite'):
+        filter_gender = None
+    return entry.gender, filter_gender, (entry.age or 0) // AGE_BAND_YEARS
+
+def buckets_compatible(entry: QueueEntry, key: tuple) -> bool:
+    """
+    Apakah `entry` mungkin cocok dengan siapa pun di bucket `key`.
+    Hanya memeriksa filter yang tercermin di kunci; sisanya tetap dicek per pasangan.
+    """
+    gender = entry.gender
+    entry_key = bucket_key(entry)
+    other_gender, other_filter, band = key
+
+    for filter_gender, g1, g2 in ((entry_key[1], gender, other_gender), (other_filter, other_gender, gender)):
+        if filter_gender == 'opposite' and g1 == g2: return False
+        if filter_gender == 'same' and g1 != g2: return False
+
+    if entry.use_filters:
+        band_min, band_max = band * AGE_BAND_YEARS, band * AGE_BAND_YEARS + AGE_BAND_YEARS - 1
+        if entry.filter_age_min and band_max < entry.filter_age_min: return False
+        if entry.filter_age_max and band_min > entry.filter_age_max: return False
+    return True
+
+
+class QueueColumns(ScoreColumns):
+    """
+    Kolom milik Matchmaker: kolom skor ditambah status antrean tiap baris
+    (seq, urutan, waktu masuk, bucket, jumlah pasangan di heap), agar kandidat
+    bisa disaring dan dipilih per potongan tanpa menyentuh objek entrinya.
+    """
+
+    _COLUMNS = ScoreColumns._COLUMNS + (
+        ('user_id', 'int64'), ('seq', 'int64'), ('order', 'int64'), ('enqueued_at', 'float64'),
+        ('bucket', 'int64'), ('links', 'int64'),
+    )
+
+    def __init__(self, entries=(), capacity: int = 64):
+        self._dirty = set()  # baris yang berubah sejak `snapshot`/`delta` terakhir
+        super().__init__(entries, capacity)
+
+    def snapshot(self) -> "QueueColumns":
+        """
+        Salinan semua baris yang pernah terisi, untuk replika di proses worker. Hanya
+        menyalin array; indeks user_id dibangun ulang oleh `reindex` di penerima.
+        """
+        high = len(self._rows) + len(self._free)
+        copy = type(self).__new__(type(self))
+        copy._rows, copy._free, copy._dirty, copy._capacity = None, [], set(), high
+        for name, _ in self._COLUMNS:
+            setattr(copy, name, getattr(self, name)[:high].copy())
+        copy.interest_words = self.interest_words[:high].copy()
+        self._dirty = set()
+        return copy
+
+    def delta(self) -> tuple:
+        """
+        Perubahan sejak `snapshot`/`delta` terakhir, untuk `apply_delta` di replika:
+        (jumlah baris terisi, nomor baris yang ditulis ulang, isi semua kolomnya,
+        kolom links). Kolom links selalu dikirim utuh karena berubah di hampir setiap push.
+        """
+        high = len(self._rows) + len(self._free)
+        rows = np.fromiter(self._dirty, dtype=np.int64, count=len(self._dirty))
+        self._dirty = set()
+        values = {name: getattr(self, name)[rows] for name, _ in self._COLUMNS}
+        values['interest_words'] = self.interest_words[rows]
+        return high, rows, values, self.links[:high].copy()
+
+    def reindex(self) -> None:
+        """Bangun indeks user_id dari kolomnya; baris yang sudah dilepas (user_id -1) jadi baris kosong."""
+        user_ids = self.user_id.tolist()
+        self._rows = {user_id: row for row, user_id in enumerate(user_ids) if user_id >= 0}
+        self._free = [row for row, user_id in enumerate(user_ids) if user_id < 0]
+
+    def apply_delta(self, delta: tuple) -> None:
+        """Terapkan hasil `delta` kolom asal ke replika ini (dibuat dari `snapshot` + `reindex`)."""
+        high, rows, values, links = delta
+        if high > self._capacity:
+            old = self._capacity
+            while self._capacity < high:
+                self._grow()
+            self.user_id[old:] = -1
+        words = values['interest_words']
+        if words.shape[1] > self.interest_words.shape[1]:
+            widened = np.zeros((self._capacity, words.shape[1]), dtype=np.uint64)
+            widened[:, :self.interest_words.shape[1]] = self.interest_words
+            self.interest_words = widened
+        for row, old_id, new_id in zip(rows.tolist(), self.user_id[rows].tolist(), values['user_id'].tolist()):
+            if old_id >= 0 and self._rows.get(old_id) == row:
+                del self._rows[old_id]
+            if new_id >= 0:
+                self._rows[new_id] = row
+        for name, _ in self._COLUMNS:
+            getattr(self, name)[rows] = values[name]
+        self.interest_words[rows] = 0
+        self.interest_words[rows, :words.shape[1]] = words
+        self.links[:high] = links
+
+    def discard(self, user_id: int) -> None:
+        row = self._rows.get(user_id)
+        super().discard(user_id)
+        if row is not None:
+            self.user_id[row] = -1
+            self._dirty.add(row)
+
+    def add(self, entry: QueueEntry) -> int:
+        row = super().add(entry)
+        self._dirty.add(row)
+        self.user_id[row] = entry.user_id
+        self.seq[row] = entry.seq
+        self.order[row] = entry.order
+        self.enqueued_at[row] = entry.enqueued_at
+        return row
+
+
+def _offer(best: list, candidate: tuple, limit: Optional[int]) -> None:
+    """Tawarkan kandidat ke min-heap `best` yang menyimpan paling banyak `limit` kandidat terbaik."""
+    if limit is None or len(best) < limit:
+        heapq.heappush(best, candidate)
+    elif candidate > best[0]:
+        heapq.heapreplace(best, candidate)
+
+def _select_rows(columns: QueueColumns, rows, seq: int, codes, excluded):
+    """
+    Baris kandidat yang perlu dinilai terhadap entri ber-`seq`: yang masuk sebelum
+    dia, di bucket `codes` (None = semua), dan tidak ada di baris `excluded`.
+    """
+    # seq lebih besar berarti dia masuk (atau dinilai ulang) sesudah entri dan sudah menilai entri itu sendiri
+    rows = rows[columns.seq[rows] < seq]
+    if codes is not None:
+        rows = rows[np.isin(columns.bucket[rows], codes)]
+    if excluded:
+        rows = rows[~np.isin(rows, excluded)]
+    return rows
+
+def _rank_block(columns: QueueColumns, row: int, rows, min_score: float, wait_bonus_per_sec: float, epoch: float,
+                limit: Optional[int], best: list) -> list:
+    """
+    Nilai baris `row` terhadap kandidat `rows`. Kandidat yang pasangannya di heap
+    belum penuh dikembalikan sebagai (kunci, skor, baris) untuk langsung masuk heap;
+    sisanya ditawarkan ke `best`. Dipakai Matchmaker dan worker `score_offloaded`.
+    """
+    if not len(rows):
+        return []
+    scores = columns.score_block((row,), rows)[0]
+    paired_since = np.maximum(columns.enqueued_at[rows], columns.enqueued_at[row]) - epoch
+    keys = scores - wait_bonus_per_sec * paired_since
+    eligible = scores >= min_score
+
+    direct = []
+    if limit is not None:
+        is_direct = eligible & (columns.links[rows] < limit)
+        direct = [(float(keys[i]), float(scores[i]), rows[i]) for i in np.flatnonzero(is_direct).tolist()]
+        eligible &= ~is_direct
+    offered = np.flatnonzero(eligible)
+    if limit is not None and len(offered):
+        # Hanya kandidat yang mungkin masuk K terbaik; seri di batas ikut agar hasilnya sama dengan jalur skalar
+        if len(offered) > limit:
+            kth = np.partition(keys[offered], len(offered) - limit)[len(offered) - limit]
+            offered = offered[keys[offered] >= kth]
+        if len(best) >= limit:
+            offered = offered[keys[offered] >= best[0][0]]
+    for i in offered.tolist():
+        other = rows[i]
+        _offer(best, (
+            float(keys[i]), -int(columns.order[other]), int(columns.user_id[other]), int(columns.seq[other]),
+            float(scores[i]),
+        ), limit)
+    return direct
+
+
+class ScoringJob:
+    """
+    Penilaian satu pengguna terhadap antrean, bisa dipotong deadline lalu
+    dilanjutkan. Kandidat dibaca bertahap dari `sources` (bucket atau daftar
+    id dari GeoGrid) supaya pengumpulan kandidat pun ikut dibatasi deadline.
+    """
+
+    __slots__ = ('entry', 'exclude', 'compatible', 'sources', 'pending_ids', 'nearby_ids', 'best')
+
+    def __init__(self, entry: QueueEntry, exclude, compatible: set, sources: list, nearby_ids):
+        self.entry = entry
+        self.exclude = exclude
+        self.compatible = compatible  # bucket yang mungkin cocok; None = sudah disaring oleh sources
+        self.sources = sources        # bucket_key, atau list id yang belum disaring bucket-nya
+        self.pending_ids = []         # id dari sumber yang sedang dibaca, belum dinilai
+        self.nearby_ids = nearby_ids
+        self.best = []                # min-heap kandidat terbaik (kunci, -order, user_id, seq, skor)
+
+
+class Matchmaker:
+    """
+    Antrean tunggu dengan pencocokan inkremental.
+
+    Setiap pengguna baru hanya dinilai terhadap isi antrean saat itu, lalu
+    pasangan kandidat disimpan di heap. Hasilnya sama dengan aturan lama
+    (pasangan dengan skor tertinggi dulu, seri dipecah berdasarkan urutan
+    antrean), tanpa menghitung ulang semua pasangan di setiap /search.
+
+    Antrean dipartisi per `bucket_key`, jadi pengguna baru hanya dinilai
+    terhadap bucket yang mungkin cocok dengan filter premiumnya.
+
+    Pengguna baru masuk lewat `submit` dan baru dinilai saat `flush`, yang
+    dijalankan oleh satu task matchmaker per tick. Skor efektif sebuah
+    pasangan = skor + bonus tunggu sejak keduanya berada di antrean. Karena
+    bonus itu naik seragam untuk semua pasangan, urutan heap tetap statis.
+
+    Setiap pengguna hanya menyimpan `max_candidates` pasangan terbaiknya di
+    heap. Pengguna yang kehilangan semua pasangan di heap (karena pasangannya
+    sudah dipasangkan, keluar, atau dilewati) dinilai ulang pada `flush`
+    berikutnya, jadi batas ini tidak membuat siapa pun tertinggal.
+
+    Saat di-pickle hanya entri antrean yang disimpan; heap dan indeks
+    dibangun ulang pada `flush` pertama setelah bot dijalankan lagi.
+    """
+
+    def __init__(self, threshold: float = MATCH_SCORE_THRESHOLD, wait_bonus_per_sec: float = WAIT_BONUS_PER_SECOND,
+                 max_candidates: Optional[int] = CANDIDATES_PER_ENTRY):
+        self.threshold = threshold
+        self.wait_bonus_per_sec = wait_bonus_per_sec
+        self.max_candidates = max_candidates  # None = semua pasangan layak masuk heap
+        self._epoch = time.time()
+        self._pending = WaitingQueue()  # menunggu tick berikutnya
+        self._items = WaitingQueue()    # sudah dinilai, urut kedatangan
+        self._next_seq = 0
+        self._heap = []     # (-kunci, order_a, order_b, seq_a, seq_b, user_a_id, user_b_id, skor)
+        self._grid = GeoGrid()
+        self._buckets = {}  # bucket_key -> {user_id}
+        self._bucket_of = {}
+        self._columns = QueueColumns() if np is not None else None  # kolom skor entri yang sudah diindeks
+        self._bucket_codes = {}  # bucket_key -> kode angka untuk kolom bucket
+        self._links = {}    # user_id -> {user_id} pasangan yang masih punya entri heap hidup
+        self._skipped = {}  # user_id -> {user_id} pasangan yang ditolak is_excluded, tidak dinilai lagi
+        self._starved = OrderedDict()  # user_id yang kehilangan semua pasangannya; dinilai ulang oleh flush
+        self.pairs_scored = 0  # jumlah pasangan yang sudah dinilai, untuk statistik/benchmark
+        self._id_cost = 2e-6   # detik per kandidat yang dibaca (rata-rata bergerak), untuk ukuran potongan
+        self._link_cost = 5e-6  # detik per pasangan heap yang dilepas saat pasangan dikeluarkan (rata-rata bergerak)
+        self.timed_out = False  # pop_best_pair terakhir berhenti karena deadline
+        self._scoring = None   # job penilaian yang terpotong deadline, dilanjutkan oleh flush
+        self._offloaded = {}   # user_id -> seq pendatang yang sedang dinilai worker `score_offloaded`
+        self._offload_pushes = None  # hasil worker yang belum masuk heap, diterapkan oleh flush
+        self._shipped = None   # kunci replika kolom yang terakhir dikirim ke worker; None = kirim salinan penuh
+
+    def __getstate__(self):
+        entries = tuple(self._items) + tuple(self._pending)
+        return self.threshold, self.wait_bonus_per_sec, self._epoch, entries
+
+    def __setstate__(self, state):
+        threshold, wait_bonus_per_sec, epoch, entries = state
+        self.__init__(threshold, wait_bonus_per_sec)
+        self._epoch = epoch
+        for entry in entries:
+            self._pending.put(entry)
+
+    def __len__(self):
+        return len(self._items) + len(self._pending)
+
+    def __contains__(self, user_id):
+        return user_id in self._items or user_id in self._pending
+
+    def __iter__(self):
+        """Semua entri, yang sudah dinilai dulu lalu yang belum."""
+        yield from self._items
+        yield from self._pending
+
+    @property
+    def pending_count(self) -> int:
+        """Pengguna yang menunggu dinilai: baru masuk, atau kehilangan semua pasangannya di heap."""
+        return len(self._pending) + len(self._starved) + len(self._offloaded)
+
+    @property
+    def heap_size(self) -> int:
+        """Jumlah pasangan kandidat di heap, termasuk yang sudah basi."""
+        return len(self._heap)
+
+    def submit(self, entry: QueueEntry) -> bool:
+        """Daftarkan pengguna untuk dinilai pada tick berikutnya. Handler cukup memanggil ini."""
+        if entry.user_id in self:
+            return False
+        if entry.enqueued_at is None:
+            entry.enqueued_at = time.time()
+        self._pending.put(entry)
+        return True
+
+    def flush(self, exclude_for: Callable[[int], set] = lambda user_id: (), deadline: Optional[float] = None) -> bool:
+        """
+        Nilai semua pengguna yang masuk sejak tick terakhir. Dengan `deadline`
+        (nilai time.perf_counter()), berhenti begitu waktunya habis; pengguna
+        yang belum selesai dinilai dilanjutkan pada flush berikutnya. Hasil
+        `score_offloaded` yang sudah diterima juga dimasukkan ke heap di sini.
+        Mengembalikan True jika semuanya sudah dinilai.
+        """
+        # Setiap flush selalu memajukan minimal satu potongan kecil, walau deadline sudah lewat
+        force = True
+        if self._offload_pushes is not None:
+            if not self._apply_offloaded(deadline):
+                return False
+            force = False
+        if self._scoring is not None:
+            if not self._score(self._scoring, deadline, force):
+                return False
+            self._scoring = None
+            force = False
+        while self._pending:
+            if not force and deadline is not None and time.perf_counter() >= deadline:
+                return False
+            entry = self._pending.popleft()
+            entry.order = self._next_seq
+            job = self._begin_scoring(entry, exclude_for(entry.user_id))
+            if not self._score(job, deadline, force):
+                self._scoring = job
+                return False
+            force = False
+        while self._starved:
+            if not force and deadline is not None and time.perf_counter() >= deadline:
+                return False
+            user_id, _ = self._starved.popitem(last=False)
+            entry = self._items.get(user_id)
+            if entry is None:
+                continue
+            self._unindex(user_id)
+            job = self._begin_scoring(entry, exclude_for(user_id))
+            if not self._score(job, deadline, force):
+                self._scoring = job
+                return False
+            force = False
+        return True
+
+    def offload_pending(self, exclude_for: Callable[[int], set] = lambda user_id: ()) -> Optional[tuple]:
+        """
+        Indeks semua pendatang baru tanpa menilainya, lalu kembalikan argumen untuk
+        `score_offloaded` di ProcessPoolExecutor: kolom antrean (salinan penuh untuk
+        kiriman pertama, selanjutnya hanya baris yang berubah) dan, per pendatang, kode
+        bucket yang cocok serta user_id yang dikecualikan; array numpy dan tuple saja,
+        tanpa heap. Selama worker berjalan pendatang sudah menjadi kandidat bagi yang
+        masuk sesudahnya. Hasilnya diserahkan ke `finish_offload`. None jika tanpa
+        numpy, tidak ada pendatang, atau hasil sebelumnya belum diterapkan.
+        """
+        if self._columns is None or self._offloaded or not self._pending:
+            return None
+        jobs = []
+        while self._pending:
+            entry = self._pending.popleft()
+            entry.order = entry.seq = self._next_seq
+            self._next_seq += 1
+            compatible = [self._bucket_codes[key] for key in self._buckets if buckets_compatible(entry, key)]
+            self._index(entry)
+            self._offloaded[entry.user_id] = entry.seq
+            jobs.append((entry.user_id, compatible, tuple(exclude_for(entry.user_id))))
+        key = next(_REPLICA_KEYS)
+        if self._shipped is None:
+            replica = key, None, self._columns.snapshot()
+        else:
+            replica = key, self._shipped, self._columns.delta()
+        self._shipped = key
+        params = self._min_score(), self.wait_bonus_per_sec, self._epoch, self.max_candidates
+        return replica, jobs, params
+
+    def finish_offload(self, result: Optional[tuple]) -> None:
+        """
+        Terima hasil `score_offloaded`. Pasangannya baru masuk heap pada `flush`,
+        dalam batas deadline-nya; pasangan yang salah satu sisinya keluar atau
+        diganti selama worker berjalan dilewati. Dengan `result` None (worker gagal
+        atau replikanya tidak cocok), pendatang yang masih menunggu dinilai ulang oleh
+        `flush` di proses ini dan kiriman berikutnya berisi salinan kolom penuh.
+        """
+        if result is None:
+            self._shipped = None
+            offloaded, self._offloaded = self._offloaded, {}
+            for user_id, seq in offloaded.items():
+                if self._is_live(user_id, seq):
+                    self._starved[user_id] = None
+            return
+        pushes, pairs_scored = result
+        self.pairs_scored += pairs_scored
+        self._offload_pushes = pushes[::-1]
+
+    def _apply_offloaded(self, deadline: Optional[float]) -> bool:
+        """Masukkan hasil worker ke heap; False jika `deadline` tercapai sebelum selesai."""
+        pushes, applied = self._offload_pushes, 0
+        while pushes:
+            applied += 1
+            if deadline is not None and not applied % DRAIN_CHECK_INTERVAL and time.perf_counter() >= deadline:
+                return False
+            key, score, user_id, seq, other_id, other_seq = pushes.pop()
+            if self._is_live(user_id, seq) and self._is_live(other_id, other_seq):
+                self._push(key, score, self._items.get(other_id), self._items.get(user_id))
+        self._offload_pushes = None
+        self._offloaded = {}
+        return True
+
+    @property
+    def coverage(self) -> float:
+        """Porsi antrean yang sudah selesai dinilai (1.0 = tidak ada yang tertunda)."""
+        if not len(self):
+            return 1.0
+        unscored = len(self._pending) + (self._scoring is not None) + len(self._offloaded)
+        return 1.0 - unscored / len(self)
+
+    @property
+    def queue(self) -> list:
+        """Isi antrean sesuai urutan kedatangan."""
+        return list(self._items)
+
+    def get(self, user_id: int) -> Optional[QueueEntry]:
+        """Entri pengguna yang sedang menunggu, baik yang sudah dinilai maupun yang belum."""
+        entry = self._items.get(user_id)
+        return entry if entry is not None else self._pending.get(user_id)
+
+    def add(self, entry: QueueEntry, exclude=()) -> None:
+        """Masukkan pengguna ke antrean dan nilai dia terhadap semua yang sudah menunggu."""
+        if entry.user_id in self._items:
+            return
+        if entry.enqueued_at is None:
+            entry.enqueued_at = time.time()
+        entry.order = self._next_seq
+        self._score(self._begin_scoring(entry, exclude))
+
+    def seed(self, entries, exclude_for: Callable[[int], set] = lambda user_id: (), window: int = SEED_WINDOW) -> int:
+        """
+        Isi antrean besar sekaligus tanpa deadline (misal benchmark). Setiap entri
+        hanya dinilai terhadap `window` entri sebelumnya, jadi biayanya O(N * window)
+        dan bukan O(N²); batas max_candidates per entri tetap berlaku. Pasangan di
+        luar jendela tidak pernah dinilai, sedangkan pengguna yang kehabisan pasangan
+        dinilai ulang penuh oleh `flush` seperti biasa. Mengembalikan jumlah entri baru.
+        """
+        recent = deque(maxlen=window)
+        added = 0
+        for entry in entries:
+            if entry.user_id in self:
+                continue
+            if entry.enqueued_at is None:
+                entry.enqueued_at = time.time()
+            entry.order = self._next_seq
+            self._score(self._begin_scoring(entry, exclude_for(entry.user_id), window=recent))
+            recent.append(entry.user_id)
+            added += 1
+        return added
+
+    def update(self, entry: QueueEntry, exclude=()) -> bool:
+        """
+        Ganti data pengguna yang sedang menunggu (misal filter diubah lewat /setfilter)
+        tanpa kehilangan posisi antreannya. Skor lama otomatis tidak berlaku lagi.
+        """
+        user_id = entry.user_id
+        pending = self._pending.get(user_id)
+        if pending is not None:
+            entry.enqueued_at = pending.enqueued_at
+            self._pending.put(entry)
+            return True
+        current = self._items.get(user_id)
+        if current is None:
+            return False
+        entry.enqueued_at = current.enqueued_at
+        entry.order = current.order
+        self._unindex(user_id)
+        self._unlink(user_id)
+        self._starved.pop(user_id, None)
+        self._score(self._begin_scoring(entry, exclude))
+        return True
+
+    def _begin_scoring(self, entry, exclude, window=None) -> ScoringJob:
+        """
+        Siapkan job penilaian untuk `entry` lalu langsung indeks dia, agar pengguna
+        yang masuk sesudahnya menilai dia walau penilaiannya sendiri belum selesai.
+        Hanya memilih sumber kandidat; id-nya baru dibaca dan disaring di `_score`.
+        Dengan `window` (id), hanya id itu yang menjadi kandidat.
+        """
+        entry.seq = self._next_seq
+        self._next_seq += 1
+
+        compatible = {key for key in self._buckets if buckets_compatible(entry, key)}
+        nearby_ids = None if self._columns is not None else ()
+        if entry.located:
+            lat, lon = entry.latitude, entry.longitude
+            if self._columns is None:
+                # Hanya jalur skalar yang memakainya; superset kotak sel cukup karena di luar radius skor lokasi memang 0
+                nearby_ids = set(self._grid.around(lat, lon, LOCATION_SCORE_RADIUS_KM))
+            max_km = entry.filter_distance_km
+            if window is None and entry.use_filters and max_km:
+                # Filter jarak premium: hanya sel di sekitar radius yang perlu dibaca;
+                # jarak tepatnya tetap dicek oleh filter saat penilaian
+                job = ScoringJob(entry, exclude, compatible, [self._grid.around(lat, lon, max_km)], nearby_ids)
+                self._index(entry)
+                return job
+        if window is not None:
+            job = ScoringJob(entry, exclude, compatible, [list(window)], nearby_ids)
+        else:
+            job = ScoringJob(entry, exclude, None, list(compatible), nearby_ids)
+        self._index(entry)
+        return job
+
+    def _next_ids(self, job: ScoringJob, size: int) -> list:
+        """Potongan id berikutnya (paling banyak `size`), dibaca lintas sumber dan belum disaring."""
+        ids = []
+        while len(ids) < size and (job.pending_ids or job.sources):
+            if not job.pending_ids:
+                source = job.sources.pop()
+                # Bucket disalin saat dibaca karena isinya bisa berubah di antara tick
+                job.pending_ids = list(self._buckets.get(source, ())) if job.compatible is None else source
+            take = size - len(ids)
+            ids.extend(job.pending_ids[-take:])
+            del job.pending_ids[-take:]
+        return ids
+
+    def _candidates(self, job: ScoringJob, ids: list) -> list:
+        """Entri kandidat dari potongan id yang masih perlu dinilai terhadap entri job."""
+        entry, items, bucket_of, compatible = job.entry, self._items, self._bucket_of, job.compatible
+        exclude, skipped = job.exclude, self._skipped.get(entry.user_id, ())
+        candidates = []
+        for uid in ids:
+            other = items.get(uid)
+            # seq lebih besar berarti dia masuk (atau dinilai ulang) sesudah entry dan sudah menilai entry sendiri
+            if other is None or other.seq >= entry.seq or uid in exclude or uid in skipped:
+                continue
+            if compatible is not None and bucket_of[uid] not in compatible:
+                continue
+            candidates.append(other)
+        return candidates
+
+    def _score(self, job: ScoringJob, deadline: Optional[float] = None, force: bool = False) -> bool:
+        """
+        Nilai kandidat job per potongan. Dengan `deadline`, deadline dicek sebelum
+        setiap potongan dan potongan hanya sebesar yang muat di sisa waktu; False
+        jika waktunya habis sebelum selesai, sisa sumber kandidat tetap di job untuk
+        dilanjutkan. `force` menjamin potongan pertama tetap dinilai (minimal
+        SCORE_CHUNK_MIN). Kandidat terbaik dikumpulkan di job dan baru masuk heap
+        setelah selesai.
+        """
+        entry, items = job.entry, self._items
+        while job.pending_ids or job.sources:
+            if items.get(entry.user_id) is not entry:
+                # Dikeluarkan atau diganti lewat update() di tengah penilaian
+                return True
+            size = SCORE_CHUNK_SIZE
+            if deadline is not None:
+                # Setengah sisa waktu saja, cadangan untuk estimasi biaya yang meleset
+                size = min(size, int((deadline - time.perf_counter()) / (2 * self._id_cost)))
+                if size < SCORE_CHUNK_MIN:
+                    if not force:
+                        return False
+                    size = SCORE_CHUNK_MIN
+            force = False
+
+            started = time.perf_counter()
+            ids = self._next_ids(job, size)
+            if self._columns is not None and len(ids) >= VECTORIZE_MIN_CANDIDATES:
+                self._rank_rows(job, ids)
+            else:
+                candidates = self._candidates(job, ids)
+                self._rank(job, candidates, score_candidates(entry, candidates, job.nearby_ids))
+            if ids:
+                self._id_cost += 0.2 * ((time.perf_counter() - started) / len(ids) - self._id_cost)
+
+        if items.get(entry.user_id) is not entry:
+            return True
+        for key, _, other_id, other_seq, score in job.best:
+            other = items.get(other_id)
+            # Kandidat yang keluar atau diganti selama job berjalan sudah tidak berlaku
+            if other is not None and other.seq == other_seq:
+                self._push(key, score, other, entry)
+        return True
+
+    def _min_score(self) -> float:
+        # Tanpa aging, pasangan di bawah ambang tidak akan pernah dipilih; dengan aging semua skor >= 0 bisa
+        return 0 if self.wait_bonus_per_sec > 0 else self.threshold
+
+    def _rank(self, job: ScoringJob, candidates: list, scores: list) -> None:
+        """Jalur skalar: masukkan kandidat yang layak ke heap atau ke K terbaik job."""
+        entry, best, links = job.entry, job.best, self._links
+        limit, min_score = self.max_candidates, self._min_score()
+        self.pairs_scored += len(candidates)
+        for other, score in zip(candidates, scores):
+            if score >= min_score:
+                paired_since = max(other.enqueued_at, entry.enqueued_at) - self._epoch
+                key = score - self.wait_bonus_per_sec * paired_since
+                if limit is not None and len(links.get(other.user_id, ())) < limit:
+                    # Kandidat yang pasangannya belum penuh langsung dapat pasangan ini, agar
+                    # pengguna yang tidak masuk K terbaik siapa pun tetap punya entri di heap
+                    self._push(key, score, other, entry)
+                    continue
+                # Seri dipecah seperti di heap: yang lebih dulu masuk antrean menang
+                _offer(best, (key, -other.order, other.user_id, other.seq, score), limit)
+
+    def _rank_rows(self, job: ScoringJob, ids: list) -> None:
+        """
+        Jalur numpy untuk `_candidates` + `_rank`: penyaringan, skor dan seleksi
+        dikerjakan pada irisan kolom persisten, dan hanya kandidat yang masuk heap
+        atau masih bisa masuk K terbaik yang diproses satu per satu.
+        """
+        columns, entry = self._columns, job.entry
+        rows = columns.rows_of(ids)
+        rows = rows[rows >= 0]
+        codes = None if job.compatible is None else [self._bucket_codes[key] for key in job.compatible]
+        excluded = [
+            columns.row_of(uid) for uid in (*job.exclude, *self._skipped.get(entry.user_id, ())) if uid in columns
+        ]
+        rows = _select_rows(columns, rows, entry.seq, codes, excluded)
+        self.pairs_scored += len(rows)
+        direct = _rank_block(
+            columns, columns.row_of(entry.user_id), rows, self._min_score(), self.wait_bonus_per_sec, self._epoch,
+            self.max_candidates, job.best,
+        )
+        for key, score, row in direct:
+            self._push(key, score, self._items.get(int(columns.user_id[row])), entry)
+
+    def _index(self, entry):
+        self._items.put(entry)
+        key = bucket_key(entry)
+        self._buckets.setdefault(key, set()).add(entry.user_id)
+        self._bucket_of[entry.user_id] = key
+        if self._columns is not None:
+            row = self._columns.add(entry)
+            self._columns.bucket[row] = self._bucket_codes.setdefault(key, len(self._bucket_codes))
+            self._columns.links[row] = len(self._links.get(entry.user_id, ()))
+        if entry.located:
+            self._grid.add(entry.user_id, entry.latitude, entry.longitude)
+
+    def _push(self, key, score, x, y):
+        # Seri dipecah berdasarkan urutan antrean: pengguna yang lebih dulu masuk ditaruh di depan
+        if x.order > y.order:
+            x, y = y, x
+        heapq.heappush(self._heap, (-key, x.order, y.order, x.seq, y.seq, x.user_id, y.user_id, score))
+        self._links.setdefault(x.user_id, set()).add(y.user_id)
+        self._links.setdefault(y.user_id, set()).add(x.user_id)
+        self._count_links(x.user_id, len(self._links[x.user_id]))
+        self._count_links(y.user_id, len(self._links[y.user_id]))
+
+    def _count_links(self, user_id, count):
+        """Salin jumlah pasangan heap `user_id` ke kolomnya, dipakai `_rank_rows` untuk cek kandidat yang belum penuh."""
+        if self._columns is not None:
+            row = self._columns.row_of(user_id)
+            if row is not None:
+                self._columns.links[row] = count
+
+    def _drop_link(self, user_id, partner_id):
+        links = self._links.get(user_id)
+        if links is None:
+            return
+        links.discard(partner_id)
+        self._count_links(user_id, len(links))
+        if not links:
+            del self._links[user_id]
+            if user_id in self._items:
+                self._starved[user_id] = None
+
+    def _unlink(self, user_id):
+        """Lepas semua pasangan heap milik `user_id`; pasangan yang jadi tidak punya kandidat dinilai ulang."""
+        for partner_id in self._links.pop(user_id, ()):
+            self._drop_link(partner_id, user_id)
+
+    def _unindex(self, user_id):
+        self._grid.remove(user_id)
+        if self._columns is not None:
+            self._columns.discard(user_id)
+        key = self._bucket_of.pop(user_id, None)
+        if key is not None:
+            members = self._buckets[key]
+            members.discard(user_id)
+            if not members:
+                del self._buckets[key]
+
+    def remove(self, user_id: int, compact: bool = True) -> Optional[QueueEntry]:
+        """
+        Keluarkan pengguna dari antrean. Entri heap miliknya dibuang secara lazy;
+        jika heap sudah terlalu banyak berisi entri basi dan `compact`, heap dibangun ulang.
+        """
+        if user_id in self._pending:
+            return self._pending.pop(user_id)
+        entry = self._items.pop(user_id)
+        if entry is None:
+            return None
+        self._unindex(user_id)
+        self._unlink(user_id)
+        self._skipped.pop(user_id, None)
+        self._starved.pop(user_id, None)
+        if compact and len(self._heap) > 64 and len(self._heap) > 2 * self._max_live_pairs():
+            self._compact()
+        return entry
+
+    def _max_live_pairs(self) -> int:
+        """
+        Batas atas entri heap yang masih hidup: setiap pengguna menaruh paling banyak
+        max_candidates dari penilaiannya sendiri, ditambah paling banyak max_candidates
+        dari pendatang baru selama pasangannya belum penuh.
+        """
+        n = len(self._items)
+        return n * n if self.max_candidates is None else 2 * n * self.max_candidates
+
+    def effective_score(self, key: float, now: float) -> float:
+        return key + self.wait_bonus_per_sec * (now - self._epoch)
+
+    def pop_best_pair(self, is_excluded: Optional[Callable[[int, int], bool]] = None, now: Optional[float] = None,
+                      deadline: Optional[float] = None):
+        """
+        Ambil pasangan terbaik yang masih valid dan keluarkan keduanya dari antrean.
+        Mengembalikan (entry_a, entry_b, skor_efektif) atau None. Dengan `deadline`
+        (nilai time.perf_counter()), pembuangan entri basi juga berhenti saat waktunya
+        habis dan mengembalikan None; sisanya dibuang pada panggilan berikutnya.
+        Pasangan juga tidak dikeluarkan jika perkiraan biaya mengeluarkannya tidak
+        muat di sisa waktu. `timed_out` menandai None karena deadline.
+        Pemadatan heap tidak dilakukan di sini agar putaran pencocokan tetap dalam anggaran.
+        """
+        self.timed_out = False
+        now = time.time() if now is None else now
+        heap = self._heap
+        drained = 0
+        while heap:
+            drained += 1
+            if deadline is not None and not drained % DRAIN_CHECK_INTERVAL and time.perf_counter() >= deadline:
+                self.timed_out = True
+                return None
+            neg_key, _, _, seq_a, seq_b, a_id, b_id, _ = heap[0]
+            if not (self._is_live(a_id, seq_a) and self._is_live(b_id, seq_b)):
+                heapq.heappop(heap)
+                continue
+            if is_excluded and is_excluded(a_id, b_id):
+                heapq.heappop(heap)
+                self._skipped.setdefault(a_id, set()).add(b_id)
+                self._skipped.setdefault(b_id, set()).add(a_id)
+                self._drop_link(a_id, b_id)
+                self._drop_link(b_id, a_id)
+                continue
+            effective = self.effective_score(-neg_key, now)
+            if effective < self.threshold:
+                # Pasangan teratas belum layak, berarti belum ada pasangan lain yang layak
+                return None
+            # Biaya mengeluarkan pasangan sebanding dengan jumlah pasangan heap yang harus dilepas
+            n_links = len(self._links.get(a_id, ())) + len(self._links.get(b_id, ())) + 1
+            if deadline is not None and time.perf_counter() + 2 * n_links * self._link_cost > deadline:
+                self.timed_out = True
+                return None
+            heapq.heappop(heap)
+            started = time.perf_counter()
+            pair = self.remove(a_id, compact=False), self.remove(b_id, compact=False), effective
+            self._link_cost += 0.2 * ((time.perf_counter() - started) / n_links - self._link_cost)
+            return pair
+        return None
+
+    def _is_live(self, user_id, seq) -> bool:
+        entry = self._items.get(user_id)
+        return entry is not None and entry.seq == seq
+
+    def _compact(self):
+        self._heap = [
+            e for e in self._heap
+            if self._is_live(e[5], e[3]) and self._is_live(e[6], e[4])
+        ]
+        heapq.heapify(self._heap)
+
+    @classmethod
+    def from_legacy_queue(cls, waiting_queue: list, registry: "InterestRegistry | InterestIndex") -> "Matchmaker":
+        """Bangun ulang dari `waiting_queue` lama (list of dict) milik persistence."""
+        matchmaker = cls()
+        for item in waiting_queue:
+            matchmaker.submit(QueueEntry.from_item(item, registry))
+        return matchmaker
+
+
+_REPLICA_KEYS = count()
+_replica = None  # (kunci, QueueColumns) replika kolom antrean milik proses worker ini
+
+def score_offloaded(replica: tuple, jobs: list, params: tuple) -> Optional[tuple]:
+    """
+    Worker ProcessPoolExecutor untuk `Matchmaker.offload_pending`: perbarui replika
+    kolom antrean, lalu nilai setiap pendatang terhadap baris yang masuk sebelum dia
+    dengan seleksi yang sama seperti penilaian di Matchmaker. Mengembalikan (pasangan,
+    jumlah pasangan dinilai); setiap pasangan berupa (kunci, skor, user_id, seq,
+    user_id_lain, seq_lain). None jika delta tidak cocok dengan replika di proses ini.
+    """
+    global _replica
+    key, base, data = replica
+    if base is None:
+        columns = data
+        columns.reindex()
+    elif _replica is not None and _replica[0] == base:
+        columns = _replica[1]
+        columns.apply_delta(data)
+    else:
+        _replica = None
+        return None
+    _replica = key, columns
+
+    min_score, wait_bonus_per_sec, epoch, limit = params
+    everyone = np.flatnonzero(columns.user_id >= 0)
+    pushes, pairs_scored = [], 0
+    for user_id, codes, exclude in jobs:
+        row = columns.row_of(user_id)
+        seq = int(columns.seq[row])
+        excluded = [columns.row_of(uid) for uid in exclude if uid in columns]
+        rows = _select_rows(columns, everyone, seq, codes, excluded)
+        pairs_scored += len(rows)
+        best = []
+        chosen = [
+            (key, score, int(columns.user_id[other]), int(columns.seq[other]))
+            for key, score, other in _rank_block(columns, row, rows, min_score, wait_bonus_per_sec, epoch, limit, best)
+        ]
+        chosen += [(key, score, other_id, other_seq) for key, _, other_id, other_seq, score in best]
+        for key, score, other_id, other_seq in chosen:
+            pushes.append((key, score, user_id, seq, other_id, other_seq))
+            # Jumlah pasangan diperbarui seperti _push, agar pendatang berikutnya melihat kandidat yang sudah penuh
+            columns.links[columns.row_of(other_id)] += 1
+            columns.links[row] += 1
+    return pushes, pairs_scored
+
+
+class MatchStats:
+    """
+    Statistik putaran pencocokan, untuk menyetel batas waktu per putaran
+    terhadap ukuran antrean. Hanya putaran dengan antrean berisi yang dicatat.
+    """
+
+    def __init__(self):
+        self.passes = 0
+        self.budget_hits = 0
+        self.pairs = 0
+        self.coverage_total = 0.0
+        self.last_coverage = 1.0
+        self.last_queue_size = 0
+        self.last_pass_ms = 0.0
+        self.max_pass_ms = 0.0
+
+    def record(self, pass_ms: float, budget_hit: bool, coverage: float, queue_size: int, pairs: int) -> None:
+        self.passes += 1
+        self.budget_hits += budget_hit
+        self.pairs += pairs
+        self.coverage_total += coverage
+        self.last_coverage = coverage
+        self.last_queue_size = queue_size
+        self.last_pass_ms = pass_ms
+        self.max_pass_ms = max(self.max_pass_ms, pass_ms)
+
+    @property
+    def budget_hit_rate(self) -> float:
+        return self.budget_hits / self.passes if self.passes else 0.0
+
+    @property
+    def avg_coverage(self) -> float:
+        return self.coverage_total / self.passes if self.passes else 1.0
+
+
+# =============================
+# PENCARIAN TERARAH (/find)
+# =============================
+
+class FindIndex:
+    """
+    Indeks pengguna yang sedang online atau menunggu, untuk /find premium.
+    Kandidat dipersempit lewat indeks usia terurut (bisect), indeks gender,
+    InterestIndex dan GeoGrid; hanya irisannya yang dinilai.
+    """
+
+    def __init__(self, online_window_sec: float, interest_index: InterestIndex):
+        self.online_window_sec = online_window_sec
+        self.interest_index = interest_index
+        self._entries = {}      # user_id -> QueueEntry
+        self._last_seen = {}    # user_id -> waktu aktivitas terakhir, urut dari yang paling lama
+        self._ages = []         # [(usia, user_id)] terurut
+        self._by_gender = {}    # gender -> {user_id}
+        self._grid = GeoGrid()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def get(self, user_id: int) -> Optional[QueueEntry]:
+        return self._entries.get(user_id)
+
+    def touch(self, user_id: int, now: Optional[float] = None) -> bool:
+        """Perbarui waktu aktivitas. False jika user belum ada di indeks (perlu `put`)."""
+        if user_id not in self._entries:
+            return False
+        self._last_seen.pop(user_id)
+        self._last_seen[user_id] = time.time() if now is None else now
+        return True
+
+    def put(self, entry: QueueEntry, now: Optional[float] = None) -> None:
+        user_id = entry.user_id
+        self.remove(user_id)
+        self._entries[user_id] = entry
+        self._last_seen[user_id] = time.time() if now is None else now
+        bisect.insort(self._ages, (entry.age or 0, user_id))
+        self._by_gender.setdefault(entry.gender, set()).add(user_id)
+        if entry.located:
+            self._grid.add(user_id, entry.latitude, entry.longitude)
+
+    def remove(self, user_id: int) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        del self._last_seen[user_id]
+        key = (entry.age or 0, user_id)
+        i = bisect.bisect_left(self._ages, key)
+        if i < len(self._ages) and self._ages[i] == key:
+            del self._ages[i]
+        members = self._by_gender.get(entry.gender)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del self._by_gender[entry.gender]
+        self._grid.remove(user_id)
+
+    def expire(self, now: Optional[float] = None, keep: Callable[[int], bool] = lambda user_id: False) -> int:
+        """Buang user yang tidak aktif selama `online_window_sec`, kecuali yang `keep` (misal masih menunggu)."""
+        now = time.time() if now is None else now
+        cutoff = now - self.online_window_sec
+        expired = 0
+        for user_id, seen in list(self._last_seen.items()):
+            if seen >= cutoff:
+                break
+            if keep(user_id):
+                self.touch(user_id, now)
+            else:
+                self.remove(user_id)
+                expired += 1
+        return expired
+
+    def _age_range(self, age_min, age_max) -> set:
+        lo = bisect.bisect_left(self._ages, (age_min or 0, float('-inf')))
+        hi = bisect.bisect_right(self._ages, (age_max, float('inf'))) if age_max else len(self._ages)
+        return {user_id for _, user_id in self._ages[lo:hi]}
+
+    def candidates(self, entry: QueueEntry, interests=()) -> set:
+        """Irisan indeks sesuai filter `entry` (jika aktif) dan minat yang dicari (salah satu dari `interests`)."""
+        narrowed = []
+        if entry.use_filters:
+            if entry.filter_gender == 'same':
+                narrowed.append(self._by_gender.get(entry.gender, set()))
+            elif entry.filter_gender == 'opposite':
+                narrowed.append({uid for gender, ids in self._by_gender.items() if gender != entry.gender for uid in ids})
+            if entry.filter_age_min or entry.filter_age_max:
+                narrowed.append(self._age_range(entry.filter_age_min, entry.filter_age_max))
+            if entry.filter_distance_km and entry.located:
+                narrowed.append(self._grid.within(entry.latitude, entry.longitude, entry.filter_distance_km))
+        if interests:
+            # InterestIndex mencakup semua user, jadi dibatasi ke yang ada di indeks ini
+            narrowed.append(self.interest_index.users_with(interests))
+            narrowed.append(self._entries.keys())
+
+        if not narrowed:
+            return set(self._entries)
+        narrowed.sort(key=len)
+        result = set(narrowed[0])
+        for ids in narrowed[1:]:
+            result &= ids
+            if not result:
+                break
+        return result
+
+    def search(self, entry: QueueEntry, interests=(), exclude: Callable[[int], bool] = lambda user_id: False,
+               limit: int = 5, deadline: Optional[float] = None) -> list:
+        """
+        Kandidat terbaik untuk `entry` sebagai list (skor, user_id), skor tertinggi dulu.
+        Penilaian berhenti di `deadline` (time.perf_counter()) dan mengembalikan yang terbaik sejauh itu.
+        """
+        top = []
+        for n, user_id in enumerate(self.candidates(entry, interests)):
+            if n % 256 == 255 and deadline is not None and time.perf_counter() >= deadline:
+                break
+            if user_id == entry.user_id or exclude(user_id):
+                continue
+            score = score_entries(self._entries[user_id], entry)
+            if score < 0:
+                continue
+            if len(top) < limit:
+                heapq.heappush(top, (score, user_id))
+            elif score > top[0][0]:
+                heapq.heapreplace(top, (score, user_id))
+        return sorted(top, reverse=True)
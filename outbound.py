@@ -0,0 +1,434 @@
+# ======================================================
+# outbound.py - Pengaturan lalu lintas keluar ke Bot API untuk bot.py
+# ======================================================
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Jalur prioritas: relay & notifikasi match selalu didahulukan dari broadcast
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+# `rate_limit_args` untuk pesan massal (broadcast)
+BULK_RATE_LIMIT_ARGS = {'priority': PRIORITY_BULK}
+
+# Bukan pesan: hanya dihitung di bucket global, tidak memakai jatah atau slot per chat
+CHAT_EXEMPT_ENDPOINTS = frozenset({'sendChatAction', 'answerCallbackQuery', 'getChat', 'getFile', 'getMe'})
+
+# Token bucket per chat yang penuh tidak menyimpan informasi; dibuang berkala
+CHAT_BUCKET_SWEEP_SECONDS = 60
+
+
+class TypingThrottle:
+    """
+    Menggabungkan indikator "mengetik" per chat tujuan: paling banyak satu
+    `send_chat_action` setiap `interval_sec`. Telegram menampilkan indikator
+    sekitar 5 detik, jadi aksi yang lebih rapat dari itu tidak terlihat
+    bedanya oleh penerima dan hanya memakan kuota API.
+    """
+
+    def __init__(self, interval_sec: float):
+        self.interval_sec = interval_sec
+        self._last_sent = {}  # chat_id -> waktu monotonic aksi terakhir
+        self._next_sweep = 0.0
+
+    def __len__(self):
+        return len(self._last_sent)
+
+    def should_send(self, chat_id: int, now: Optional[float] = None) -> bool:
+        """True jika indikator untuk `chat_id` boleh dikirim sekarang (dan catat pengirimannya)."""
+        now = time.monotonic() if now is None else now
+        if now >= self._next_sweep:
+            self._sweep(now)
+        last = self._last_sent.get(chat_id)
+        if last is not None and now - last < self.interval_sec:
+            return False
+        self._last_sent[chat_id] = now
+        return True
+
+    def _sweep(self, now: float) -> None:
+        # Entri yang sudah lewat interval tidak lagi menahan apa pun, buang agar dict tidak tumbuh tanpa batas
+        self._last_sent = {chat_id: last for chat_id, last in self._last_sent.items() if now - last < self.interval_sec}
+        self._next_sweep = now + self.interval_sec
+
+
+# =============================
+# PENJADWAL KELUAR
+# =============================
+
+class TokenBucket:
+    """Token bucket sederhana: `rate` token per detik, menampung paling banyak `capacity`."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'stamp')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.stamp:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def delay(self, now: float, reserve: float = 0.0) -> float:
+        """Detik sampai satu token tersedia sambil menyisakan `reserve` token."""
+        self._refill(now)
+        wait = max(0.0, self.stamp - now)
+        missing = 1 + reserve - self.tokens
+        return wait + missing / self.rate if missing > 0 else wait
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, until: float) -> None:
+        """Tahan bucket sampai `until` (RetryAfter); satu token langsung tersedia setelahnya."""
+        if until > self.stamp:
+            self.tokens, self.stamp = 1.0, until
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.stamp <= now and self.tokens >= self.capacity
+
+
+def _retry_seconds(retry_after) -> float:
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class OutboundScheduler(BaseRateLimiter[dict]):
+    """
+    Rate limiter untuk ExtBot (`ApplicationBuilder().rate_limiter(...)`), jadi
+    setiap panggilan Bot API lewat sini. Permintaan menunggu di jalur
+    prioritas per chat dan baru dijalankan jika token bucket global dan token
+    bucket chat tujuan sama-sama siap. Per chat hanya satu permintaan yang
+    berjalan sekaligus, sehingga urutan pesan ke satu chat terjaga.
+
+    Broadcast memakai ``rate_limit_args=BULK_RATE_LIMIT_ARGS`` dan
+    selalu menyisakan `bulk_reserve` token global untuk lalu lintas
+    interaktif. RetryAfter untuk sebuah chat hanya menahan bucket chat itu
+    selama `retry_after` (chat lain tetap jalan); RetryAfter tanpa chat
+    tujuan menahan bucket global. Permintaan lalu diulang dari depan
+    antrean chat-nya.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 bulk_reserve: float = 6, max_retries: int = 3):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.bulk_reserve = bulk_reserve
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+        self._chats = {}                                   # chat_id -> TokenBucket
+        self._lanes = tuple({} for _ in range(PRIORITY_BULK + 1))  # per prioritas: chat_id -> deque[Future]
+        self._busy = set()                                 # chat dengan permintaan yang sedang berjalan
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._next_sweep = 0.0
+        self.sent = 0
+        self.retried = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(waiters) for lane in self._lanes for waiters in lane.values())
+
+    async def initialize(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for lane in self._lanes:
+            for waiters in lane.values():
+                for waiter in waiters:
+                    waiter.cancel()
+            lane.clear()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: dict,
+        endpoint: str,
+        data: dict,
+        rate_limit_args: Optional[dict],
+    ):
+        rate_limit_args = rate_limit_args or {}
+        priority = rate_limit_args.get('priority', PRIORITY_INTERACTIVE)
+        max_retries = rate_limit_args.get('max_retries', self.max_retries)
+        chat_id = None if endpoint in CHAT_EXEMPT_ENDPOINTS else data.get('chat_id')
+
+        await self._acquire(chat_id, priority)
+        holding, attempt = True, 0
+        try:
+            while True:
+                try:
+                    result = await callback(*args, **kwargs)
+                    self.sent += 1
+                    return result
+                except RetryAfter as e:
+                    if attempt >= max_retries:
+                        raise
+                    attempt += 1
+                    self.retried += 1
+                    delay = _retry_seconds(e.retry_after)
+                    logger.warning(f"RetryAfter {delay:.0f} dtk untuk {endpoint} ke {chat_id}, percobaan ulang ke-{attempt}")
+                    self._pause(chat_id, delay)
+                    # Lepas slot chat dan antre lagi di paling depan, agar tidak ada pesan lain ke chat ini yang menyalip
+                    holding = False
+                    await self._acquire(chat_id, priority, front=True, release=True)
+                    holding = True
+        finally:
+            if holding:
+                self._release(chat_id)
+
+    async def _acquire(self, chat_id, priority: int, front: bool = False, release: bool = False) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        waiters = self._lanes[priority].setdefault(chat_id, deque())
+        if front:
+            waiters.appendleft(waiter)
+        else:
+            waiters.append(waiter)
+        if release:
+            self._release(chat_id)
+        self._wakeup.set()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Jika izin sudah diberikan tepat sebelum pembatalan, slot chat harus dikembalikan
+            if waiter.done() and not waiter.cancelled():
+                self._release(chat_id)
+            raise
+
+    def _release(self, chat_id) -> None:
+        self._busy.discard(chat_id)
+        self._wakeup.set()
+
+    def _pause(self, chat_id, delay: float) -> None:
+        now = time.monotonic()
+        if chat_id is not None:
+            self._chat_bucket(chat_id, now).pause(now + delay)
+        else:
+            # Flood wait yang tidak terkait satu chat berlaku untuk seluruh bot
+            self._global.pause(now + delay)
+
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            wait = self._dispatch(time.monotonic())
+            if wait is None:
+                await self._wakeup.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _dispatch(self, now: float) -> Optional[float]:
+        """Beri izin ke semua permintaan yang siap. Mengembalikan detik sampai permintaan berikutnya siap (None jika kosong)."""
+        if now >= self._next_sweep:
+            self._chats = {chat_id: b for chat_id, b in self._chats.items() if chat_id in self._busy or not b.is_full(now)}
+            self._next_sweep = now + CHAT_BUCKET_SWEEP_SECONDS
+
+        next_wait = None
+        for priority, lane in enumerate(self._lanes):
+            reserve = 0.0 if priority == PRIORITY_INTERACTIVE else self.bulk_reserve
+            emptied, rotated = [], []
+            global_wait = 0.0
+            for chat_id, waiters in lane.items():
+                while waiters and waiters[0].done():  # pemanggil sudah dibatalkan
+                    waiters.popleft()
+                if not waiters:
+                    emptied.append(chat_id)
+                    continue
+                if chat_id is not None and chat_id in self._busy:
+                    continue
+                bucket = self._chat_bucket(chat_id, now) if chat_id is not None else None
+                wait = bucket.delay(now) if bucket else 0.0
+                if wait > 0:
+                    next_wait = wait if next_wait is None else min(next_wait, wait)
+                    continue
+                global_wait = self._global.delay(now, reserve)
+                if global_wait > 0:
+                    break
+                self._global.take()
+                if bucket:
+                    bucket.take()
+                    self._busy.add(chat_id)
+                waiters.popleft().set_result(None)
+                (rotated if waiters else emptied).append(chat_id)
+            for chat_id in emptied:
+                del lane[chat_id]
+            for chat_id in rotated:  # giliran bergilir antar chat dalam satu jalur
+                lane[chat_id] = lane.pop(chat_id)
+            if global_wait > 0:
+                # Jalur prioritas lebih rendah butuh token global lebih banyak lagi, jadi berhenti di sini
+                return global_wait if next_wait is None else min(next_wait, global_wait)
+        return next_wait
+
+
+# =============================
+# ANTREAN RELAY PER SESI
+# =============================
+
+class RelayQueue:
+    """
+    Antrean keluar berurutan untuk satu arah relay (pengirim -> partner) dalam
+    satu sesi, dengan satu task konsumen. Task hanya hidup selama antrean
+    berisi, jadi sesi yang diam tidak memegang task apa pun.
+
+    `deliver(item)` mengirim satu item dan mengembalikan False jika sesi harus
+    dihentikan (kegagalan permanen); sisa antrean lalu dibuang. Jika antrean
+    penuh (partner sedang kena rate limit), item baru ditolak dan `dropped`
+    bertambah sampai antrean kosong lagi.
+    """
+
+    def __init__(self, deliver: Callable[[Any], Coroutine[Any, Any, bool]], maxsize: int,
+                 on_idle: Callable[["RelayQueue"], None] = lambda queue: None):
+        self.maxsize = maxsize
+        self.closed = False
+        self.dropped = 0
+        self._deliver = deliver
+        self._on_idle = on_idle
+        self._items = deque()
+        self._task = None
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item) -> bool:
+        """Masukkan item. False jika antrean penuh atau sudah ditutup."""
+        if self.closed:
+            return False
+        if len(self._items) >= self.maxsize:
+            self.dropped += 1
+            return False
+        self._items.append(item)
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain())
+        return True
+
+    def close(self) -> None:
+        """Tutup antrean dan buang item yang belum terkirim; item yang sedang dikirim dibiarkan selesai."""
+        self.closed = True
+        self._items.clear()
+
+    async def _drain(self) -> None:
+        try:
+            while self._items:
+                item = self._items.popleft()
+                try:
+                    keep_going = await self._deliver(item)
+                except Exception:
+                    logger.exception("Relay: pengiriman gagal dengan error tak terduga")
+                    keep_going = True
+                if not keep_going:
+                    self.close()
+        finally:
+            self._task = None
+            self.dropped = 0
+            self._on_idle(self)
+
+
+class RelayQueues:
+    """Kumpulan RelayQueue aktif, dengan kunci (session_id, pengirim). Antrean dilepas begitu kosong."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._queues = {}
+
+    def __len__(self):
+        return len(self._queues)
+
+    def get(self, session_id: int, sender_id: int, deliver: Callable[[Any], Coroutine[Any, Any, bool]]) -> RelayQueue:
+        key = (session_id, sender_id)
+        queue = self._queues.get(key)
+        if queue is None or queue.closed:
+            queue = self._queues[key] = RelayQueue(deliver, self.maxsize, on_idle=lambda q: self._forget(key, q))
+        return queue
+
+    def _forget(self, key, queue: RelayQueue) -> None:
+        if self._queues.get(key) is queue:
+            del self._queues[key]
+
+    def close_session(self, session_id: int, *user_ids: int) -> None:
+        """Tutup antrean kedua arah saat sesi berakhir."""
+        for user_id in user_ids:
+            queue = self._queues.pop((session_id, user_id), None)
+            if queue is not None:
+                queue.close()
+
+
+class MediaGroup:
+    """Satu album yang sedang dikumpulkan. Konsumen relay menunggu `wait()` sampai album lengkap."""
+
+    __slots__ = ('messages', '_ready', '_timer')
+
+    # Telegram membatasi satu album paling banyak 10 item
+    MAX_ITEMS = 10
+
+    def __init__(self):
+        self.messages = []
+        self._ready = asyncio.Event()
+        self._timer = None
+
+    @property
+    def complete(self) -> bool:
+        return self._ready.is_set()
+
+    async def wait(self) -> list:
+        await self._ready.wait()
+        return self.messages
+
+
+class MediaGroupBuffer:
+    """
+    Menggabungkan item album (update terpisah dengan `media_group_id` sama)
+    menjadi satu MediaGroup. Album dianggap lengkap setelah `window_sec`
+    tanpa item baru, atau begitu mencapai 10 item.
+    """
+
+    def __init__(self, window_sec: float):
+        self.window_sec = window_sec
+        self._open = {}  # (pengirim, media_group_id) -> MediaGroup
+
+    def __len__(self):
+        return len(self._open)
+
+    def add(self, sender_id: int, media_group_id: str, message) -> Optional[MediaGroup]:
+        """Tambahkan item album. Mengembalikan MediaGroup baru untuk item pertama (untuk diantrekan), None untuk item berikutnya."""
+        key = (sender_id, media_group_id)
+        group = self._open.get(key)
+        is_new = group is None
+        if is_new:
+            group = self._open[key] = MediaGroup()
+        group.messages.append(message)
+        if group._timer is not None:
+            group._timer.cancel()
+        if len(group.messages) >= MediaGroup.MAX_ITEMS:
+            self._close(key, group)
+        else:
+            group._timer = asyncio.get_running_loop().call_later(self.window_sec, self._close, key, group)
+        return group if is_new else None
+
+    def _close(self, key, group: MediaGroup) -> None:
+        if self._open.get(key) is group:
+            del self._open[key]
+        group._timer = None
+        group._ready.set()
@@ -0,0 +1,380 @@
+import gc
+import os
+import pickle
+import random
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matchmaking
+from matchmaking import (
+    InterestIndex, InterestRegistry, Matchmaker, QueueEntry, ScoreColumns, calculate_match_score, np, score_entries, score_matrix,
+    score_offloaded,
+)
+
+INTERESTS = ["musik", "film", "gaming", "olahraga", "traveling", "kuliner", "membaca", "teknologi"]
+# Cukup banyak minat manual agar bitmask melewati satu kata uint64
+MANUAL_INTERESTS = [f"minat{i}" for i in range(150)]
+
+
+def make_items(n: int, seed: int) -> list:
+    """Item antrean (dict dengan 'profile') yang mencakup filter premium, tanpa lokasi dan minat langka."""
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        located = rng.random() < 0.6
+        interests = set(rng.sample(INTERESTS, rng.randint(0, 4)))
+        if rng.random() < 0.3:
+            interests.update(rng.sample(MANUAL_INTERESTS, rng.randint(1, 3)))
+        use_filters = rng.random() < 0.3
+        profile = {
+            'user_id': i, 'gender': rng.choice(["Laki-laki", "Perempuan", None]),
+            'age': rng.choice([None, rng.randint(15, 50)]), 'karma': rng.randint(0, 200),
+            'latitude': -6.2 + rng.gauss(0, 0.5) if located else None,
+            'longitude': 106.8 + rng.gauss(0, 0.5) if located else None,
+            'interests': ",".join(sorted(interests)) or None,
+            'filter_gender': rng.choice(['opposite', 'same', None]) if use_filters else None,
+            'filter_age_min': rng.choice([None, 18, 21]) if use_filters else None,
+            'filter_age_max': rng.choice([None, 30, 40]) if use_filters else None,
+            'filter_distance_km': rng.choice([None, 10, 50]) if use_filters else None,
+        }
+        items.append({'user_id': i, 'use_filters': use_filters, 'profile': profile})
+    return items
+
+
+def check_score_parity(items: list, tolerance: float = 1e-9) -> list:
+    """
+    Bandingkan `score_entries` dan `score_matrix` dengan `calculate_match_score`
+    untuk semua pasangan item (dict dengan 'profile').
+    Mengembalikan daftar (i, j, skor_referensi, skor_skalar, skor_batch) yang berbeda.
+    """
+    registry = InterestRegistry()
+    entries = [QueueEntry.from_item(item, registry) for item in items]
+    matrix = score_matrix(entries)
+    mismatches = []
+    for i in range(len(items)):
+        for j in range(i + 1, len(items)):
+            expected = calculate_match_score(items[i], items[j])
+            scalar = score_entries(entries[i], entries[j])
+            if abs(expected - scalar) > tolerance or abs(expected - matrix[i, j]) > tolerance:
+                mismatches.append((i, j, expected, scalar, float(matrix[i, j])))
+    return mismatches
+
+
+@unittest.skipIf(np is None, "numpy tidak terpasang")
+class ScoreParityTest(unittest.TestCase):
+
+    def test_seeded_population(self):
+        self.assertEqual(check_score_parity(make_items(120, seed=1)), [])
+
+    def test_large_masks(self):
+        items = make_items(60, seed=2)
+        for n, item in enumerate(items):
+            item['profile']['interests'] = ",".join(MANUAL_INTERESTS[n % 7::7][:12])
+        self.assertEqual(check_score_parity(items), [])
+
+    def test_no_location(self):
+        items = make_items(60, seed=3)
+        for item in items:
+            item['profile']['latitude'] = item['profile']['longitude'] = None
+        self.assertEqual(check_score_parity(items), [])
+
+    def test_columns_reuse_rows(self):
+        registry = InterestRegistry(INTERESTS)
+        entries = [QueueEntry.from_item(item, registry) for item in make_items(200, seed=4)]
+        columns = ScoreColumns(capacity=8)
+        for entry in entries[:120]:
+            columns.add(entry)
+        # Baris yang dilepas dipakai ulang oleh entri berikutnya, termasuk bitmask yang lebih lebar
+        for entry in entries[:60]:
+            columns.discard(entry.user_id)
+        for entry in entries[120:]:
+            entry.interest_mask |= 1 << 200
+            columns.add(entry)
+        live = entries[60:]
+        self.assertEqual(len(columns), len(live))
+        rows = [columns.row_of(entry.user_id) for entry in live]
+        for entry in live[::7]:
+            batch = columns.score_block([columns.row_of(entry.user_id)], rows)[0]
+            for other, score in zip(live, batch):
+                if other is not entry:
+                    self.assertAlmostEqual(float(score), score_entries(other, entry), places=9)
+
+
+class InterestIndexTest(unittest.TestCase):
+    def test_masks_stay_compact_as_interest_ids_grow(self):
+        index = InterestIndex()
+        # Minat manual baru terus dibuat dan ditinggalkan, sementara interest_id terus naik
+        for interest_id in range(1000):
+            index.define(f"minat{interest_id}", interest_id)
+            index.set_user(1, [interest_id, interest_id + 1000])
+            index.define(f"lain{interest_id}", interest_id + 1000)
+        self.assertEqual(index.mask_of(1), 0b11)
+        index.set_user(2, [5, 999])
+        self.assertEqual(index.mask_of(2), 0b101)
+        self.assertEqual(index.mask(["minat999", "minat5", "minat6", "baru"]), 0b101)
+
+    def test_freed_slots_are_reused(self):
+        index = InterestIndex()
+        index.set_user(1, [10, 20, 30])
+        index.set_user(2, [20])
+        index.set_user(1, [])
+        self.assertEqual(index.mask_of(2), 0b010)
+        index.set_user(3, [40, 50])
+        self.assertEqual(index.mask_of(3), 0b101)
+
+
+class MatchmakerTest(unittest.TestCase):
+
+    def make_entries(self, n: int, seed: int) -> list:
+        registry = InterestRegistry(INTERESTS)
+        entries = [QueueEntry.from_item(item, registry) for item in make_items(n, seed)]
+        for i, entry in enumerate(entries):
+            entry.enqueued_at = 1000.0 + i
+        return entries
+
+    def drain(self, matchmaker: Matchmaker, now: float, is_excluded=None) -> list:
+        pairs = []
+        while True:
+            matchmaker.flush()
+            best = matchmaker.pop_best_pair(is_excluded, now=now)
+            if best is not None:
+                pairs.append(best)
+            elif not matchmaker.pending_count:
+                return pairs
+
+    @unittest.skipIf(np is None, "numpy tidak terpasang")
+    def test_column_path_matches_scalar_path(self):
+        with mock.patch.object(matchmaking, 'np', None):
+            scalar = Matchmaker(wait_bonus_per_sec=1.0, max_candidates=4)
+        vectorized = Matchmaker(wait_bonus_per_sec=1.0, max_candidates=4)
+        for matchmaker in (scalar, vectorized):
+            for entry in self.make_entries(300, seed=7):
+                matchmaker.submit(entry)
+        blocked = {frozenset((i, i + 1)) for i in range(0, 300, 3)}
+        is_excluded = lambda a, b: frozenset((a, b)) in blocked
+        results = [
+            [(a.user_id, b.user_id, round(score, 9)) for a, b, score in self.drain(matchmaker, 2000.0, is_excluded)]
+            for matchmaker in (scalar, vectorized)
+        ]
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(scalar.pairs_scored, vectorized.pairs_scored)
+
+    def make_offload_pair(self, exclude_for):
+        """Dua matchmaker berisi antrean yang sama, masing-masing dengan 100 pendatang baru yang belum dinilai."""
+        matchmakers = Matchmaker(wait_bonus_per_sec=1.0, max_candidates=4), Matchmaker(wait_bonus_per_sec=1.0, max_candidates=4)
+        for matchmaker in matchmakers:
+            entries = self.make_entries(300, seed=9)
+            for entry in entries[:200]:
+                matchmaker.submit(entry)
+            matchmaker.flush(exclude_for=exclude_for)
+            for entry in entries[200:]:
+                matchmaker.submit(entry)
+        return matchmakers
+
+    @unittest.skipIf(np is None, "numpy tidak terpasang")
+    def test_offloaded_scoring_matches_inline(self):
+        blocked = {frozenset((i, i + 1)) for i in range(0, 300, 3)}
+        exclude_for = lambda user_id: {other for other in (user_id - 1, user_id + 1) if frozenset((user_id, other)) in blocked}
+        inline, offloaded = self.make_offload_pair(exclude_for)
+        inline.flush(exclude_for=exclude_for)
+        # Argumen dan hasil worker harus bisa melewati batas proses
+        batch = pickle.loads(pickle.dumps(offloaded.offload_pending(exclude_for=exclude_for)))
+        self.assertIsNone(offloaded.offload_pending())
+        self.assertEqual(offloaded.pending_count, 100)
+        offloaded.finish_offload(pickle.loads(pickle.dumps(score_offloaded(*batch))))
+        self.assertTrue(offloaded.flush())
+        self.assertEqual(offloaded.pending_count, 0)
+        self.assertEqual(inline.heap_size, offloaded.heap_size)
+        results = [[(a.user_id, b.user_id) for a, b, _ in self.drain(m, 2000.0)] for m in (inline, offloaded)]
+        self.assertEqual(results[0], results[1])
+
+    @unittest.skipIf(np is None, "numpy tidak terpasang")
+    def test_offload_ships_only_changed_rows(self):
+        inline, offloaded = self.make_offload_pair(lambda user_id: ())
+        offloaded.finish_offload(score_offloaded(*offloaded.offload_pending()))
+        for matchmaker in (inline, offloaded):
+            matchmaker.flush()
+            for user_id in range(0, 300, 7):
+                matchmaker.remove(user_id)
+            for entry in self.make_entries(400, seed=9)[300:]:
+                entry.enqueued_at += 0.5
+                matchmaker.submit(entry)
+        inline.flush()
+        replica, jobs, params = pickle.loads(pickle.dumps(offloaded.offload_pending()))
+        self.assertIsNotNone(replica[1])
+        self.assertLess(len(replica[2][1]), 200)
+        offloaded.finish_offload(score_offloaded(replica, jobs, params))
+        self.assertTrue(offloaded.flush())
+        self.assertEqual(inline.heap_size, offloaded.heap_size)
+        results = [[(a.user_id, b.user_id) for a, b, _ in self.drain(m, 2000.0)] for m in (inline, offloaded)]
+        self.assertEqual(results[0], results[1])
+
+    @unittest.skipIf(np is None, "numpy tidak terpasang")
+    def test_offload_resends_columns_after_replica_mismatch(self):
+        _, matchmaker = self.make_offload_pair(lambda user_id: ())
+        matchmaker.finish_offload(score_offloaded(*matchmaker.offload_pending()))
+        matchmaker.flush()
+        for entry in self.make_entries(350, seed=9)[300:]:
+            matchmaker.submit(entry)
+        # Worker baru (misal setelah crash) tidak punya replika yang menjadi dasar delta
+        with mock.patch.object(matchmaking, '_replica', None):
+            result = score_offloaded(*matchmaker.offload_pending())
+        self.assertIsNone(result)
+        matchmaker.finish_offload(result)
+        self.assertEqual(matchmaker.pending_count, 50)
+        self.assertTrue(matchmaker.flush())
+        for entry in self.make_entries(400, seed=9)[350:]:
+            matchmaker.submit(entry)
+        replica, _, _ = matchmaker.offload_pending()
+        self.assertIsNone(replica[1])
+
+    @unittest.skipIf(np is None, "numpy tidak terpasang")
+    def test_offload_skips_users_who_left(self):
+        _, matchmaker = self.make_offload_pair(lambda user_id: ())
+        batch = matchmaker.offload_pending()
+        result = score_offloaded(*batch)
+        left = {user_id for _, _, user_id, _, _, _ in result[0][:10]}
+        for user_id in left:
+            matchmaker.remove(user_id)
+        matchmaker.finish_offload(result)
+        self.assertTrue(matchmaker.flush())
+        self.assertEqual(matchmaker.pending_count, 0)
+        for a, b, _ in self.drain(matchmaker, 2000.0):
+            self.assertNotIn(a.user_id, left)
+            self.assertNotIn(b.user_id, left)
+
+    @unittest.skipIf(np is None, "numpy tidak terpasang")
+    def test_failed_offload_rescored_inline(self):
+        _, matchmaker = self.make_offload_pair(lambda user_id: ())
+        matchmaker.offload_pending()
+        matchmaker.finish_offload(None)
+        self.assertEqual(matchmaker.pending_count, 100)
+        self.assertTrue(matchmaker.flush())
+        self.assertEqual(matchmaker.coverage, 1.0)
+        paired = {entry.user_id for a, b, _ in self.drain(matchmaker, 2000.0) for entry in (a, b)}
+        self.assertGreater(len(paired & set(range(200, 300))), 50)
+
+    def test_heap_bounded_by_top_k(self):
+        matchmaker = Matchmaker(wait_bonus_per_sec=1.0, max_candidates=8)
+        entries = self.make_entries(400, seed=5)
+        for entry in entries:
+            matchmaker.submit(entry)
+        matchmaker.flush()
+        self.assertLessEqual(matchmaker.heap_size, len(entries) * 8)
+
+    def test_seed_window_limits_scoring(self):
+        flushed, seeded, windowed = (Matchmaker(wait_bonus_per_sec=1.0, max_candidates=8) for _ in range(3))
+        for entry in self.make_entries(400, seed=6):
+            flushed.submit(entry)
+        flushed.flush()
+        # Jendela selebar antrean sama dengan flush biasa
+        self.assertEqual(seeded.seed(self.make_entries(400, seed=6), window=400), 400)
+        self.assertEqual(flushed.heap_size, seeded.heap_size)
+        self.assertEqual(
+            [(a.user_id, b.user_id) for a, b, _ in self.drain(flushed, 2000.0)],
+            [(a.user_id, b.user_id) for a, b, _ in self.drain(seeded, 2000.0)],
+        )
+        windowed.seed(self.make_entries(400, seed=6), window=50)
+        self.assertLessEqual(windowed.pairs_scored, 400 * 50)
+        self.assertLessEqual(windowed.heap_size, 400 * 8 * 2)
+
+    def test_starved_entries_are_rescored(self):
+        # Tanpa filter semua pasangan layak, jadi semua harus terpasang walau heap hanya menyimpan satu kandidat
+        matchmaker = Matchmaker(threshold=0, wait_bonus_per_sec=0, max_candidates=1)
+        entries = [QueueEntry(user_id, karma=user_id, enqueued_at=1000.0 + user_id) for user_id in range(50)]
+        for entry in entries:
+            matchmaker.submit(entry)
+        pairs = self.drain(matchmaker, now=2000.0)
+        self.assertEqual(len(pairs), 25)
+        self.assertEqual(len(matchmaker), 0)
+
+    def test_excluded_pairs_are_not_rescored(self):
+        matchmaker = Matchmaker(threshold=0, wait_bonus_per_sec=0, max_candidates=1)
+        for user_id in range(3):
+            matchmaker.submit(QueueEntry(user_id, enqueued_at=1000.0 + user_id))
+        blocked = {frozenset((0, 1)), frozenset((0, 2))}
+        # 1 dan 2 sama-sama memilih 0; setelah keduanya ditolak, mereka dinilai ulang dan saling bertemu
+        pairs = self.drain(matchmaker, now=2000.0, is_excluded=lambda a, b: frozenset((a, b)) in blocked)
+        self.assertEqual([{a.user_id, b.user_id} for a, b, _ in pairs], [{1, 2}])
+        self.assertIn(0, matchmaker)
+        self.assertEqual(self.drain(matchmaker, now=2000.0), [])
+
+    def test_underfilled_entries_get_pairs_from_newcomers(self):
+        matchmaker = Matchmaker(threshold=0, wait_bonus_per_sec=0, max_candidates=1)
+        # 0 masuk sendirian, 1 menolak 0 lewat filter; bagi 2, 1 lebih cocok daripada 0
+        matchmaker.submit(QueueEntry(0, gender="Perempuan", karma=0, enqueued_at=1000.0))
+        matchmaker.flush()
+        matchmaker.submit(QueueEntry(1, use_filters=True, gender="Laki-laki", filter_gender='same', enqueued_at=1001.0))
+        matchmaker.submit(QueueEntry(2, gender="Laki-laki", enqueued_at=1002.0))
+        matchmaker.flush()
+        entry_a, entry_b, _ = matchmaker.pop_best_pair(lambda a, b: {a, b} == {1, 2}, now=2000.0)
+        self.assertEqual({entry_a.user_id, entry_b.user_id}, {0, 2})
+
+    def make_stale_matchmaker(self, pending: int) -> Matchmaker:
+        """Heap tanpa batas kandidat berisi semua pasangan, lalu 90% pengguna keluar tanpa pemadatan."""
+        rng = random.Random(6)
+
+        def entry(user_id):
+            return QueueEntry(user_id, gender=rng.choice(["Laki-laki", "Perempuan"]), age=rng.randint(18, 40),
+                              karma=rng.randint(50, 150), enqueued_at=1000.0 + user_id)
+
+        matchmaker = Matchmaker(max_candidates=None)
+        for user_id in range(600):
+            matchmaker.submit(entry(user_id))
+        matchmaker.flush()
+        for user_id in range(600):
+            if user_id % 10:
+                matchmaker.remove(user_id, compact=False)
+        matchmaker.flush()
+        for user_id in range(600, 600 + pending):
+            matchmaker.submit(entry(user_id))
+        return matchmaker
+
+    def run_pass(self, matchmaker: Matchmaker, budget: float, exclude_for=lambda user_id: ()) -> float:
+        """
+        Satu putaran seperti try_match_users (3/4 budget untuk flush); mengembalikan
+        waktu CPU putaran dalam detik. Deadline tetap memakai perf_counter seperti bot,
+        tapi jeda karena proses lain memakai CPU tidak dihitung sebagai kelebihan.
+        """
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        matchmaker.flush(exclude_for=exclude_for, deadline=started + budget * 0.75)
+        while matchmaker.pop_best_pair(deadline=started + budget) is not None:
+            pass
+        return time.thread_time() - cpu_started
+
+    def test_flush_stays_within_budget(self):
+        matchmaker = self.make_stale_matchmaker(pending=600)
+        self.assertLess(self.run_pass(matchmaker, budget=0.02), 0.021)
+        self.assertTrue(matchmaker.pending_count)
+
+    def test_stale_drain_stays_within_budget(self):
+        matchmaker = self.make_stale_matchmaker(pending=0)
+        self.assertLess(self.run_pass(matchmaker, budget=0.005), 0.006)
+        self.assertTrue(matchmaker.heap_size)
+
+    def test_passes_stay_within_budget_at_realistic_size(self):
+        budget = 0.02
+        entries = self.make_entries(2400, seed=8)
+        matchmaker = Matchmaker()
+        for entry in entries[:2000]:
+            matchmaker.submit(entry)
+        matchmaker.flush()
+        # Jeda GC bukan bagian dari putaran; objek hasil pengisian dibekukan agar yang diukur hanya matchmaker
+        gc.collect()
+        gc.freeze()
+        self.addCleanup(gc.unfreeze)
+        passes = []
+        for start in range(2000, 2400, 4):
+            for entry in entries[start:start + 4]:
+                matchmaker.submit(entry)
+            passes.append(self.run_pass(matchmaker, budget))
+        self.assertGreater(sum(p >= budget * 0.75 for p in passes), 10)
+        # Kelebihan yang wajar hanya sisa satu interval pembuangan entri basi
+        self.assertLess(max(passes), budget + 0.001)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# ======================================================
+# updates.py - Pemrosesan update paralel dengan urutan per user untuk bot.py
+# ======================================================
+import asyncio
+from typing import Any, Awaitable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Memproses update dari user berbeda secara paralel, tetapi update dari
+    satu user tetap berurutan. Setiap user dipetakan ke salah satu dari
+    `n_shards` lock (user_id % n_shards), jadi jumlah lock tetap berapa pun
+    jumlah user; dua user di shard yang sama hanya saling menunggu.
+
+    Lock shard diambil *sebelum* slot konkurensi, sehingga satu user yang
+    mengirim banyak update sekaligus tidak menghabiskan slot milik user lain.
+    State ConversationHandler tetap konsisten karena update milik satu user
+    tidak pernah berjalan bersamaan.
+    """
+
+    def __init__(self, max_concurrent_updates: int, n_shards: int = 256):
+        super().__init__(max_concurrent_updates)
+        self._locks = [asyncio.Lock() for _ in range(n_shards)]
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        async with self._locks[key % len(self._locks)]:
+            await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass